@@ -0,0 +1,141 @@
+"""Content encodings: negotiation, precompressed static files and compression helpers.
+
+Static files are compressed once, ahead of time (scripts/precompress_static.py,
+run when the Docker image is built), into `.br` / `.gz` files next to the
+originals. PrecompressedStaticFiles serves those to clients that accept them.
+Brotli and gzip are both supported; gzip only if `brotli` cannot be imported.
+"""
+
+from __future__ import annotations
+
+import gzip
+import mimetypes
+import os
+from pathlib import Path
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:  # A dependency, but gzip still works without it.
+    brotli = None
+
+# Supported encodings, preferred first, and the suffix of precompressed files.
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"} if brotli is not None else {"gzip": ".gz"}
+# Media types worth compressing (images, fonts and archives already are).
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "application/pdf",
+    "application/xml",
+    "image/svg+xml",
+)
+# Smaller bodies gain too little to pay for the encoding headers.
+MINIMUM_SIZE = 500
+
+
+def is_compressible(media_type: str | None) -> bool:
+    return media_type is not None and media_type.lower().startswith(COMPRESSIBLE_TYPES)
+
+
+def accepted_encodings(accept_encoding: str | None) -> list[str]:
+    """Supported encodings allowed by an Accept-Encoding header, preferred first."""
+    accepted = set()
+    for coding in (accept_encoding or "").split(","):
+        name, *params = (part.strip() for part in coding.split(";"))
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(name.lower())
+    return [encoding for encoding in ENCODING_SUFFIXES if encoding in accepted]
+
+
+def compress(data: bytes, encoding: str, fast: bool = False) -> bytes:
+    """Encode `data`, at the best compression level unless `fast` (for responses)."""
+    if encoding == "br":
+        return brotli.compress(data, quality=5 if fast else 11)
+    if encoding == "gzip":
+        # mtime=0: the same input always gives the same output.
+        return gzip.compress(data, compresslevel=6 if fast else 9, mtime=0)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def precompress_directory(directory: str | os.PathLike, min_size: int = 1024) -> list[Path]:
+    """Write a compressed copy of each compressible file (recursively) next to it.
+
+    Copies that are up to date (not older than their original) are kept.
+    Copies that would not save at least a tenth of the size are not written.
+    Returns the paths of the files written.
+    """
+    written = []
+    suffixes = set(ENCODING_SUFFIXES.values())
+    for path in sorted(Path(directory).rglob("*")):
+        if not path.is_file() or path.suffix in suffixes:
+            continue
+        media_type, _ = mimetypes.guess_type(path.name)
+        stat_result = path.stat()
+        if not is_compressible(media_type) or stat_result.st_size < min_size:
+            continue
+        data = None
+        for encoding, suffix in ENCODING_SUFFIXES.items():
+            target = path.with_name(path.name + suffix)
+            if target.exists() and target.stat().st_mtime >= stat_result.st_mtime:
+                continue
+            data = path.read_bytes() if data is None else data
+            compressed = compress(data, encoding)
+            if len(compressed) > len(data) * 0.9:
+                continue
+            target.write_bytes(compressed)
+            written.append(target)
+    return written
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles sending the precompressed copy of a file when the client accepts it."""
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        response = await super().get_response(path, scope)
+        if response.status_code != 200 or not isinstance(response, FileResponse):
+            return response
+        if not is_compressible(response.media_type):
+            return response
+
+        copies = {}
+        for encoding, suffix in ENCODING_SUFFIXES.items():
+            try:
+                stat_result = os.stat(f"{response.path}{suffix}")
+            except FileNotFoundError:
+                continue
+            if response.stat_result and stat_result.st_mtime < response.stat_result.st_mtime:
+                continue  # Outdated copy (the original was edited since).
+            copies[encoding] = stat_result
+        if not copies:
+            return response  # Left to GZipMiddleware.
+
+        response.headers["Vary"] = "Accept-Encoding"
+        request_headers = Headers(scope=scope)
+        if "range" in request_headers:
+            return response
+        for encoding in accepted_encodings(request_headers.get("accept-encoding")):
+            if encoding not in copies:
+                continue
+            compressed = FileResponse(
+                f"{response.path}{ENCODING_SUFFIXES[encoding]}",
+                stat_result=copies[encoding],
+                media_type=response.media_type,
+                headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+            )
+            if self.is_not_modified(compressed.headers, request_headers):
+                return NotModifiedResponse(compressed.headers)
+            return compressed
+        return response
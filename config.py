@@ -20,6 +20,47 @@ class Settings(BaseSettings):
     post_path_format: str = "/%(year)d/%(month)02d/%(slug)s"
     posts_per_page: int = 10
     disqus_shortname: str = "thegrandlocus"
+    # Rendered Markdown kept in memory (number of entries), and an optional
+    # directory for a durable render cache tier (e.g. /tmp/render-cache on Cloud Run).
+    render_cache_size: int = 256
+    render_cache_dir: str = ""
+    # Seconds that values derived from the posts (counts...) are cached. Writes
+    # clear them at once on the instance that handled the write.
+    post_cache_ttl: int = 300
+    # Keep the metadata of all posts in memory (services.post_index), reloaded
+    # every post_index_refresh seconds to pick up writes from other instances.
+    post_index_enabled: bool = False
+    post_index_refresh: int = 300
+    # Seconds that browsers and proxies may reuse an image from /img/ without
+    # revalidating it (its ETag is the Cloud Storage generation).
+    image_cache_max_age: int = 30 * 24 * 3600
+    # Optional on-instance cache of the images (e.g. /tmp/image-cache on Cloud
+    # Run), bounded in bytes, and how long image metadata is reused. Resized
+    # variants (/img/...?width=640) are only made when the cache is enabled.
+    image_cache_dir: str = ""
+    image_cache_max_bytes: int = 256 * 1024 * 1024
+    image_metadata_ttl: int = 300
+    # Serve images from this local directory instead of the bucket (development).
+    image_source_dir: str = ""
+    # Public pages served from memory to anonymous visitors: fresh for
+    # page_cache_ttl seconds (0 disables the cache), then served for
+    # page_cache_stale_ttl more seconds while being refreshed in the background.
+    page_cache_ttl: int = 60
+    page_cache_stale_ttl: int = 600
+    page_cache_size: int = 512
+    # File of the full-text search index (services.search), e.g.
+    # /tmp/search-index.bin on Cloud Run. Empty disables /search.
+    search_index_path: str = ""
+    # Related posts listed on each post page (0 disables them), ranked when
+    # the application starts (services.related).
+    related_posts: int = 5
+    # The search index and the related posts pick up the writes of other
+    # instances every analysis_refresh seconds (services.analysis).
+    analysis_refresh: int = 300
+    # Store the analyzed posts in Datastore (kind PostTerms), so that starting
+    # an instance reads them instead of tokenizing every post. Saving a post
+    # then writes its analysis too.
+    analysis_stored: bool = False
 
     class Config:
         env_file = ".env"
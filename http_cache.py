@@ -0,0 +1,125 @@
+"""HTTP validators: ETag / Last-Modified headers and 304 Not Modified answers."""
+
+from __future__ import annotations
+
+import datetime
+import hashlib
+from email.utils import format_datetime, parsedate_to_datetime
+from pathlib import Path
+
+from fastapi import Request, Response
+
+# HTML pages are cached by browsers but revalidated on every use.
+REVALIDATE = "no-cache"
+
+
+def template_version(directory: str | Path, *extra: object) -> str:
+    """Digest of every template under `directory` and of `extra` values.
+
+    Part of the ETags of rendered pages, so that deploying new templates (or a
+    new Markdown setup, passed in `extra`) changes every ETag.
+    """
+    digest = hashlib.sha256()
+    for path in sorted(Path(directory).rglob("*")):
+        if path.is_file():
+            digest.update(str(path.relative_to(directory)).encode())
+            digest.update(path.read_bytes())
+    for value in extra:
+        digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+
+def make_etag(*parts: object) -> str:
+    """Strong ETag (quoted) derived from `parts`."""
+    raw = "\x1f".join(repr(part) for part in parts)
+    return '"' + hashlib.sha256(raw.encode()).hexdigest()[:32] + '"'
+
+
+def http_date(value: datetime.datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.UTC)  # Assume UTC.
+    return format_datetime(value.astimezone(datetime.UTC), usegmt=True)
+
+
+def is_not_modified(
+    request: Request, etag: str, last_modified: datetime.datetime | None = None
+) -> bool:
+    """True if the client copy is current (RFC 9110 section 13.2.2).
+
+    If-None-Match takes precedence; If-Modified-Since is only looked at
+    without it, and compared at the one-second resolution of HTTP dates.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison, as specified for If-None-Match.
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=datetime.UTC)
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=datetime.UTC)
+    return last_modified.replace(microsecond=0) <= since
+
+
+class RangeNotSatisfiable(Exception):
+    """The Range header of the request selects no byte of the resource."""
+
+
+def parse_byte_range(header: str, size: int) -> tuple[int, int] | None:
+    """Parse a Range header into (first byte, last byte), both inclusive.
+
+    Returns None when the header should be ignored and the whole resource
+    sent (other units, several ranges, malformed), and raises
+    RangeNotSatisfiable when the range starts past the end of the resource.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # Suffix range: the last N bytes.
+            start, end = max(size - int(last), 0), size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    if start < 0 or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def validator_headers(etag: str, last_modified: datetime.datetime | None = None) -> dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def not_modified_response(
+    request: Request, etag: str, last_modified: datetime.datetime | None = None
+) -> Response | None:
+    """A 304 response if the client copy is current, None otherwise."""
+    if not is_not_modified(request, etag, last_modified):
+        return None
+    return Response(status_code=304, headers=validator_headers(etag, last_modified))
+
+
+def set_validators(
+    response: Response, etag: str, last_modified: datetime.datetime | None = None
+) -> Response:
+    """Add the validators (and a revalidation policy) to a full response."""
+    response.headers.update(validator_headers(etag, last_modified))
+    return response
@@ -1,16 +1,33 @@
+import datetime
+import functools
 import logging
-import mimetypes
+from contextlib import asynccontextmanager
+from urllib.parse import quote
 
-from fastapi import Depends, FastAPI, HTTPException, Request, Response
-from fastapi.responses import FileResponse, HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from google.cloud import datastore, storage
+from google.cloud import datastore
+from starlette.middleware.gzip import GZipMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.responses import RedirectResponse
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 
+from compression import MINIMUM_SIZE
 from config import settings
+from http_cache import (
+    RangeNotSatisfiable,
+    http_date,
+    is_not_modified,
+    make_etag,
+    not_modified_response,
+    parse_byte_range,
+    set_validators,
+    template_version,
+)
+from models.blog_post import RENDER_FINGERPRINT
+from page_cache import PageCacheMiddleware, page_cache
 from routes.admin_fastapi import admin_router, get_current_user
 from routes.public import router as public_router
 from schemas import PostDetails, PostList, PostSummary
@@ -21,17 +38,124 @@ from security import (
     validate_image_blob_path,
 )
 from services import blog as blog_service
-from services.datastore import get_datastore_client
+from services.analysis import post_analyses
+from services.cache import TTLCache
+from services.datastore import (
+    close_datastore_client,
+    get_datastore_client,
+    ping_datastore,
+    warm_up_datastore_client,
+)
+from services.dependencies import DependencyTracker, route_path
+from services.feeds import (
+    ATOM_MEDIA_TYPE,
+    FEED_SIZE,
+    JSON_MEDIA_TYPE,
+    base_url,
+    feed_context,
+    lastpost_json,
+)
 from services.google_auth import oauth
+from services.images import (
+    GCSImageSource,
+    ImageDiskCache,
+    ImageSource,
+    LocalImageSource,
+    choose_variant,
+    is_negotiated,
+    supported_formats,
+)
+from services.pagination import InvalidCursor, PageCursor, PostPage
+from services.post_index import post_index
+from services.related import related_posts
+from services.render_cache import render_cache
+from services.search import search_index
+from services.sitemap import SITEMAP_MEDIA_TYPE, sitemap_documents, sitemap_urls
+from services.storage import IMAGE_BUCKET, get_storage_client
+from static_assets import FingerprintedStaticFiles, add_static_url, static_manifest
 
 logger = logging.getLogger(__name__)
 
 # Stdout is always ingested by Cloud Logging; `logger.info` is often dropped (root level WARNING).
 print(f"services.blog loaded from {blog_service.__file__}", flush=True)
 
-app = FastAPI()
 
-# Add middleware for proxy headers and sessions.
+def load_post_index() -> None:
+    try:
+        post_index.load(get_datastore_client())
+    except Exception:
+        # Routes query Datastore until the background refresh succeeds.
+        logger.warning("Post index could not be loaded", exc_info=True)
+    site_dependencies.rebuild()
+
+
+def posts_analyzed() -> None:
+    """Called when the search index and the related posts changed (see post_analyses)."""
+    # Post pages cached so far show other related posts (or none).
+    site_dependencies.rebuild()
+    page_cache.clear()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the shared Datastore client (and its gRPC channel) before serving.
+    await run_in_threadpool(warm_up_datastore_client)
+    if settings.image_cache_dir and not supported_formats():
+        # Pillow is a dependency: without it, /img serves the originals only.
+        logger.warning("Pillow is not installed: image variants (?width=) are disabled")
+    if settings.post_index_enabled:
+        await run_in_threadpool(load_post_index)
+        post_index.start_refresh(get_datastore_client, settings.post_index_refresh)
+    if settings.search_index_path:
+        # Searches use the index of the previous run until the build completes.
+        search_index.load()
+    if settings.search_index_path or settings.related_posts > 0:
+        post_analyses.start_refresh(
+            get_datastore_client, settings.analysis_refresh, on_change=posts_analyzed
+        )
+    yield
+    post_analyses.stop_refresh()
+    post_index.stop_refresh()
+    close_datastore_client()
+
+
+app = FastAPI(lifespan=lifespan)
+
+render_cache.configure(
+    max_entries=settings.render_cache_size,
+    directory=settings.render_cache_dir or None,
+)
+
+search_index.configure(settings.search_index_path or None)
+if settings.search_index_path:
+    post_analyses.subscribe(search_index)
+related_posts.configure(settings.related_posts)
+if settings.related_posts > 0:
+    post_analyses.subscribe(related_posts)
+post_analyses.configure(stored=settings.analysis_stored)
+blog_service.on_post_change(post_analyses.apply_change)
+
+page_cache.configure(
+    ttl=settings.page_cache_ttl,
+    stale_ttl=settings.page_cache_stale_ttl,
+    max_entries=settings.page_cache_size,
+)
+site_dependencies = DependencyTracker(post_index, settings, related_posts)
+
+
+@blog_service.on_post_change
+def invalidate_pages(post_id, post) -> None:
+    """Drop the cached pages that show the post (all of them without the post index)."""
+    affected = site_dependencies.post_changed(post_id, post)
+    if affected is None:
+        page_cache.clear()
+    else:
+        page_cache.invalidate({route_path(path) for path in affected})
+
+
+# Add middleware for proxy headers and sessions. The page cache is added first
+# so that it runs inside SessionMiddleware, and sees who is signed in.
+app.add_middleware(PageCacheMiddleware)
 app.add_middleware(
     ProxyHeadersMiddleware,
     trusted_hosts=trusted_proxy_hosts_from_setting(settings.trusted_proxy_hosts),
@@ -43,59 +167,123 @@ app.add_middleware(
     same_site="lax",
     https_only=is_production_runtime(),
 )
+# Outermost: compresses the responses that are not already (precompressed
+# static files and cached pages are), except images and partial content.
+app.add_middleware(GZipMiddleware, minimum_size=MINIMUM_SIZE, compresslevel=6)
 
 app.include_router(admin_router, prefix="/admin")
 app.include_router(public_router)
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+app.mount("/static", FingerprintedStaticFiles(directory="static"), name="static")
+templates = add_static_url(Jinja2Templates(directory="templates"))
+
+# Changes with anything that changes the HTML of a page but not the posts.
+PAGE_VERSION = template_version(
+    "templates",
+    RENDER_FINGERPRINT,
+    settings.url_prefix,
+    settings.host,
+    settings.date_format,
+    settings.copyright_year,
+    settings.disqus_shortname,
+    static_manifest.version,
+)
+
+
+def post_validators(
+    post, neighbours: tuple, related: list = ()
+) -> tuple[str, datetime.datetime | None]:
+    """ETag and Last-Modified of a post page (post is a BlogPost or IndexedPost).
+
+    The page links to its neighbours (see blog_service.get_neighbours) and
+    related posts: a new neighbour, or a change in the related posts, changes
+    the ETag.
+    """
+    last_modified = post.updated or post.published
+    links = [neighbour.path if neighbour else None for neighbour in neighbours]
+    links += [(other.path, other.title) for other in related]
+    etag = make_etag(PAGE_VERSION, "post", post.key.id_or_name, last_modified, *links)
+    return etag, last_modified
 
 
-def get_storage_client():
-    return storage.Client()
+def listing_validators(state: tuple) -> tuple[str, datetime.datetime | None]:
+    """ETag and Last-Modified of a listing page (see blog_service.get_listing_state)."""
+    newest_published, newest_updated, _count = state
+    dates = [date for date in (newest_published, newest_updated) if date is not None]
+    return make_etag(PAGE_VERSION, "listing", state), max(dates, default=None)
+
+
+def page_validators(page: PostPage) -> tuple[str, datetime.datetime | None]:
+    """ETag and Last-Modified of a listing page, from the posts it shows and its links.
+
+    For when the post index is not loaded (listing_validators needs it): the
+    keys and dates of the page are read with projection queries, and its
+    posts only when the client copy is stale.
+    """
+    dates = [post.updated or post.published for post in page.posts]
+    rows = [(post.key.id_or_name, date) for post, date in zip(page.posts, dates, strict=True)]
+    links = (page.next_cursor, page.prev_cursor, page.prev_is_first)
+    return make_etag(PAGE_VERSION, "page", rows, *links), max(dates, default=None)
+
+
+def parse_page_cursor(cursor: str | None) -> PageCursor | None:
+    """Decode a ?cursor= query parameter (400 if it was tampered with)."""
+    if not cursor:
+        return None
+    try:
+        return PageCursor.decode(cursor)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from None
 
 
 @app.get("/", response_class=HTMLResponse)
 def read_root(
     request: Request,
     start: int = 0,
+    cursor: str | None = None,
     db: datastore.Client = Depends(get_datastore_client),
 ):
-    posts, total_posts = blog_service.get_posts(
-        db, offset=start, limit=settings.posts_per_page, with_total=True
+    page_cursor = parse_page_cursor(cursor)
+    state = blog_service.get_listing_state()
+    if state is not None:
+        etag, last_modified = listing_validators(state)
+        if (not_modified := not_modified_response(request, etag, last_modified)) is not None:
+            return not_modified
+
+    # `start` is the legacy offset parameter: old links keep working and lead
+    # to cursor-based links from there.
+    page = blog_service.get_posts_page(
+        db,
+        cursor=page_cursor,
+        limit=settings.posts_per_page,
+        offset=max(start, 0),
+        read_posts=False,
     )
+    if state is None:
+        etag, last_modified = page_validators(page)
+        if (not_modified := not_modified_response(request, etag, last_modified)) is not None:
+            return not_modified
+    page = blog_service.read_page_posts(page, db)
 
-    next_page_start = start + settings.posts_per_page
-    if next_page_start < total_posts:
-        next_page = f"/?start={next_page_start}"
-    else:
-        next_page = None
-
-    if start > 0:
-        prev_page_start = start - settings.posts_per_page
-        if prev_page_start <= 0:
-            prev_page = "/"
-        else:
-            prev_page = f"/?start={prev_page_start}"
-
-    else:
-        prev_page = None
-
-    return templates.TemplateResponse(
+    response = templates.TemplateResponse(
         request,
         "listing.html",
         {
-            "posts": posts,
+            "posts": page.posts,
             "settings": settings,
-            "prev_page": prev_page,
-            "next_page": next_page,
+            "prev_page": page.prev_url("/"),
+            "next_page": page.next_url("/"),
             "copyright_year": settings.copyright_year,
         },
     )
+    return set_validators(response, etag, last_modified)
 
 
 @app.get("/posts", response_model=PostList)
-def list_posts_api(db: datastore.Client = Depends(get_datastore_client)):
-    posts = blog_service.get_posts(db)
+def list_posts_api(
+    cursor: str | None = None,
+    db: datastore.Client = Depends(get_datastore_client),
+):
+    page = blog_service.get_posts_page(db, cursor=parse_page_cursor(cursor), limit=20)
     results = [
         PostSummary(
             key=post.key.id_or_name,
@@ -103,9 +291,9 @@ def list_posts_api(db: datastore.Client = Depends(get_datastore_client)):
             published=post.published,
             path=post.path,
         )
-        for post in posts
+        for post in page.posts
     ]
-    return {"posts": results}
+    return {"posts": results, "next_cursor": page.next_cursor}
 
 
 @app.get("/posts/{post_id}", response_model=PostDetails)
@@ -132,26 +320,111 @@ def get_post(post_id: str, db: datastore.Client = Depends(get_datastore_client))
     )
 
 
-@app.get("/img/{image_path:path}")
-def get_image(image_path: str, storage_client: storage.Client = Depends(get_storage_client)):
-    validate_image_blob_path(image_path)
-    bucket = storage_client.bucket("thegrandlocus_bucket")
-    blob = bucket.blob(image_path)
+@functools.cache
+def get_image_source() -> ImageSource:
+    """FastAPI dependency: the bucket, or the image_source_dir stand-in when set."""
+    if settings.image_source_dir:
+        return LocalImageSource(settings.image_source_dir)
+    return GCSImageSource(IMAGE_BUCKET, get_storage_client)
 
-    if not blob.exists():
-        raise HTTPException(status_code=404, detail="Image not found")
 
+@functools.cache
+def get_image_cache() -> ImageDiskCache | None:
+    """FastAPI dependency: the disk cache, or None when image_cache_dir is not set."""
+    if not settings.image_cache_dir:
+        return None
+    return ImageDiskCache(
+        settings.image_cache_dir,
+        max_bytes=settings.image_cache_max_bytes,
+        metadata_ttl=settings.image_metadata_ttl,
+    )
+
+
+class CachedFileResponse(FileResponse):
+    """A file of the image cache, pinned (kept on disk) until the response is sent."""
+
+    def __init__(self, cache: ImageDiskCache, path, **kwargs) -> None:
+        super().__init__(path, **kwargs)
+        self.cache = cache
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.cache.release(self.path)
+
+
+@app.get("/img/{image_path:path}")
+def get_image(
+    request: Request,
+    image_path: str,
+    width: int | None = None,
+    image_format: str | None = Query(None, alias="format"),
+    source: ImageSource = Depends(get_image_source),
+    cache: ImageDiskCache | None = Depends(get_image_cache),
+):
+    validate_image_blob_path(image_path, width, image_format)
     try:
-        image_data = blob.download_as_bytes()
-        mime_type, _ = mimetypes.guess_type(image_path)
-        if mime_type is None:
-            mime_type = "application/octet-stream"
-        return Response(content=image_data, media_type=mime_type)
-    except HTTPException:
-        raise
+        image = cache.stat(source, image_path) if cache is not None else source.stat(image_path)
     except Exception:
         logger.exception("Failed to serve image from storage")
         raise HTTPException(status_code=500, detail="Could not load image") from None
+    if image is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    # Resized or re-encoded variants are made once and kept in the disk cache.
+    variant = None
+    if cache is not None:
+        variant = choose_variant(image, width, image_format, request.headers.get("accept"))
+    etag = variant.etag(image) if variant is not None else image.etag
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.image_cache_max_age}",
+        "Accept-Ranges": "bytes",
+    }
+    if is_negotiated(width, image_format):
+        headers["Vary"] = "Accept"
+    if image.updated is not None:
+        headers["Last-Modified"] = http_date(image.updated)
+    if is_not_modified(request, etag, image.updated):
+        return Response(status_code=304, headers=headers)
+
+    if variant is not None:
+        variant_path = cache.fetch(source, image, variant, pin=True)
+        if variant_path is not None:
+            return CachedFileResponse(
+                cache, variant_path, media_type=variant.media_type, headers=headers
+            )
+        # Fall back to the original, with its own validator.
+        headers["ETag"] = etag = image.etag
+
+    cached_path = cache.fetch(source, image, pin=True) if cache is not None else None
+    if cached_path is not None:
+        # Sent with sendfile; FileResponse also answers Range requests.
+        return CachedFileResponse(cache, cached_path, media_type=image.media_type, headers=headers)
+
+    size = image.size
+    start, end, status_code = 0, size - 1, 200
+    range_header = request.headers.get("range")
+    # If-Range: only send a part of the version the client already has.
+    if range_header and request.headers.get("if-range", etag) == etag:
+        try:
+            byte_range = parse_byte_range(range_header, size)
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    return StreamingResponse(
+        source.iter_bytes(image, start, end),
+        status_code=status_code,
+        media_type=image.media_type,
+        headers=headers,
+    )
 
 
 @app.get("/login")
@@ -213,40 +486,180 @@ def get_post_by_path(
     db: datastore.Client = Depends(get_datastore_client),
 ):
     path = f"/{year}/{month:02d}/{slug.lower()}"
-    post = blog_service.get_post_by_path(path, db)
+    # Validators come from the post metadata: a 304 reads no body and renders nothing.
+    meta = blog_service.get_post_meta_by_path(path, db)
+    if meta is not None and blog_service.is_post_visible_to_public(meta):
+        neighbours = blog_service.get_neighbours(meta, db)
+        related = related_posts.get(meta.key.id_or_name)
+        not_modified = not_modified_response(request, *post_validators(meta, neighbours, related))
+        if not_modified is not None:
+            return not_modified
+
+    post = None
+    if meta is not None:
+        post = blog_service.get_post_by_id(meta.key.id_or_name, db)
+    if post is None or post.path != path:
+        post = blog_service.get_post_by_path(path, db)
 
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     if not blog_service.is_post_visible_to_public(post):
         raise HTTPException(status_code=404, detail="Post not found")
 
-    return templates.TemplateResponse(
+    older, newer = neighbours = blog_service.get_neighbours(post, db)
+    related = related_posts.get(post.key.id_or_name)
+    response = templates.TemplateResponse(
         request,
         "post.html",
         {
             "post": post,
             "path": post.path,
+            "prev": older,
+            "next": newer,
+            "related": related,
             "settings": settings,
             "copyright_year": settings.copyright_year,
         },
     )
+    return set_validators(response, *post_validators(post, neighbours, related))
 
 
 @app.get("/tag/{tag}")
 def get_posts_by_tag(
-    request: Request, tag: str, db: datastore.Client = Depends(get_datastore_client)
+    request: Request,
+    tag: str,
+    cursor: str | None = None,
+    db: datastore.Client = Depends(get_datastore_client),
 ):
-    posts = blog_service.get_posts_by_tag(tag, db)
-    return templates.TemplateResponse(
+    page_cursor = parse_page_cursor(cursor)
+    state = blog_service.get_listing_state(tag)
+    if state is not None:
+        etag, last_modified = listing_validators(state)
+        if (not_modified := not_modified_response(request, etag, last_modified)) is not None:
+            return not_modified
+
+    page = blog_service.get_posts_page(
+        db,
+        cursor=page_cursor,
+        limit=settings.posts_per_page,
+        tag=tag,
+        read_posts=False,
+    )
+    if state is None:
+        etag, last_modified = page_validators(page)
+        if (not_modified := not_modified_response(request, etag, last_modified)) is not None:
+            return not_modified
+    page = blog_service.read_page_posts(page, db)
+    base_url = f"/tag/{quote(tag)}"
+    response = templates.TemplateResponse(
         request,
         "listing.html",
         {
-            "posts": posts,
+            "posts": page.posts,
             "title": f"Posts tagged with '{tag}'",
             "settings": settings,
+            "prev_page": page.prev_url(base_url),
+            "next_page": page.next_url(base_url),
             "copyright_year": settings.copyright_year,
         },
     )
+    return set_validators(response, etag, last_modified)
+
+
+# Rendered feeds and sitemaps by listing state (which a publication changes).
+# A post change clears them; without the post index the state is unknown
+# (None), and a scheduled post reaches them when they expire.
+_feeds = TTLCache(ttl=settings.post_cache_ttl, max_entries=8)
+blog_service.on_post_change(_feeds.clear)
+_sitemaps = TTLCache(ttl=settings.post_cache_ttl, max_entries=2)
+blog_service.on_post_change(_sitemaps.clear)
+
+# A rendered document: body, ETag and Last-Modified.
+Document = tuple[bytes, str, datetime.datetime | None]
+
+
+def get_feed(name: str, db: datastore.Client) -> Document:
+    """A feed: "feed.xml" or "lastpost.json"."""
+
+    def render() -> Document:
+        posts = blog_service.get_posts(db, limit=FEED_SIZE)
+        if name == "lastpost.json":
+            posts = posts[:1]
+            body = lastpost_json(posts[0] if posts else None, settings)
+        else:
+            body = templates.get_template("feed.xml").render(feed_context(posts, settings))
+        body = body.encode()
+        dates = [post.updated or post.published for post in posts]
+        return body, make_etag(PAGE_VERSION, name, body), max(dates, default=None)
+
+    return _feeds.get_or_compute((name, blog_service.get_listing_state()), render)
+
+
+def get_sitemaps(db: datastore.Client) -> list[Document]:
+    """Documents of the sitemap: /sitemap.xml, then its parts if it is an index."""
+
+    def render() -> list[Document]:
+        posts = blog_service.list_post_dates(db)
+        last_modified = max((post.updated or post.published for post in posts), default=None)
+        documents = sitemap_documents(sitemap_urls(posts, base_url(settings)), base_url(settings))
+        return [
+            (body.encode(), make_etag(PAGE_VERSION, "sitemap", body), last_modified)
+            for body in documents
+        ]
+
+    return _sitemaps.get_or_compute(blog_service.get_listing_state(), render)
+
+
+def document_response(request: Request, document: Document, media_type: str):
+    body, etag, last_modified = document
+    if (not_modified := not_modified_response(request, etag, last_modified)) is not None:
+        return not_modified
+    return set_validators(Response(body, media_type=media_type), etag, last_modified)
+
+
+@app.get("/feed.xml", include_in_schema=False)
+def atom_feed(request: Request, db: datastore.Client = Depends(get_datastore_client)):
+    """Atom feed of the latest posts, with their full content."""
+    return document_response(request, get_feed("feed.xml", db), ATOM_MEDIA_TYPE)
+
+
+@app.get("/lastpost.json", include_in_schema=False)
+def lastpost(request: Request, db: datastore.Client = Depends(get_datastore_client)):
+    """The latest post (title, summary and tags), for embedding in other sites."""
+    return document_response(request, get_feed("lastpost.json", db), JSON_MEDIA_TYPE)
+
+
+@app.get("/sitemap.xml", include_in_schema=False)
+def sitemap(request: Request, db: datastore.Client = Depends(get_datastore_client)):
+    """Sitemap of the public pages (or the index of its parts, on large sites)."""
+    return document_response(request, get_sitemaps(db)[0], SITEMAP_MEDIA_TYPE)
+
+
+@app.get("/sitemap-{number:int}.xml", include_in_schema=False)
+def sitemap_part(
+    request: Request, number: int, db: datastore.Client = Depends(get_datastore_client)
+):
+    documents = get_sitemaps(db)
+    if not 1 <= number < len(documents):
+        raise HTTPException(status_code=404, detail="Sitemap not found")
+    return document_response(request, documents[number], SITEMAP_MEDIA_TYPE)
+
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness probe: the process is up (no backend call)."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz", include_in_schema=False)
+def readyz(db: datastore.Client = Depends(get_datastore_client)):
+    """Readiness probe: the shared Datastore channel answers a query."""
+    try:
+        ping_datastore(db)
+    except Exception:
+        logger.warning("Readiness check failed", exc_info=True)
+        return JSONResponse({"status": "unavailable"}, status_code=503)
+    return {"status": "ok"}
 
 
 @app.get("/favicon.ico", include_in_schema=False)
@@ -1,12 +1,42 @@
 import datetime
 import re
+from collections.abc import Iterator
 
 import markdown
 from google.cloud import datastore
 from markdown.extensions import Extension
 from markdown.preprocessors import Preprocessor
 
-from utils import HTMLWordTruncator, slugify
+from models.markdown_pool import MarkdownPool, cached_html_formatter
+from services.render_cache import body_digest, render_cache
+from utils import VOID, HTMLWordTruncator, count_html_words, slugify
+
+SUMMARY_EXTENSIONS = ["md_in_html"]
+SUMMARY_MAX_WORDS = 180
+
+RENDERED_EXTENSIONS = ["fenced_code", "codehilite", "tables", "attr_list", "md_in_html"]
+RENDERED_EXTENSION_CONFIGS = {
+    "codehilite": {
+        "linenums": False,
+        "css_class": "codehilite",
+        "guess_lang": False,
+    }
+}
+
+# Identifies the Markdown setup in render cache keys. Changes to the extensions
+# or their configuration are picked up automatically; bump RENDER_VERSION when
+# changing SourceCodePreprocessor or the summary post-processing.
+RENDER_VERSION = 1
+RENDER_FINGERPRINT = repr(
+    (
+        RENDER_VERSION,
+        markdown.__version__,
+        SUMMARY_EXTENSIONS,
+        SUMMARY_MAX_WORDS,
+        RENDERED_EXTENSIONS,
+        sorted((k, sorted(v.items())) for k, v in RENDERED_EXTENSION_CONFIGS.items()),
+    )
+)
 
 
 class SourceCodePreprocessor(Preprocessor):
@@ -42,6 +72,73 @@ class SourceCodeExtension(Extension):
         md.preprocessors.register(SourceCodePreprocessor(md), "sourcecode", 175)
 
 
+_BLANK_LINE_RE = re.compile(r"\n[ \t]*\n")
+_REFERENCE_RE = re.compile(r"^ {0,3}\[[^\]]+\]:.*$", re.MULTILINE)
+# Lines that may belong to a list, a blockquote or an indented block, which
+# can all continue past a blank line.
+_CONTINUABLE_RE = re.compile(r"^(?:[ \t]|>|[*+-][ \t]|\d+\.[ \t])", re.MULTILINE)
+_TAG_RE = re.compile(r"<(/?)([A-Za-z][A-Za-z0-9]*)\b[^>]*?(/?)>")
+
+
+def _html_depth(block: str) -> int:
+    """Net number of raw HTML elements opened (but not closed) in a block."""
+    depth = 0
+    for closing, tag, self_closing in _TAG_RE.findall(block):
+        if tag.lower() in VOID or self_closing:
+            continue
+        depth += -1 if closing else 1
+    return depth
+
+
+def summary_chunks(body: str) -> Iterator[str]:
+    """Split a post body into chunks of Markdown that convert independently.
+
+    Chunks are cut at blank lines between plain top-level blocks only (never
+    inside lists, blockquotes, indented blocks or raw HTML, nor right after a
+    block with HTML, which may be followed by an extra newline), and reference
+    definitions are repeated in every chunk, so that joining the converted
+    chunks with newlines gives the same HTML as converting the whole body.
+    """
+    text = (body or "").replace("\r\n", "\n").replace("\r", "\n")
+    references = "\n".join(_REFERENCE_RE.findall(text))
+    suffix = f"\n\n{references}" if references else ""
+
+    chunk: list[str] = []
+    depth = 0
+    for block in _BLANK_LINE_RE.split(text):
+        if not block.strip():
+            continue
+        if (
+            chunk
+            and depth == 0
+            and not _CONTINUABLE_RE.search(chunk[-1])
+            and not _TAG_RE.search(chunk[-1])
+            and not _CONTINUABLE_RE.match(block)
+        ):
+            yield "\n\n".join(chunk) + suffix
+            chunk = []
+        chunk.append(block)
+        depth += _html_depth(block)
+    if chunk:
+        yield "\n\n".join(chunk) + suffix
+
+
+def _full_converter() -> markdown.Markdown:
+    configs = {name: dict(config) for name, config in RENDERED_EXTENSION_CONFIGS.items()}
+    configs["codehilite"]["pygments_formatter"] = cached_html_formatter
+    return markdown.Markdown(
+        extensions=[SourceCodeExtension(), *RENDERED_EXTENSIONS],
+        extension_configs=configs,
+    )
+
+
+def _summary_converter() -> markdown.Markdown:
+    return markdown.Markdown(extensions=SUMMARY_EXTENSIONS)
+
+
+markdown_pool = MarkdownPool({"full": _full_converter, "summary": _summary_converter})
+
+
 class BlogPost:
     def __init__(
         self,
@@ -54,6 +151,10 @@ class BlogPost:
         tags: list | None = None,
         difficulty: int = 0,
         slugs: list | None = None,
+        rendered_html: str | None = None,
+        summary_html: str | None = None,
+        word_count: int | None = None,
+        render_digest: str | None = None,
     ) -> None:
         self.key = key
         self.title = title
@@ -64,6 +165,12 @@ class BlogPost:
         self.tags = tags if tags is not None else []
         self.difficulty = difficulty
         self.slugs = slugs if slugs is not None else []
+        # Renderings precomputed by `prerender` (stored with the entity). They
+        # are only trusted while `render_digest` matches the current body.
+        self.rendered_html = rendered_html
+        self.summary_html = summary_html
+        self.word_count = word_count
+        self.render_digest = render_digest
 
     @property
     def published_tz(self) -> datetime.datetime:
@@ -73,35 +180,78 @@ class BlogPost:
     def tag_pairs(self) -> list[tuple[str, str]]:
         return [(tag, slugify(tag)) for tag in self.tags]
 
+    @property
+    def _cache_key(self):
+        return self.key.id_or_name if self.key else None
+
+    @property
+    def has_current_renderings(self) -> bool:
+        """True if the stored renderings were made from this body and Markdown setup."""
+        return (
+            self.render_digest is not None
+            and self.rendered_html is not None
+            and self.summary_html is not None
+            and self.render_digest == body_digest(self.body, RENDER_FINGERPRINT)
+        )
+
     @property
     def summary(self) -> str:
-        html = markdown.markdown(self.body, extensions=["md_in_html"])
-        truncator = HTMLWordTruncator(max_words=180, end="__TRUNCATION_MARKER_")
-        truncated = truncator.process(html)
-        # There can be a space before the truncation marker, so we remove it.
-        return re.sub(r"\s*__TRUNCATION_MARKER_", "...", truncated)
+        if self.has_current_renderings:
+            return self.summary_html
+        return render_cache.get_or_render(
+            self._cache_key, "summary", self.body, RENDER_FINGERPRINT, self._render_summary
+        )
 
     @property
     def rendered(self) -> str:
-        return markdown.markdown(
-            self.body,
-            extensions=[
-                SourceCodeExtension(),
-                "fenced_code",
-                "codehilite",
-                "tables",
-                "attr_list",
-                "md_in_html",
-            ],
-            extension_configs={
-                "codehilite": {
-                    "linenums": False,
-                    "css_class": "codehilite",
-                    "guess_lang": False,
-                }
-            },
+        if self.has_current_renderings:
+            return self.rendered_html
+        return render_cache.get_or_render(
+            self._cache_key, "rendered", self.body, RENDER_FINGERPRINT, self._render_full
         )
 
+    def prerender(self) -> None:
+        """Compute the renderings stored alongside the post entity (through render_cache)."""
+        self.rendered_html = render_cache.get_or_render(
+            self._cache_key, "rendered", self.body, RENDER_FINGERPRINT, self._render_full
+        )
+        self.summary_html = render_cache.get_or_render(
+            self._cache_key, "summary", self.body, RENDER_FINGERPRINT, self._render_summary
+        )
+        self.word_count = count_html_words(self.rendered_html)
+        self.render_digest = body_digest(self.body, RENDER_FINGERPRINT)
+
+    def rendering_properties(self) -> dict:
+        """Entity properties holding the precomputed renderings."""
+        return {
+            "rendered_html": self.rendered_html,
+            "summary_html": self.summary_html,
+            "word_count": self.word_count,
+            "render_digest": self.render_digest,
+        }
+
+    def _render_summary(self) -> str:
+        # Convert the body chunk by chunk and stop as soon as the truncator has
+        # seen enough words: long posts are never converted in full.
+        truncator = HTMLWordTruncator(max_words=SUMMARY_MAX_WORDS, end="__TRUNCATION_MARKER_")
+        truncator.begin()
+        separator = ""
+        with markdown_pool.converter("summary") as md:
+            for chunk in summary_chunks(self.body):
+                html = md.convert(chunk)
+                md.reset()
+                if not html:
+                    continue
+                if not truncator.stream(separator + html):
+                    break
+                separator = "\n"
+        truncated = truncator.getvalue()
+        # There can be a space before the truncation marker, so we remove it.
+        return re.sub(r"\s*__TRUNCATION_MARKER_", "...", truncated)
+
+    def _render_full(self) -> str:
+        return markdown_pool.convert("full", self.body)
+
     @staticmethod
     def from_datastore_entity(entity: datastore.Entity) -> "BlogPost":
         return BlogPost(
@@ -114,6 +264,10 @@ class BlogPost:
             tags=entity.get("tags", []),
             difficulty=entity.get("difficulty", 0),
             slugs=entity.get("slugs", []),
+            rendered_html=entity.get("rendered_html"),
+            summary_html=entity.get("summary_html"),
+            word_count=entity.get("word_count"),
+            render_digest=entity.get("render_digest"),
         )
 
     def to_dict(self) -> dict:
@@ -0,0 +1,77 @@
+"""Pool of reusable, preconfigured Markdown converters.
+
+Building a `markdown.Markdown` object resolves and instantiates every
+extension, which costs more than converting a typical post. The pool keeps
+converters per profile (a fixed set of extensions and their configuration) and
+hands each one to a single thread at a time, so it is safe to use from the
+threadpool that runs the sync route handlers.
+"""
+
+from __future__ import annotations
+
+import functools
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+import markdown
+from pygments.formatters.html import HtmlFormatter
+
+
+class MarkdownPool:
+    """Reusable Markdown converters, with one free list per profile.
+
+    Args:
+        factories: Maps profile names to callables creating a converter.
+        max_idle: Maximum number of idle converters kept per profile.
+    """
+
+    def __init__(
+        self, factories: dict[str, Callable[[], markdown.Markdown]], max_idle: int = 8
+    ) -> None:
+        self._factories = factories
+        self._free: dict[str, list[markdown.Markdown]] = {name: [] for name in factories}
+        self.max_idle = max_idle
+
+    @contextmanager
+    def converter(self, profile: str) -> Iterator[markdown.Markdown]:
+        """Borrow a converter for `profile`; it is reset and returned on exit."""
+        free = self._free[profile]
+        try:
+            # list.pop and list.append are atomic: no two threads get the same converter.
+            md = free.pop()
+        except IndexError:
+            md = self._factories[profile]()
+        try:
+            yield md
+        finally:
+            md.reset()
+            if len(free) < self.max_idle:
+                free.append(md)
+
+    def convert(self, profile: str, text: str) -> str:
+        """Convert `text` with a converter of the given profile."""
+        with self.converter(profile) as md:
+            return md.convert(text)
+
+
+def _freeze(value):
+    """Hashable version of a Pygments option value (lists become tuples)."""
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+@functools.lru_cache(maxsize=64)
+def _html_formatter(frozen_options: tuple) -> HtmlFormatter:
+    return HtmlFormatter(**dict(frozen_options))
+
+
+def cached_html_formatter(lang_str: str = "", **options) -> HtmlFormatter:
+    """`pygments_formatter` for codehilite returning one formatter per option set.
+
+    Options only depend on the code block settings (line numbers, CSS class...),
+    so a handful of formatters serve every code block of every post. The
+    `lang_str` argument is dropped, as with codehilite's default "html" formatter.
+    """
+    frozen = tuple(sorted((name, _freeze(value)) for name, value in options.items()))
+    return _html_formatter(frozen)
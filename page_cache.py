@@ -0,0 +1,280 @@
+"""Full-page cache for the public pages, as an ASGI middleware.
+
+Public pages are identical for every anonymous visitor, so their responses
+are kept in memory, keyed by path and query string, and replayed without
+running the route. An entry is fresh for `ttl` seconds. For `stale_ttl`
+more seconds it is still served while a background request refreshes it.
+Concurrent misses on the same page wait for a single rendering. Pages are
+compressed once when stored, in every supported encoding. Post writes
+drop the pages that show the post (see main.py), and requests from a
+signed-in admin always bypass the cache.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from compression import (
+    ENCODING_SUFFIXES,
+    MINIMUM_SIZE,
+    accepted_encodings,
+    compress,
+    is_compressible,
+)
+from http_cache import is_not_modified
+
+logger = logging.getLogger(__name__)
+
+# Paths of the pages that do not depend on the visitor.
+CACHEABLE_PATHS = re.compile(r"^/(?:|archive|bestof|about|tags|tag/[^/]+|\d{4}/\d{1,2}/[^/]+)$")
+# Post paths, which the post route normalizes (two-digit month, lowercase slug).
+_POST_PATH = re.compile(r"^/(\d{4})/(\d{1,2})/([^/]+)$")
+# Request headers that make the route answer something else than the full page.
+_CONDITIONAL_HEADERS = {b"if-none-match", b"if-modified-since", b"range", b"if-range"}
+
+
+def cache_key(scope: Scope) -> str:
+    """Key of a page: its path and query string.
+
+    Post paths are in the form of the post route, and so of the paths that
+    post writes invalidate: /2024/1/Title and /2024/01/title are one page.
+    """
+    path = scope["path"]
+    if match := _POST_PATH.match(path):
+        year, month, slug = match.groups()
+        path = f"/{int(year)}/{int(month):02d}/{slug.lower()}"
+    if scope.get("query_string"):
+        path += "?" + scope["query_string"].decode("latin-1")
+    return path
+
+
+class CachedPage:
+    """A complete response: status, headers and body."""
+
+    __slots__ = ("status", "headers", "body", "encoded", "stored_at")
+
+    def __init__(self, status: int, headers: list[tuple[bytes, bytes]], body: bytes) -> None:
+        self.status = status
+        self.headers = headers
+        self.body = body
+        # Body in each content encoding, compressed once when the page is stored.
+        self.encoded: dict[str, bytes] = {}
+        self.stored_at = time.monotonic()
+
+    def compress(self) -> None:
+        if (
+            len(self.body) < MINIMUM_SIZE
+            or self.header(b"content-encoding") is not None
+            or not is_compressible(self.header(b"content-type"))
+        ):
+            return
+        self.encoded = {
+            encoding: compress(self.body, encoding, fast=True) for encoding in ENCODING_SUFFIXES
+        }
+
+    def header(self, name: bytes) -> str | None:
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value.decode("latin-1")
+        return None
+
+    @property
+    def cacheable(self) -> bool:
+        return self.status == 200 and self.header(b"set-cookie") is None
+
+
+class PageCache:
+    """Pages by key (path and query string), least recently used dropped first.
+
+    Args:
+        ttl: Seconds that a page is served as is (0 disables the cache).
+        stale_ttl: Seconds after that during which the page is still served
+            while it is refreshed in the background.
+        max_entries: Maximum number of pages.
+    """
+
+    def __init__(self, ttl: float = 60, stale_ttl: float = 600, max_entries: int = 512) -> None:
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._pages: OrderedDict[str, CachedPage] = OrderedDict()
+        # Incremented by clear(): pages rendered before a clear are not stored.
+        self.generation = 0
+
+    def configure(self, ttl: float, stale_ttl: float, max_entries: int) -> None:
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.clear()
+
+    def get(self, key: str) -> CachedPage | None:
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+            return page
+
+    def put(self, key: str, page: CachedPage, generation: int) -> None:
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+    def clear(self, *_args: object) -> None:
+        """Drop every page (accepts and ignores arguments, to serve as a listener)."""
+        with self._lock:
+            self._pages.clear()
+            self.generation += 1
+
+    def invalidate(self, paths: set[str]) -> None:
+        """Drop the pages at these paths (whatever their query string)."""
+        with self._lock:
+            for key in [key for key in self._pages if key.partition("?")[0] in paths]:
+                del self._pages[key]
+            # Renderings in progress may predate the change.
+            self.generation += 1
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+
+page_cache = PageCache()
+
+
+class PageCacheMiddleware:
+    """Serve cacheable GET requests of anonymous visitors from a PageCache.
+
+    Must run inside SessionMiddleware, which decodes the session it looks at.
+    """
+
+    def __init__(self, app: ASGIApp, cache: PageCache = page_cache) -> None:
+        self.app = app
+        self.cache = cache
+        # Requests rendering each missing or stale page, shared by the waiters.
+        self._renders: dict[str, asyncio.Task] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or self.cache.ttl <= 0
+            or not CACHEABLE_PATHS.match(scope["path"])
+            or scope.get("session", {}).get("user")
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        key = cache_key(scope)
+
+        page = self.cache.get(key)
+        if page is not None:
+            age = time.monotonic() - page.stored_at
+            if age < self.cache.ttl:
+                await self._send(page, scope, send, "HIT")
+                return
+            if age < self.cache.ttl + self.cache.stale_ttl:
+                self._render(key, scope)
+                await self._send(page, scope, send, "STALE")
+                return
+
+        leader = key not in self._renders
+        # Shielded: a client going away does not cancel the rendering the others wait for.
+        page = await asyncio.shield(self._render(key, scope))
+        if page.cacheable or leader:
+            await self._send(page, scope, send, "MISS")
+        else:
+            # Not shareable (errors, cookies): render it for this request only.
+            await self.app(scope, receive, send)
+
+    def _render(self, key: str, scope: Scope) -> asyncio.Task:
+        """Task rendering the page (started unless already running) and storing it."""
+        task = self._renders.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._render_page(key, scope))
+            self._renders[key] = task
+            task.add_done_callback(lambda done: self._render_done(key, done))
+        return task
+
+    def _render_done(self, key: str, task: asyncio.Task) -> None:
+        self._renders.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Rendering %s for the page cache failed", key, exc_info=task.exception())
+
+    async def _render_page(self, key: str, scope: Scope) -> CachedPage:
+        generation = self.cache.generation
+        headers = [(k, v) for k, v in scope["headers"] if k.lower() not in _CONDITIONAL_HEADERS]
+        render_scope = {**scope, "headers": headers}
+        status = 500
+        response_headers: list[tuple[bytes, bytes]] = []
+        body = bytearray()
+        request_sent = False
+
+        async def receive() -> Message:
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # The response is for the cache, so its "client" never disconnects.
+            await asyncio.Event().wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message: Message) -> None:
+            nonlocal status, response_headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                body.extend(message.get("body", b""))
+
+        await self.app(render_scope, receive, send)
+        page = CachedPage(status, response_headers, bytes(body))
+        if page.cacheable:
+            await asyncio.to_thread(page.compress)
+            self.cache.put(key, page, generation)
+        return page
+
+    async def _send(self, page: CachedPage, scope: Scope, send: Send, state: str) -> None:
+        etag = page.header(b"etag")
+        last_modified = page.header(b"last-modified")
+        if etag is not None:
+            modified_at = parsedate_to_datetime(last_modified) if last_modified else None
+            if is_not_modified(Request(scope), etag, modified_at):
+                headers = [
+                    (k, v)
+                    for k, v in page.headers
+                    if k.lower() in (b"etag", b"last-modified", b"cache-control", b"vary")
+                ]
+                await send({"type": "http.response.start", "status": 304, "headers": headers})
+                await send({"type": "http.response.body", "body": b""})
+                return
+        headers = [*page.headers, (b"x-cache", state.encode())]
+        body = page.body
+        if page.encoded:
+            accept_encoding = Headers(scope=scope).get("accept-encoding")
+            encoding = next(iter(accepted_encodings(accept_encoding)), None)
+            if encoding is not None and encoding in page.encoded:
+                body = page.encoded[encoding]
+                headers = [(k, v) for k, v in headers if k.lower() != b"content-length"]
+                headers += [
+                    (b"content-encoding", encoding.encode()),
+                    (b"content-length", str(len(body)).encode()),
+                ]
+            response_headers = MutableHeaders(raw=headers)
+            response_headers.add_vary_header("Accept-Encoding")
+            headers = response_headers.raw
+        await send({"type": "http.response.start", "status": page.status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
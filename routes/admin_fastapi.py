@@ -9,9 +9,10 @@ from models.blog_post import BlogPost
 from security import ensure_csrf_token, verify_csrf_token
 from services import blog as blog_service
 from services.datastore import get_datastore_client
+from static_assets import add_static_url
 
 admin_router = APIRouter()
-templates = Jinja2Templates(directory="templates")
+templates = add_static_url(Jinja2Templates(directory="templates"))
 
 
 # Dependency to check if user is authenticated
@@ -1,15 +1,15 @@
-from itertools import groupby
-
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.templating import Jinja2Templates
 from google.cloud import datastore
 
 from config import settings
 from services import blog as blog_service
 from services.datastore import get_datastore_client
+from services.search import search_index
+from static_assets import add_static_url
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
+templates = add_static_url(Jinja2Templates(directory="templates"))
 
 
 @router.get("/bestof")
@@ -26,24 +26,47 @@ def bestof(request: Request):
 
 @router.get("/archive")
 def archive(request: Request, db: datastore.Client = Depends(get_datastore_client)):
-    posts = blog_service.get_posts(db, limit=None)
+    return templates.TemplateResponse(
+        request,
+        "archive.html",
+        {
+            "settings": settings,
+            "by_year": blog_service.get_archive(db),
+            "copyright_year": settings.copyright_year,
+        },
+    )
 
-    # Sort posts by year in descending order
-    posts.sort(key=lambda p: p.published.year, reverse=True)
 
-    # Group posts by year
-    posts_by_year = []
-    for _year, group in groupby(posts, key=lambda p: p.published.year):
-        posts_by_year.append(list(group))
+@router.get("/tags")
+def tags(request: Request, db: datastore.Client = Depends(get_datastore_client)):
+    return templates.TemplateResponse(
+        request,
+        "tags.html",
+        {
+            "settings": settings,
+            "tags": blog_service.get_tag_cloud(db),
+            "copyright_year": settings.copyright_year,
+        },
+    )
 
+
+@router.get("/search")
+def search(request: Request, q: str = ""):
+    if not settings.search_index_path:
+        raise HTTPException(status_code=404, detail="Search is not enabled")
+    ready = search_index.ready
     return templates.TemplateResponse(
         request,
-        "archive.html",
+        "search.html",
         {
             "settings": settings,
-            "by_year": posts_by_year,
+            "query": q,
+            "ready": ready,
+            "hits": search_index.search(q) if q else [],
             "copyright_year": settings.copyright_year,
         },
+        # The index is built at startup: a moment before it can answer.
+        status_code=200 if ready else 503,
     )
 
 
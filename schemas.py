@@ -18,3 +18,5 @@ class PostDetails(PostSummary):
 
 class PostList(BaseModel):
     posts: list[PostSummary]
+    # Pass as ?cursor= to get the next (older) page; None on the last page.
+    next_cursor: str | None = None
@@ -0,0 +1,43 @@
+"""
+Store the renderings (HTML, summary, word count) of the posts written before
+render-on-save, or rendered with another Markdown setup. Until then, each
+instance of the application renders them when it shows them (kept in
+services.render_cache): public pages never write to Datastore. Run once
+after deploying a change of the Markdown setup.
+Run from the root of the project (the settings are read from .env, as for
+the application).
+You may need to authenticate first:
+```bash
+    gcloud auth application-default login
+    python scripts/backfill_renderings.py
+```
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.cloud import datastore  # noqa: E402
+
+from services import blog as blog_service  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store the renderings of stale posts.")
+    parser.add_argument(
+        "--project",
+        type=str,
+        default="thegrandlocus-2",
+        help="The project ID of the Datastore.",
+    )
+    args = parser.parse_args()
+
+    client = datastore.Client(project=args.project)
+    stored = blog_service.backfill_renderings(client)
+    print(f"Stored the renderings of {stored} post(s) in project '{args.project}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Render every public page of the blog to a directory of static files, which
+can be served from a bucket or a CDN. Run again on the same directory, it
+only renders the pages affected by the post changes since the last export.
+Run from the root of the project (the settings are read from .env, as for
+the application).
+You may need to authenticate first:
+```bash
+    gcloud auth application-default login
+    python scripts/export_site.py --output site
+```
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.cloud import datastore  # noqa: E402
+
+from config import settings  # noqa: E402
+from services import blog as blog_service  # noqa: E402
+from services.dependencies import update_export  # noqa: E402
+from services.related import RelatedPosts  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the blog as static files.")
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="site",
+        help="Directory to write the site to.",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Empty the directory and render every page.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of rendering processes (default: one per CPU).",
+    )
+    parser.add_argument(
+        "--project",
+        type=str,
+        default="thegrandlocus-2",
+        help="The project ID of the Datastore.",
+    )
+    args = parser.parse_args()
+
+    client = datastore.Client(project=args.project)
+    posts = blog_service.get_posts(client, limit=None)
+    print(f"Found {len(posts)} published posts in Datastore for project '{args.project}'.")
+
+    if args.full and os.path.exists(args.output):
+        shutil.rmtree(args.output)
+    start = time.perf_counter()
+    related = RelatedPosts(settings.related_posts)
+    related.build(posts)
+    written, deleted = update_export(
+        posts, settings, args.output, workers=args.workers, related=related
+    )
+    elapsed = time.perf_counter() - start
+    print(
+        f"Wrote {len(written)} page(s), deleted {len(deleted)}, in {args.output} ({elapsed:.1f}s)."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Write compressed copies (.gz, and .br when brotli is installed) of the static
+files, served by PrecompressedStaticFiles. Run from the root of the project;
+the Docker build runs it.
+```bash
+    python scripts/precompress_static.py
+```
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import ENCODING_SUFFIXES, precompress_directory  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompress the static files.")
+    parser.add_argument(
+        "directory",
+        nargs="?",
+        default="static",
+        help="Directory of the static files.",
+    )
+    args = parser.parse_args()
+
+    written = precompress_directory(args.directory)
+    encodings = ", ".join(ENCODING_SUFFIXES)
+    print(f"Wrote {len(written)} compressed file(s) ({encodings}) under {args.directory}.")
+
+
+if __name__ == "__main__":
+    main()
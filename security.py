@@ -68,9 +68,18 @@ def trusted_proxy_hosts_from_setting(value: str) -> list[str] | str:
     return parts if parts else "*"
 
 
-def validate_image_blob_path(image_path: str) -> None:
+# Widths (in pixels) and formats accepted by /img/ for resized variants. A
+# closed set keeps the number of derivatives per image (and cache) bounded.
+IMAGE_VARIANT_WIDTHS = (320, 480, 640, 800, 960, 1280, 1600, 1920)
+IMAGE_VARIANT_FORMATS = ("auto", "original", "avif", "webp", "jpeg", "png")
+
+
+def validate_image_blob_path(
+    image_path: str, width: int | None = None, image_format: str | None = None
+) -> None:
     """
-    Reject empty, absolute, traversal-like, or control-character paths for GCS object names.
+    Reject empty, absolute, traversal-like, or control-character paths for GCS object names,
+    and variant widths or formats outside IMAGE_VARIANT_WIDTHS and IMAGE_VARIANT_FORMATS.
     """
     if not image_path or image_path.strip() != image_path:
         raise HTTPException(status_code=400, detail="Invalid image path")
@@ -80,3 +89,7 @@ def validate_image_blob_path(image_path: str) -> None:
         raise HTTPException(status_code=400, detail="Invalid image path")
     if len(image_path) > 1024:
         raise HTTPException(status_code=400, detail="Invalid image path")
+    if width is not None and width not in IMAGE_VARIANT_WIDTHS:
+        raise HTTPException(status_code=400, detail="Invalid image width")
+    if image_format is not None and image_format not in IMAGE_VARIANT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid image format")
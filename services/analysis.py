@@ -0,0 +1,295 @@
+"""The analyzed posts, shared by the search index and the related posts.
+
+Both need the terms of every post (services.search.AnalyzedPost): posts are
+read and tokenized once, here, and passed on to the consumers. Each instance
+of the application keeps its own copy, up to date with:
+
+- the changes it makes itself (a post change listener, see apply_change);
+- the changes made by the other instances, caught up with every few minutes
+  (see refresh): a projection query on the dates of the posts tells which
+  posts changed, and only those are read and tokenized again.
+
+Only the posts published by now are analyzed. Drafts (dated 9999-12-31) are
+left out, and so are the posts scheduled later: the first refresh after
+their date finds them, as posts it does not know yet.
+
+The analyses can be stored in Datastore too (kind PostTerms, one entity per
+post, child of the post; off by default, see configure), by the instance
+that changes a post. Starting an instance then reads them in one query
+instead of reading and tokenizing every post: only the posts changed since
+they were stored are analyzed again (and stored).
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+import logging
+import threading
+from collections import Counter
+from collections.abc import Callable, Hashable
+
+from google.cloud import datastore
+
+from models.blog_post import BlogPost
+from services.post_index import lookup_posts, read_post_dates
+from services.search import TERMS_VERSION, AnalyzedPost, analyze, is_published
+
+logger = logging.getLogger(__name__)
+
+KIND = "PostTerms"
+# Name of the PostTerms entity of a post (the post is its parent).
+_NAME = "terms"
+# Entities written per call (Datastore limit).
+_WRITE_BATCH = 500
+_PROPERTIES = (
+    "version",
+    "title",
+    "path",
+    "published",
+    "updated",
+    "tags",
+    "slugs",
+    "difficulty",
+    "terms",
+)
+
+
+def terms_key(post_key: datastore.Key) -> datastore.Key:
+    """Key of the stored analysis of a post."""
+    return datastore.Key(KIND, _NAME, parent=post_key)
+
+
+def to_entity(post: AnalyzedPost) -> datastore.Entity:
+    entity = datastore.Entity(key=terms_key(post.key), exclude_from_indexes=_PROPERTIES)
+    entity.update(
+        {
+            "version": TERMS_VERSION,
+            "title": post.title,
+            "path": post.path,
+            "published": post.published,
+            "updated": post.updated,
+            "tags": post.tags,
+            "slugs": post.slugs,
+            "difficulty": post.difficulty,
+            "terms": json.dumps(post.terms, separators=(",", ":")),
+        }
+    )
+    return entity
+
+
+def from_entity(entity: datastore.Entity) -> AnalyzedPost | None:
+    """The stored analysis, or None if another version of the terms made it."""
+    if entity.get("version") != TERMS_VERSION:
+        return None
+    return AnalyzedPost(
+        key=entity.key.parent,
+        title=entity.get("title"),
+        path=entity.get("path"),
+        published=entity.get("published"),
+        updated=entity.get("updated"),
+        tags=entity.get("tags", []),
+        slugs=entity.get("slugs", []),
+        difficulty=entity.get("difficulty", 0),
+        terms=Counter(json.loads(entity["terms"])),
+    )
+
+
+class PostAnalyses:
+    """The analyzed posts (those published by now), by post ID.
+
+    Consumers have `build(posts)` and `apply(changes)` (changes map post IDs
+    to an AnalyzedPost, or None for a removed post). They are built when the
+    posts are loaded, then given every change, in order. Empty until loaded.
+    """
+
+    def __init__(self) -> None:
+        self._posts: dict[Hashable, AnalyzedPost] | None = None
+        self._consumers: list = []
+        # Serializes the changes, so that consumers receive them in order.
+        self._lock = threading.Lock()
+        # Incremented by every local change, so that posts read before a change
+        # do not overwrite it with older data.
+        self._generation = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        # Client to store the analyses of local changes with (see start_refresh).
+        self._get_client: Callable[[], datastore.Client] | None = None
+        self._stored = False
+
+    def configure(self, stored: bool) -> None:
+        """Store the analyses in Datastore, and start from them (see the module docstring)."""
+        self._stored = stored
+
+    def subscribe(self, consumer) -> None:
+        self._consumers.append(consumer)
+
+    @property
+    def ready(self) -> bool:
+        return self._posts is not None
+
+    def __len__(self) -> int:
+        posts = self._posts
+        return len(posts) if posts is not None else 0
+
+    def load(self, db: datastore.Client) -> bool:
+        """Read the stored analyses (if stored), analyze the posts changed since,
+        then build the consumers.
+
+        Returns False if a post changed meanwhile (the posts read are
+        discarded: load again).
+        """
+        generation = self._generation
+        now = datetime.datetime.now(datetime.UTC)
+        stored = {}
+        stored_keys = {}
+        if self._stored:
+            for entity in db.query(kind=KIND).fetch():
+                stored[entity.key.parent.id_or_name] = from_entity(entity)
+                stored_keys[entity.key.parent.id_or_name] = entity.key
+        posts = {}
+        changed = []
+        for post_id, (key, published, updated) in read_post_dates(db).items():
+            if not is_published(published, now):
+                continue
+            post = stored.get(post_id)
+            if post is not None and (post.published, post.updated) == (published, updated):
+                posts[post_id] = post
+            else:
+                changed.append(key)
+        analyzed = [
+            analyze(post)
+            for post in map(BlogPost.from_datastore_entity, lookup_posts(db, changed))
+            if is_published(post.published, now)
+        ]
+        posts.update({post.key.id_or_name: post for post in analyzed})
+        # Analyses of the posts deleted or unpublished since (drafts included).
+        removed = [stored_keys[post_id] for post_id in stored_keys.keys() - posts.keys()]
+        if self._stored:
+            self._store(db, analyzed, removed)
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._posts = posts
+            for consumer in self._consumers:
+                consumer.build(posts.values())
+        logger.info("Loaded %d analyzed post(s), %d analyzed again", len(posts), len(analyzed))
+        return True
+
+    @staticmethod
+    def _store(
+        db: datastore.Client, posts: list[AnalyzedPost], removed: list[datastore.Key]
+    ) -> None:
+        """Store analyses and delete those of removed posts (failures are only logged)."""
+        try:
+            entities = [to_entity(post) for post in posts]
+            for start in range(0, len(entities), _WRITE_BATCH):
+                db.put_multi(entities[start : start + _WRITE_BATCH])
+            for start in range(0, len(removed), _WRITE_BATCH):
+                db.delete_multi(removed[start : start + _WRITE_BATCH])
+        except Exception:
+            logger.warning("Could not store the analyses of %d post(s)", len(posts), exc_info=True)
+
+    def refresh(self, db: datastore.Client) -> bool:
+        """Catch up with the posts changed by other instances (loads them first).
+
+        Returns True if anything changed. Changes found while a post changed
+        locally are discarded: the next refresh finds them again.
+        """
+        if self._posts is None:
+            # Read again if a post changed during the first read.
+            return self.load(db) or self.load(db)
+        generation = self._generation
+        now = datetime.datetime.now(datetime.UTC)
+        known = self._posts
+        changes: dict[Hashable, AnalyzedPost | None] = {}
+        changed = []
+        dates = read_post_dates(db)
+        for post_id, (key, published, updated) in dates.items():
+            post = known.get(post_id)
+            if not is_published(published, now):
+                if post is not None:
+                    changes[post_id] = None  # Unpublished, or rescheduled.
+            elif post is None or (post.published, post.updated) != (published, updated):
+                changed.append(key)
+        changes.update({post_id: None for post_id in known if post_id not in dates})
+        for entity in lookup_posts(db, changed):
+            post = BlogPost.from_datastore_entity(entity)
+            public = is_published(post.published, now)
+            changes[post.key.id_or_name] = analyze(post) if public else None
+        if not changes:
+            return False
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._apply(changes)
+        logger.info("Analyzed %d post(s) changed by other instances", len(changes))
+        return True
+
+    def apply_change(self, post_id: Hashable, post: BlogPost | None) -> None:
+        """Post change listener: analyze a saved post, or remove a deleted one.
+
+        If the analyses are stored, this one is once refreshes are started
+        (see start_refresh), by the request that saved the post.
+        """
+        now = datetime.datetime.now(datetime.UTC)
+        public = post is not None and is_published(post.published, now)
+        change = analyze(post) if public else None
+        with self._lock:
+            self._generation += 1
+            if self._posts is not None:
+                self._apply({post_id: change})
+        if self._stored and self._get_client is not None:
+            db = self._get_client()
+            if change is not None:
+                self._store(db, [change], [])
+            else:
+                self._store(db, [], [terms_key(db.key("BlogPost", post_id))])
+
+    def _apply(self, changes: dict[Hashable, AnalyzedPost | None]) -> None:
+        posts = dict(self._posts)
+        for post_id, post in changes.items():
+            if post is None:
+                posts.pop(post_id, None)
+            else:
+                posts[post_id] = post
+        self._posts = posts
+        for consumer in self._consumers:
+            consumer.apply(changes)
+
+    def start_refresh(
+        self,
+        get_client: Callable[[], datastore.Client],
+        interval: float,
+        on_change: Callable[[], None] | None = None,
+    ) -> None:
+        """Load the posts in a daemon thread, then refresh them every `interval` seconds.
+
+        `on_change` is called after every load or refresh that changed something.
+        """
+        if self._thread is not None:
+            return
+        self._get_client = get_client
+        self._stop.clear()
+
+        def refresh() -> None:
+            while True:
+                try:
+                    if self.refresh(get_client()) and on_change is not None:
+                        on_change()
+                except Exception:
+                    logger.warning("Posts could not be analyzed", exc_info=True)
+                if interval <= 0 or self._stop.wait(interval):
+                    return
+
+        self._thread = threading.Thread(target=refresh, name="analyze-posts", daemon=True)
+        self._thread.start()
+
+    def stop_refresh(self) -> None:
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+
+
+post_analyses = PostAnalyses()
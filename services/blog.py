@@ -1,14 +1,69 @@
 from __future__ import annotations
 
 import datetime
+import logging
+from collections.abc import Callable, Hashable
+from itertools import groupby
 
 from google.cloud import datastore
 from google.cloud.datastore.query import PropertyFilter
 
 from config import settings
 from models.blog_post import BlogPost
+from services.cache import TTLCache
+from services.pagination import Direction, PageCursor, PostPage
+from services.post_index import IndexedPost, TagCount, count_tags, post_index
+from services.render_cache import render_cache
 from utils import slugify
 
+logger = logging.getLogger(__name__)
+
+# Listeners called as listener(key_id, post) after a post is saved (post is the
+# stored BlogPost) or deleted (post is None).
+PostChangeListener = Callable[[Hashable, BlogPost | None], None]
+_post_change_listeners: list[PostChangeListener] = []
+
+
+def on_post_change(listener: PostChangeListener) -> PostChangeListener:
+    """Register a listener for post writes (usable as a decorator)."""
+    _post_change_listeners.append(listener)
+    return listener
+
+
+def _notify_post_change(key_id: Hashable, post: BlogPost | None) -> None:
+    for listener in _post_change_listeners:
+        try:
+            listener(key_id, post)
+        except Exception:
+            logger.exception("Post change listener %r failed", listener)
+
+
+# Totals of published posts (site-wide and per tag), counted server-side.
+_post_counts = TTLCache(ttl=settings.post_cache_ttl)
+
+on_post_change(lambda key_id, _post: render_cache.invalidate(key_id))
+on_post_change(_post_counts.clear)
+on_post_change(post_index.apply_change)
+
+# Posts of the archive page, grouped by year.
+_archive = TTLCache(ttl=settings.post_cache_ttl, max_entries=1)
+on_post_change(_archive.clear)
+
+# Tags of the published posts with their counts, when the post index is not loaded.
+_tag_cloud = TTLCache(ttl=settings.post_cache_ttl, max_entries=1)
+on_post_change(_tag_cloud.clear)
+
+# Neighbours of each post (prev/next links), by post ID.
+_neighbours = TTLCache(ttl=settings.post_cache_ttl)
+on_post_change(_neighbours.clear)
+
+# Precomputed renderings stored alongside the post (see BlogPost.prerender).
+RENDERING_PROPERTIES = ["rendered_html", "summary_html", "word_count", "render_digest"]
+# Properties with long text content that should not be indexed.
+UNINDEXED_PROPERTIES = ["body", *RENDERING_PROPERTIES]
+# Posts whose renderings are stored per transaction (see backfill_renderings).
+_BACKFILL_BATCH = 100
+
 
 def format_post_path(post, num):
     """Make the address of the post."""
@@ -36,6 +91,29 @@ def is_post_visible_to_public(post: BlogPost) -> bool:
     return post.published <= now
 
 
+def count_query_results(query: datastore.Query, db: datastore.Client) -> int:
+    """Count the results of a query with a server-side COUNT aggregation.
+
+    Nothing but the count is sent back, whatever the number of entities.
+    """
+    aggregation = db.aggregation_query(query).count(alias="total")
+    for results in aggregation.fetch():
+        for result in results:
+            return int(result.value)
+    return 0
+
+
+def _get_indexed_entities(posts: list[IndexedPost], db: datastore.Client) -> list[datastore.Entity]:
+    """Read the entities of posts found in the index, by key and in the same order.
+
+    Posts deleted since the index was refreshed are skipped.
+    """
+    if not posts:
+        return []
+    found = {entity.key: entity for entity in db.get_multi([post.key for post in posts])}
+    return [found[post.key] for post in posts if post.key in found]
+
+
 def get_post_by_id(post_id: int, db: datastore.Client):
     """Fetches a single post by its integer ID."""
 
@@ -46,6 +124,83 @@ def get_post_by_id(post_id: int, db: datastore.Client):
     return None
 
 
+def get_post_meta_by_path(path: str, db: datastore.Client) -> IndexedPost | None:
+    """Key and dates of the post at `path`, without reading its body.
+
+    Answered from the post index when it is loaded, otherwise with a
+    projection query (served from an index, no entity read).
+    """
+    if post_index.ready:
+        return post_index.get_by_path(path)
+    query = db.query(kind="BlogPost")
+    query.add_filter(filter=PropertyFilter("path", "=", path))
+    query.projection = ["published", "updated"]
+    for entity in query.fetch(limit=1):
+        return IndexedPost(
+            key=entity.key,
+            path=path,
+            published=entity.get("published"),
+            updated=entity.get("updated"),
+        )
+    return None
+
+
+def _query_neighbour(post, db: datastore.Client, older: bool) -> IndexedPost | None:
+    query = db.query(kind="BlogPost")
+    if older:
+        query.add_filter(filter=PropertyFilter("published", "<", post.published))
+        query.order = ["-published"]
+    else:
+        now = datetime.datetime.now(datetime.UTC)
+        query.add_filter(filter=PropertyFilter("published", ">", post.published))
+        query.add_filter(filter=PropertyFilter("published", "<=", now))
+        query.order = ["published"]
+    query.projection = ["published", "path"]
+    for entity in query.fetch(limit=1):
+        return IndexedPost(
+            key=entity.key, path=entity.get("path"), published=entity.get("published")
+        )
+    return None
+
+
+def get_neighbours(post, db: datastore.Client) -> tuple[IndexedPost | None, IndexedPost | None]:
+    """The published posts just before and after `post` (older, newer), for
+    its prev/next links (post is a BlogPost or IndexedPost).
+
+    Answered from the post index when it is loaded, otherwise with two
+    projection queries, whose result is cached per post (until it expires or
+    a post changes).
+    """
+    if post.published is None:
+        return None, None
+    post_id = post.key.id_or_name
+    if post_index.ready:
+        return post_index.neighbours(post_id)
+    return _neighbours.get_or_compute(
+        post_id,
+        lambda: (
+            _query_neighbour(post, db, older=True),
+            _query_neighbour(post, db, older=False),
+        ),
+    )
+
+
+def get_listing_state(tag: str | None = None) -> tuple | None:
+    """Summary of the published posts (optionally with a tag) for validators.
+
+    Returns (newest publication date, newest update date, number of posts),
+    which changes whenever a listing of these posts changes, or None when the
+    post index is not loaded.
+    """
+    if not post_index.ready:
+        return None
+    posts = post_index.published(tag)
+    if not posts:
+        return (None, None, 0)
+    updated = [post.updated for post in posts if post.updated is not None]
+    return (posts[0].published, max(updated, default=None), len(posts))
+
+
 def get_posts(
     db: datastore.Client,
     offset: int = 0,
@@ -58,12 +213,17 @@ def get_posts(
     For the admin view (published_only=False), this function fetches all posts
     and sorts them in Python to handle drafts correctly (which may not have a
     'published' date). For the public view, it fetches paginated published posts
-    directly from Datastore.
+    directly from Datastore, or from the post index when it is loaded (then
+    only the posts of the page are read, by key).
     """
     query = db.query(kind="BlogPost")
     total_posts = 0
 
-    if published_only:
+    if published_only and post_index.ready:
+        entities = _get_indexed_entities(post_index.page(offset=offset, limit=limit), db)
+        posts = [BlogPost.from_datastore_entity(entity) for entity in entities]
+        return (posts, post_index.count()) if with_total else posts
+    elif published_only:
         now = datetime.datetime.now(datetime.UTC)
         query.add_filter(filter=PropertyFilter("published", "<=", now))
         query.order = ["-published"]
@@ -72,8 +232,9 @@ def get_posts(
             # Create a new query for counting without limit/offset
             count_query = db.query(kind="BlogPost")
             count_query.add_filter(filter=PropertyFilter("published", "<=", now))
-            # Use keys_only for efficiency
-            total_posts = len(list(count_query.fetch()))
+            total_posts = _post_counts.get_or_compute(
+                "published", lambda: count_query_results(count_query, db)
+            )
 
         entities = list(query.fetch(offset=offset, limit=limit))
         posts = [BlogPost.from_datastore_entity(entity) for entity in entities]
@@ -102,12 +263,246 @@ def get_posts(
         return posts
 
 
-def get_post_by_path(path: str, db: datastore.Client):
-    """Fetches a single post by its path."""
+def get_posts_page(
+    db: datastore.Client,
+    cursor: PageCursor | None = None,
+    limit: int = 10,
+    tag: str | None = None,
+    offset: int = 0,
+    read_posts: bool = True,
+) -> PostPage:
+    """Fetches one page of published posts (optionally with a tag slug), newest first.
+
+    Pages are addressed by cursors (see services.pagination): each page costs
+    at most two queries for limit + 1 rows in total, whatever its depth (the
+    posts published at the same time as the boundary post, then the others).
+    The queries are projections on the dates, and the posts are then read by
+    key. `offset` is only honoured without a cursor, to keep old ?start=N
+    links working.
+
+    With `read_posts=False`, the page holds IndexedPost entries with the key
+    and the dates only, for validators: read_page_posts reads the posts.
+    """
+
+    now = datetime.datetime.now(datetime.UTC)
+    indexed = post_index.ready
+
+    # Rows are IndexedPost entries: from the post index when it is loaded (a
+    # page is then a slice of the listing of the tag, found by bisection),
+    # otherwise with the key and the publication date only.
+    def listing_query():
+        query = db.query(kind="BlogPost")
+        if tag is not None:
+            query.add_filter(filter=PropertyFilter("slugs", "=", tag))
+        return query
+
+    # Listing order: (-published, -__key__), the key breaking the ties.
+    def fetch(direction: Direction | None, limit: int, offset: int = 0) -> list[IndexedPost]:
+        if indexed:
+            if direction is None:
+                return post_index.page(tag, now, offset=offset, limit=limit)
+            return post_index.page(
+                tag, now, direction, cursor.published, limit=limit, boundary_id=cursor.key_id
+            )
+        newer = direction == "newer"
+        rows = []
+        if direction is not None:
+            # The posts published at the same time as the boundary post, past its key.
+            ties = listing_query()
+            ties.add_filter(filter=PropertyFilter("published", "=", cursor.published))
+            key = db.key("BlogPost", cursor.key_id)
+            ties.add_filter(filter=PropertyFilter("__key__", ">" if newer else "<", key))
+            ties.order = ["__key__"] if newer else ["-__key__"]
+            # Keys only: a property with an equality filter cannot be projected.
+            ties.keys_only()
+            rows = [
+                IndexedPost(key=entity.key, published=cursor.published)
+                for entity in ties.fetch(limit=limit)
+            ]
+            if len(rows) >= limit:
+                return rows
+        query = listing_query()
+        query.add_filter(filter=PropertyFilter("published", "<=", now))
+        if direction == "older":
+            query.add_filter(filter=PropertyFilter("published", "<", cursor.published))
+        elif direction == "newer":
+            query.add_filter(filter=PropertyFilter("published", ">", cursor.published))
+        query.order = ["published", "__key__"] if newer else ["-published", "-__key__"]
+        query.projection = ["published"]
+        return rows + [
+            IndexedPost(key=entity.key, published=entity["published"])
+            for entity in query.fetch(offset=offset, limit=limit - len(rows))
+        ]
+
+    def boundary(row: IndexedPost, direction: Direction) -> str:
+        return PageCursor(row.published, direction, row.key.id_or_name).encode()
+
+    prev_cursor = None
+    prev_is_first = False
+    if cursor is not None and cursor.direction == "newer":
+        rows = fetch("newer", limit + 1)
+        if len(rows) > limit:
+            rows = rows[:limit][::-1]
+            prev_cursor = boundary(rows[0], "newer")
+            # The post at the cursor boundary is older, so there is a next page.
+            has_next = True
+        else:
+            # Reached the newest posts: serve the first page instead of a short one.
+            cursor, offset = None, 0
+
+    if cursor is None or cursor.direction == "older":
+        if cursor is None:
+            rows = fetch(None, limit + 1, offset)
+            if offset > 0:
+                if offset <= limit or not rows:
+                    prev_is_first = True
+                else:
+                    prev_cursor = boundary(rows[0], "newer")
+        else:
+            rows = fetch("older", limit + 1)
+            if rows:
+                prev_cursor = boundary(rows[0], "newer")
+            else:
+                prev_is_first = True
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+
+    next_cursor = boundary(rows[-1], "older") if has_next else None
+    if not indexed:
+        _query_updated(db, rows, tag)
+    page = PostPage(rows, next_cursor, prev_cursor, prev_is_first)
+    return read_page_posts(page, db) if read_posts else page
+
+
+def _query_updated(db: datastore.Client, posts: list[IndexedPost], tag: str | None) -> None:
+    """Set the update dates of posts read with their publication date only.
+
+    One projection query on the dates of the posts published in their range
+    (with the tag, if any), served by an index (see index.yaml).
+    """
+    if not posts:
+        return
+    dates = [post.published for post in posts]
+    query = db.query(kind="BlogPost")
+    if tag is not None:
+        query.add_filter(filter=PropertyFilter("slugs", "=", tag))
+    query.add_filter(filter=PropertyFilter("published", ">=", min(dates)))
+    query.add_filter(filter=PropertyFilter("published", "<=", max(dates)))
+    query.order = ["published"]
+    query.projection = ["published", "updated"]
+    updated = {entity.key: entity.get("updated") for entity in query.fetch()}
+    for post in posts:
+        post.updated = updated.get(post.key)
+
+
+def read_page_posts(page: PostPage, db: datastore.Client) -> PostPage:
+    """The page with its posts read by key (see get_posts_page); deleted posts are skipped."""
+    entities = _get_indexed_entities(page.posts, db)
+    posts = [BlogPost.from_datastore_entity(entity) for entity in entities]
+    return PostPage(posts, page.next_cursor, page.prev_cursor, page.prev_is_first)
+
+
+def _query_published_meta(
+    db: datastore.Client, properties: tuple[str, ...] = ("path", "title")
+) -> list[IndexedPost]:
+    """Date, tags and `properties` of every published post, newest first,
+    with projection queries (no body read).
+
+    Projecting a list property yields one result per distinct value, in
+    index order, and omits entities where it is empty, so the tags come
+    from a second projection (of the same posts) and are merged by key. They
+    are then sorted and without duplicates, as in every IndexedPost. Each
+    set of properties needs its composite index (see index.yaml).
+    """
+    now = datetime.datetime.now(datetime.UTC)
+    tags: dict[Hashable, list[str]] = {}
+    tags_query = db.query(kind="BlogPost")
+    tags_query.add_filter(filter=PropertyFilter("published", "<=", now))
+    tags_query.order = ["-published"]
+    tags_query.projection = ["published", "tags"]
+    for entity in tags_query.fetch():
+        tags.setdefault(entity.key.id_or_name, []).append(entity["tags"])
 
     query = db.query(kind="BlogPost")
-    query.add_filter(filter=PropertyFilter("path", "=", path))
-    posts = list(query.fetch(limit=1))
+    query.add_filter(filter=PropertyFilter("published", "<=", now))
+    query.order = ["-published"]
+    query.projection = ["published", *properties]
+    posts = []
+    for entity in query.fetch():
+        post_tags = tags.get(entity.key.id_or_name, [])
+        posts.append(
+            IndexedPost(
+                key=entity.key,
+                published=entity.get("published"),
+                tags=post_tags,
+                slugs=[slugify(tag) for tag in post_tags],
+                **{name: entity.get(name) for name in properties},
+            )
+        )
+    return posts
+
+
+def list_published_posts(db: datastore.Client) -> list[IndexedPost]:
+    """Metadata of every published post, newest first (for listings of titles).
+
+    Answered from the post index when it is loaded, without any query, and
+    otherwise with projection queries.
+    """
+    if post_index.ready:
+        return post_index.published()
+    return _query_published_meta(db)
+
+
+def list_post_dates(db: datastore.Client) -> list[IndexedPost]:
+    """Path, dates and tags of every published post, newest first (for sitemaps).
+
+    Answered from the post index when it is loaded, otherwise with
+    projection queries.
+    """
+    if post_index.ready:
+        return post_index.published()
+    return _query_published_meta(db, ("path", "updated"))
+
+
+def get_archive(db: datastore.Client) -> list[list[IndexedPost]]:
+    """Published posts grouped by year of publication, newest first.
+
+    Cached until it expires or a post changes.
+    """
+
+    def group_by_year() -> list[list[IndexedPost]]:
+        posts = list_published_posts(db)
+        return [list(group) for _year, group in groupby(posts, key=lambda p: p.published.year)]
+
+    return _archive.get_or_compute("archive", group_by_year)
+
+
+def get_tag_cloud(db: datastore.Client) -> list[TagCount]:
+    """Tags of the published posts with their number of posts, sorted by name.
+
+    Counted from the tag listings of the post index when it is loaded,
+    otherwise from list_published_posts (cached until it expires or a post
+    changes).
+    """
+    if post_index.ready:
+        return post_index.tag_counts()
+    return _tag_cloud.get_or_compute("tags", lambda: count_tags(list_published_posts(db)))
+
+
+def get_post_by_path(path: str, db: datastore.Client):
+    """Fetches a single post by its path (a keyed read when the post index has it)."""
+
+    posts = []
+    indexed = post_index.get_by_path(path)
+    if indexed is not None:
+        # Check the path: the post may have moved since the index was refreshed.
+        entity = db.get(indexed.key)
+        if entity is not None and entity.get("path") == path:
+            posts = [entity]
+    if not posts:
+        query = db.query(kind="BlogPost")
+        query.add_filter(filter=PropertyFilter("path", "=", path))
+        posts = list(query.fetch(limit=1))
     if posts:
         return BlogPost.from_datastore_entity(posts[0])
     return None
@@ -136,11 +531,44 @@ def _ensure_post_path(post: BlogPost, db: datastore.Client) -> None:
         num += 1
 
 
+def backfill_renderings(db: datastore.Client) -> int:
+    """Store current renderings on the posts that lack them; returns how many were stored.
+
+    Posts written before render-on-save (or rendered with another Markdown
+    setup) are otherwise rendered by every process that shows them (through
+    render_cache). Run from scripts/backfill_renderings.py, never from a
+    public page: each batch of posts is read again in a transaction, and
+    posts whose body changed in the meantime are skipped.
+    """
+
+    stale: dict[datastore.Key, BlogPost] = {}
+    for entity in db.query(kind="BlogPost").fetch():
+        post = BlogPost.from_datastore_entity(entity)
+        if not post.has_current_renderings:
+            stale[entity.key] = post
+
+    stored = 0
+    keys = list(stale)
+    for start in range(0, len(keys), _BACKFILL_BATCH):
+        batch = keys[start : start + _BACKFILL_BATCH]
+        for key in batch:
+            stale[key].prerender()
+        with db.transaction():
+            for fresh in db.get_multi(batch):
+                post = stale[fresh.key]
+                if fresh.get("body") != post.body:
+                    continue
+                fresh.exclude_from_indexes.update(RENDERING_PROPERTIES)
+                fresh.update(post.rendering_properties())
+                db.put(fresh)
+                stored += 1
+    return stored
+
+
 def save_post(post: BlogPost, db: datastore.Client):
     """Create or update a BlogPost object in the Datastore."""
 
-    # Properties with long text content that should not be indexed.
-    exclude_from_indexes = ["body"]
+    exclude_from_indexes = UNINDEXED_PROPERTIES
 
     if post.key and post.key.id_or_name:
         # Existing post, use its key
@@ -153,6 +581,7 @@ def save_post(post: BlogPost, db: datastore.Client):
     _ensure_post_path(post, db)
 
     post.slugs = [slugify(tag) for tag in post.tags]
+    post.prerender()
 
     entity.update(
         {
@@ -164,13 +593,16 @@ def save_post(post: BlogPost, db: datastore.Client):
             "difficulty": post.difficulty,
             "path": post.path,
             "slugs": post.slugs,
+            **post.rendering_properties(),
         }
     )
     db.put(entity)
     # Re-read so the returned BlogPost always reflects the stored key (insert IDs,
     # etc.). Relying on in-place mutation after put can be fragile across client versions.
     stored = db.get(entity.key)
-    return BlogPost.from_datastore_entity(stored if stored is not None else entity)
+    saved_post = BlogPost.from_datastore_entity(stored if stored is not None else entity)
+    _notify_post_change(entity.key.id_or_name, saved_post)
+    return saved_post
 
 
 def delete_post(post_id: int, db: datastore.Client):
@@ -178,6 +610,7 @@ def delete_post(post_id: int, db: datastore.Client):
 
     key = db.key("BlogPost", post_id)
     db.delete(key)
+    _notify_post_change(post_id, None)
 
 
 def get_posts_by_tag(
@@ -189,6 +622,12 @@ def get_posts_by_tag(
 ):
     """Fetches published blog posts with tag, sorted by publication date."""
 
+    if post_index.ready:
+        indexed = post_index.page(tag, offset=offset, limit=limit)
+        entities = _get_indexed_entities(indexed, db)
+        posts = [BlogPost.from_datastore_entity(entity) for entity in entities]
+        return (posts, post_index.count(tag)) if with_total else posts
+
     query = db.query(kind="BlogPost")
     query.add_filter(filter=PropertyFilter("slugs", "=", tag))
     now = datetime.datetime.now(datetime.UTC)
@@ -199,8 +638,9 @@ def get_posts_by_tag(
         count_query = db.query(kind="BlogPost")
         count_query.add_filter(filter=PropertyFilter("slugs", "=", tag))
         count_query.add_filter(filter=PropertyFilter("published", "<=", now))
-        count_query.keys_only = True
-        total_posts = len(list(count_query.fetch()))
+        total_posts = _post_counts.get_or_compute(
+            ("tag", tag), lambda: count_query_results(count_query, db)
+        )
 
         entities = list(query.fetch(offset=offset, limit=limit))
         posts = [BlogPost.from_datastore_entity(entity) for entity in entities]
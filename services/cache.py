@@ -0,0 +1,67 @@
+"""Small in-process caches for values derived from the posts."""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Any
+
+
+class TTLCache:
+    """Thread-safe cache whose entries expire after `ttl` seconds.
+
+    Values derived from posts are cached until they expire (which bounds
+    staleness on instances that did not see a write) or until the cache is
+    cleared by a post change on this instance.
+
+    Args:
+        ttl: Lifetime of an entry in seconds (0 disables caching).
+        max_entries: Maximum number of entries, least recently used dropped first.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 1024) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        # Incremented by every invalidation, so that a value computed from data
+        # read before it is returned but not stored.
+        self._generation = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the cached value for `key`, calling `compute()` if missing or expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+            generation = self._generation
+
+        value = compute()
+        if self.ttl > 0:
+            with self._lock:
+                if generation != self._generation:
+                    return value
+                self._entries[key] = (now + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def pop(self, key: Hashable) -> None:
+        """Drop one entry."""
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self, *_args: Any) -> None:
+        """Drop every entry (accepts and ignores arguments, to serve as a listener)."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1,5 +1,68 @@
+"""Process-wide Datastore client.
+
+Creating a `datastore.Client` runs credential discovery and opens a new gRPC
+channel (with its TLS handshake), so the application shares one client per
+worker process. It is opened and warmed up by the application lifespan, and
+created lazily on first use otherwise (scripts, tests). The client is safe to
+share between threads: batches and transactions are tracked per thread.
+"""
+
+import logging
+import threading
+
 from google.cloud import datastore
 
+logger = logging.getLogger(__name__)
+
+_client: datastore.Client | None = None
+_client_lock = threading.Lock()
+
+
+def get_datastore_client() -> datastore.Client:
+    """FastAPI dependency returning the shared Datastore client."""
+    client = _client
+    if client is None:
+        client = open_datastore_client()
+    return client
+
+
+def open_datastore_client() -> datastore.Client:
+    """Create the shared client if needed and return it."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = datastore.Client()
+        return _client
+
+
+def close_datastore_client() -> None:
+    """Close the shared client (called on application shutdown)."""
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
+
+
+def ping_datastore(client: datastore.Client) -> None:
+    """Run the cheapest possible query (one key, keys only) to exercise the channel.
+
+    Raises whatever the client raises when Datastore cannot be reached.
+    """
+    query = client.query(kind="BlogPost")
+    query.keys_only()
+    list(query.fetch(limit=1))
+
+
+def warm_up_datastore_client() -> bool:
+    """Open the shared client and its channel ahead of the first request.
 
-def get_datastore_client():
-    return datastore.Client()
+    Returns False (after logging) if Datastore could not be reached; requests
+    will then retry on their own.
+    """
+    try:
+        ping_datastore(open_datastore_client())
+    except Exception:
+        logger.warning("Datastore warm-up failed", exc_info=True)
+        return False
+    return True
@@ -0,0 +1,212 @@
+"""Dependency graph from the posts to the pages that display them.
+
+Every page of the site (see services.export.site_pages) shows some posts:
+its own post and the neighbours and related posts it links to, the posts of
+a listing page (front page or tag), or all of them (the archive). A page
+depends on what it shows of these posts, their `signature` (and the tag
+cloud on the counts). When a post changes, the pages to render again are
+those whose signature changed, and those that show the post.
+A post moving in the listings, or changing tags, reaches every listing page
+whose content shifts.
+
+Page paths are those of the static export (listing pages numbered by path:
+/page/2/); route_path() maps them to the routes of the application.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+from collections import defaultdict
+from collections.abc import Hashable, Iterable
+from pathlib import Path
+
+from http_cache import template_version
+from models.blog_post import RENDER_FINGERPRINT
+from services.export import ExportPage, export_site, site_pages
+from services.post_index import PostIndex
+from services.related import RelatedPosts
+from static_assets import StaticManifest
+
+# Digests of the dependencies of the exported pages, kept in the output directory.
+EXPORT_MANIFEST = ".dependencies.json"
+# Numbered listing pages, served by the cursor-paginated routes.
+_LISTING_PAGE = re.compile(r"^(?P<base>/(?:tag/[^/]+/)?)page/\d+/$")
+
+
+def post_signature(post) -> tuple:
+    """What pages show of a post (post is a BlogPost or IndexedPost)."""
+    return (
+        post.key.id_or_name,
+        post.title,
+        post.path,
+        post.published,
+        post.updated,
+        tuple(post.tags),
+        tuple(post.slugs),
+        post.difficulty,
+    )
+
+
+def page_posts(page: ExportPage) -> list:
+    """Posts displayed by a page, read from its template context."""
+    context = page.context
+    posts = [context[name] for name in ("prev", "post", "next") if context.get(name) is not None]
+    posts += context.get("related", [])
+    posts += context.get("posts", [])
+    for posts_of_the_year in context.get("by_year", []):
+        posts += posts_of_the_year
+    return posts
+
+
+def route_path(page_path: str) -> str:
+    """Path of the route serving a page (without the cursor of listing pages)."""
+    match = _LISTING_PAGE.match(page_path)
+    if match is not None:
+        page_path = match["base"]
+    return page_path if page_path == "/" else page_path.rstrip("/")
+
+
+class SiteGraph:
+    """Pages of the site with their dependencies on the posts.
+
+    Args:
+        pages: Pages of the site (services.export.site_pages).
+    """
+
+    def __init__(self, pages: Iterable[ExportPage]) -> None:
+        # Page path -> signatures of the posts it shows.
+        self.pages: dict[str, tuple] = {}
+        # Post ID -> paths of the pages showing it.
+        self.post_pages: dict[Hashable, set[str]] = defaultdict(set)
+        for page in pages:
+            posts = page_posts(page)
+            tags = tuple((tag.slug, tag.name, tag.count) for tag in page.context.get("tags", ()))
+            self.pages[page.path] = (tuple(post_signature(post) for post in posts), tags)
+            for post in posts:
+                self.post_pages[post.key.id_or_name].add(page.path)
+
+    @staticmethod
+    def from_posts(posts: list, settings, related: RelatedPosts | None = None) -> SiteGraph:
+        """Graph of the site given the published posts, newest first."""
+        return SiteGraph(site_pages(posts, settings, related))
+
+    def digest(self, path: str) -> str:
+        """Digest of the dependencies of a page (changes when the page must be rendered)."""
+        return hashlib.sha256(repr(self.pages[path]).encode()).hexdigest()[:16]
+
+    def pages_of(self, post_id: Hashable) -> set[str]:
+        return set(self.post_pages.get(post_id, ()))
+
+    def changed_pages(self, other: SiteGraph) -> set[str]:
+        """Pages that differ from `other`: new, gone, or showing other posts or versions."""
+        paths = self.pages.keys() | other.pages.keys()
+        return {path for path in paths if self.pages.get(path) != other.pages.get(path)}
+
+
+class DependencyTracker:
+    """Keeps the graph of the site in step with a PostIndex to answer which
+    pages a post change affects.
+
+    The index must be loaded: without it (or before rebuild() succeeds)
+    post_changed() answers None, meaning that any page may have changed.
+    """
+
+    def __init__(self, index: PostIndex, settings, related: RelatedPosts | None = None) -> None:
+        self.index = index
+        self.settings = settings
+        self.related = related
+        self.graph: SiteGraph | None = None
+
+    def _current(self) -> SiteGraph | None:
+        if not self.index.ready:
+            return None
+        return SiteGraph.from_posts(self.index.published(), self.settings, self.related)
+
+    def rebuild(self) -> None:
+        self.graph = self._current()
+
+    def post_changed(self, post_id: Hashable, _post: object = None) -> set[str] | None:
+        """Pages affected by a change of the post (once applied to the index).
+
+        Also counts the changes that the index picked up from its reloads
+        since the last call.
+        """
+        previous, self.graph = self.graph, self._current()
+        if previous is None or self.graph is None:
+            return None
+        return (
+            previous.changed_pages(self.graph)
+            | previous.pages_of(post_id)
+            | self.graph.pages_of(post_id)
+        )
+
+
+def export_version(settings, template_dir: str = "templates", static_dir: str = "static") -> str:
+    """Changes with everything that changes the pages but not the posts."""
+    return template_version(
+        template_dir,
+        RENDER_FINGERPRINT,
+        StaticManifest(static_dir).version,
+        *(
+            getattr(settings, name)
+            for name in (
+                "url_prefix",
+                "host",
+                "date_format",
+                "copyright_year",
+                "posts_per_page",
+                "disqus_shortname",
+            )
+        ),
+    )
+
+
+def update_export(
+    posts: list,
+    settings,
+    output_dir: str | os.PathLike,
+    workers: int | None = None,
+    template_dir: str = "templates",
+    static_dir: str = "static",
+    related: RelatedPosts | None = None,
+) -> tuple[list[str], list[str]]:
+    """Bring a static export up to date, rendering only the pages that changed.
+
+    The digests of the dependencies of the pages are kept in the output
+    directory: a page is rendered when its digest changed since the last
+    export (or when the templates or settings changed), and the files of
+    pages that no longer exist are deleted. Returns (files written, files
+    deleted).
+    """
+    output_dir = Path(output_dir)
+    manifest_path = output_dir / EXPORT_MANIFEST
+    version = export_version(settings, template_dir, static_dir)
+    previous = {}
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+        if manifest.get("version") == version:
+            previous = manifest["pages"]
+
+    pages = site_pages(posts, settings, related)
+    graph = SiteGraph(pages)
+    digests = {page.path: graph.digest(page.path) for page in pages}
+    stale = [page for page in pages if previous.get(page.path) != digests[page.path]]
+    written = export_site(
+        posts,
+        settings,
+        output_dir,
+        workers=workers,
+        template_dir=template_dir,
+        static_dir=static_dir,
+        pages=stale,
+    )
+    deleted = []
+    for path in sorted(previous.keys() - digests.keys()):
+        filename = ExportPage(path, "", {}).filename
+        (output_dir / filename).unlink(missing_ok=True)
+        deleted.append(filename)
+    manifest_path.write_text(json.dumps({"version": version, "pages": digests}))
+    return written, deleted
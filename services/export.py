@@ -0,0 +1,168 @@
+"""Static export: every public page of the blog rendered to files.
+
+The output directory can be served as is from a bucket or a CDN: each page
+is written to `<path>/index.html` (the front page to `index.html`), next to
+`robots.txt`, `404.html`, the Atom feed `feed.xml` and a copy of the static files (under their plain
+and fingerprinted names). Listings are paginated by path instead of by
+cursor: `/page/2/`, `/tag/<slug>/page/2/`.
+
+Pages are rendered with the templates of the application, in worker
+processes: the posts are read once by the caller and sent to the workers
+with their pages, so the workers never touch Datastore.
+"""
+
+from __future__ import annotations
+
+import functools
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from pathlib import Path
+from typing import Any
+
+from fastapi.templating import Jinja2Templates
+
+from models.blog_post import BlogPost
+from services.feeds import FEED_SIZE, feed_context
+from services.post_index import count_tags
+from services.related import RelatedPosts
+from static_assets import StaticManifest, add_static_url
+
+
+class ExportPage:
+    """A page to render: its URL path, template and template context."""
+
+    __slots__ = ("path", "template", "context")
+
+    def __init__(self, path: str, template: str, context: dict[str, Any]) -> None:
+        self.path = path
+        self.template = template
+        self.context = context
+
+    @property
+    def filename(self) -> str:
+        """File of the page, relative to the output directory."""
+        if "." in self.path.rsplit("/", 1)[-1]:
+            return self.path.lstrip("/")  # robots.txt, 404.html
+        return (self.path.strip("/") + "/index.html").lstrip("/")
+
+
+def listing_path(base: str, number: int) -> str:
+    """Path of the page `number` (from 1) of a listing at `base` ("/" or "/tag/<slug>/")."""
+    return base if number == 1 else f"{base}page/{number}/"
+
+
+def _listing_pages(
+    base: str, posts: list[BlogPost], per_page: int, context: dict[str, Any]
+) -> list[ExportPage]:
+    chunks = [posts[i : i + per_page] for i in range(0, len(posts), per_page)] or [[]]
+    pages = []
+    for number, chunk in enumerate(chunks, start=1):
+        prev_page = listing_path(base, number - 1) if number > 1 else None
+        next_page = listing_path(base, number + 1) if number < len(chunks) else None
+        page_context = {**context, "posts": chunk, "prev_page": prev_page, "next_page": next_page}
+        pages.append(ExportPage(listing_path(base, number), "listing.html", page_context))
+    return pages
+
+
+def site_pages(
+    posts: list[BlogPost], settings, related: RelatedPosts | None = None
+) -> list[ExportPage]:
+    """Every public page of the site, given the published posts (newest first).
+
+    Post pages list their `related` posts, if given.
+    """
+    common = {"settings": settings, "copyright_year": settings.copyright_year}
+    per_page = settings.posts_per_page
+
+    pages = _listing_pages("/", posts, per_page, common)
+    for slug in sorted({slug for post in posts for slug in post.slugs}):
+        tagged = [post for post in posts if slug in post.slugs]
+        context = {**common, "title": f"Posts tagged with '{slug}'"}
+        pages += _listing_pages(f"/tag/{slug}/", tagged, per_page, context)
+    for i, post in enumerate(posts):
+        # Posts are newest first: the previous post is the next one in the list.
+        neighbours = {
+            "prev": posts[i + 1] if i + 1 < len(posts) else None,
+            "next": posts[i - 1] if i > 0 else None,
+        }
+        context = {**common, "post": post, "path": post.path, **neighbours}
+        if related is not None:
+            context["related"] = related.get(post.key.id_or_name)
+        pages.append(ExportPage(post.path, "post.html", context))
+
+    by_year = [list(group) for _year, group in groupby(posts, key=lambda post: post.published.year)]
+    pages.append(ExportPage("/archive/", "archive.html", {**common, "by_year": by_year}))
+    pages.append(ExportPage("/tags/", "tags.html", {**common, "tags": count_tags(posts)}))
+    pages.append(ExportPage("/bestof/", "bestof.html", common))
+    pages.append(ExportPage("/about/", "about.html", common))
+    pages.append(ExportPage("/404.html", "404.html", common))
+    pages.append(ExportPage("/robots.txt", "robots.txt", common))
+    pages.append(ExportPage("/feed.xml", "feed.xml", feed_context(posts[:FEED_SIZE], settings)))
+    return pages
+
+
+@functools.cache
+def _templates(directory: str) -> Jinja2Templates:
+    # One template environment per worker process.
+    return add_static_url(Jinja2Templates(directory=directory))
+
+
+def render_page(page: ExportPage, output_dir: str, template_dir: str = "templates") -> str:
+    """Render a page to its file under `output_dir`; returns the file name."""
+    template = _templates(template_dir).get_template(page.template)
+    target = Path(output_dir) / page.filename
+    target.parent.mkdir(parents=True, exist_ok=True)
+    target.write_text(template.render(page.context), encoding="utf-8")
+    return page.filename
+
+
+def copy_static(static_dir: str | os.PathLike, output_dir: str | os.PathLike) -> int:
+    """Copy the static files under `output_dir`/static, with their fingerprinted names too."""
+    manifest = StaticManifest(static_dir)
+    target = Path(output_dir) / "static"
+    for path, name in manifest.names.items():
+        source = Path(static_dir) / path
+        stat_result = source.stat()
+        for relative in (path, name):
+            destination = target / relative
+            if destination.exists():
+                copied = destination.stat()
+                if (copied.st_size, copied.st_mtime) == (stat_result.st_size, stat_result.st_mtime):
+                    continue  # Copied by a previous export.
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(source, destination)
+    return len(manifest.names)
+
+
+def export_site(
+    posts: list[BlogPost],
+    settings,
+    output_dir: str | os.PathLike,
+    workers: int | None = None,
+    template_dir: str = "templates",
+    static_dir: str = "static",
+    pages: list[ExportPage] | None = None,
+    related: RelatedPosts | None = None,
+) -> list[str]:
+    """Render the site under `output_dir`; returns the files of the pages.
+
+    `posts` are the published posts, newest first, and `pages` the pages to
+    render (all the pages of the site by default). With `workers` = 1 the
+    pages are rendered in this process, otherwise in a pool of processes
+    (as many as CPUs by default).
+    """
+    output_dir = os.fspath(output_dir)
+    if pages is None:
+        pages = site_pages(posts, settings, related)
+    copy_static(static_dir, output_dir)
+    if not pages:
+        return []
+    render = functools.partial(render_page, output_dir=output_dir, template_dir=template_dir)
+    if workers == 1:
+        return [render(page) for page in pages]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Chunks amortize sending the posts to the workers.
+        chunksize = max(1, len(pages) // (4 * (workers or os.cpu_count() or 1)))
+        return list(executor.map(render, pages, chunksize=chunksize))
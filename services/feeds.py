@@ -0,0 +1,81 @@
+"""Feeds of the latest posts: Atom (/feed.xml) and /lastpost.json.
+
+Entries carry the full rendering of the posts, as stored with them (see
+BlogPost.prerender), with their links made absolute for feed readers. The
+documents only change when a post is published or edited: the application
+renders them once per change (see main.get_feed) and answers the polls of
+feed readers with 304 Not Modified.
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+from typing import Any
+
+from models.blog_post import BlogPost
+from utils import absolutify_url
+
+# Number of posts in the Atom feed.
+FEED_SIZE = 10
+ATOM_MEDIA_TYPE = "application/atom+xml; charset=utf-8"
+JSON_MEDIA_TYPE = "application/json"
+
+
+def rfc3339(value: datetime.datetime) -> str:
+    """Timestamp of an Atom document (naive datetimes are UTC)."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.UTC)
+    return value.astimezone(datetime.UTC).isoformat(timespec="seconds").replace("+00:00", "Z")
+
+
+def base_url(settings) -> str:
+    """Absolute URL of the root of the blog (without trailing slash)."""
+    return settings.host.rstrip("/") + settings.url_prefix.rstrip("/")
+
+
+class FeedEntry:
+    """A post as shown in the Atom feed."""
+
+    __slots__ = ("post", "base", "url", "published", "updated")
+
+    def __init__(self, post: BlogPost, base: str) -> None:
+        self.post = post
+        self.base = base
+        self.url = base + post.path
+        self.published = rfc3339(post.published)
+        self.updated = rfc3339(post.updated or post.published)
+
+    @property
+    def content(self) -> str:
+        # Read when rendering only: the pages of the site graph hold IndexedPosts.
+        return absolutify_url(self.post.rendered, self.base)
+
+
+def feed_context(posts: list[BlogPost], settings) -> dict[str, Any]:
+    """Context of the feed.xml template, given the latest posts (newest first)."""
+    base = base_url(settings)
+    dates = [post.updated or post.published for post in posts]
+    return {
+        "settings": settings,
+        "base_url": base,
+        "posts": posts,
+        "entries": [FeedEntry(post, base) for post in posts],
+        "updated": rfc3339(max(dates)) if dates else rfc3339(datetime.datetime(2000, 1, 1)),
+    }
+
+
+def lastpost_json(post: BlogPost | None, settings) -> str:
+    """The latest post, as the JSON document embedded by other sites."""
+    if post is None:
+        return json.dumps({}, indent=4)
+    base = base_url(settings)
+    data = {
+        "path": post.path,
+        "url": base + post.path,
+        "title": post.title,
+        "summary": absolutify_url(post.summary, base),
+        "tag_pairs": post.tag_pairs,
+        "pubdate": post.published.strftime("%B %d, %Y"),
+    }
+    return json.dumps(data, indent=4)
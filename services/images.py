@@ -0,0 +1,491 @@
+"""Post images: where they are stored, and an on-instance disk cache.
+
+Images are read through an ImageSource: the Cloud Storage bucket in
+production, or a local directory (development, tests). Once uploaded, post
+images practically never change, so ImageDiskCache keeps their bytes on the
+local disk (e.g. under /tmp on Cloud Run), keyed by path and generation.
+Cached images are then served with sendfile, without any download from the
+bucket. Metadata lookups are cached for a short while, so a hot image does not
+even cost a metadata request.
+
+A file being sent is pinned: evicting it only unlinks it once released.
+"""
+
+from __future__ import annotations
+
+import datetime
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import BinaryIO
+
+from google.cloud import storage
+
+from services.cache import TTLCache
+from services.storage import iter_blob
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow is optional: without it, only originals are served.
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Pillow format name and media type of the formats that variants can take.
+VARIANT_FORMATS = {
+    "avif": ("AVIF", "image/avif"),
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+# Originals that can be resized (animated GIFs, SVGs... are always sent as is).
+RESIZABLE_MEDIA_TYPES = {"image/jpeg": "jpeg", "image/png": "png", "image/webp": "webp"}
+# Variant formats tried by content negotiation, best first.
+NEGOTIATED_FORMATS = ("avif", "webp")
+ENCODER_OPTIONS = {
+    "avif": {"quality": 60},
+    "webp": {"quality": 80, "method": 4},
+    "jpeg": {"quality": 85, "optimize": True, "progressive": True},
+    "png": {"optimize": True},
+}
+
+
+class ImageObject:
+    """Metadata of one version of an image."""
+
+    def __init__(
+        self,
+        name: str,
+        generation: int,
+        size: int,
+        updated: datetime.datetime | None = None,
+        content_type: str | None = None,
+        handle: object = None,
+    ) -> None:
+        self.name = name
+        self.generation = generation
+        self.size = size
+        self.updated = updated
+        self.content_type = content_type
+        # Object of the source standing for this version (e.g. a storage.Blob).
+        self.handle = handle
+
+    @property
+    def media_type(self) -> str:
+        mime_type, _ = mimetypes.guess_type(self.name)
+        return mime_type or self.content_type or "application/octet-stream"
+
+    @property
+    def etag(self) -> str:
+        # The generation changes whenever the object is overwritten.
+        return f'"{self.generation}"'
+
+
+class ImageSource(ABC):
+    """Where the images are stored."""
+
+    @abstractmethod
+    def stat(self, name: str) -> ImageObject | None:
+        """Metadata of the current version of `name`, None if there is no such image."""
+
+    @abstractmethod
+    def iter_bytes(
+        self, image: ImageObject, start: int = 0, end: int | None = None
+    ) -> Iterator[bytes]:
+        """Yield the bytes `start` to `end` (inclusive) of this version of the image."""
+
+    def download(self, image: ImageObject, file: BinaryIO) -> None:
+        """Write the whole image to `file`."""
+        for chunk in self.iter_bytes(image):
+            file.write(chunk)
+
+
+class GCSImageSource(ImageSource):
+    """Images stored in a Cloud Storage bucket."""
+
+    def __init__(self, bucket_name: str, get_client: Callable[[], storage.Client]) -> None:
+        self.bucket_name = bucket_name
+        self._get_client = get_client
+
+    def _bucket(self) -> storage.Bucket:
+        return self._get_client().bucket(self.bucket_name)
+
+    def stat(self, name: str) -> ImageObject | None:
+        blob = self._bucket().get_blob(name)
+        if blob is None:
+            return None
+        return ImageObject(
+            name, blob.generation, blob.size or 0, blob.updated, blob.content_type, handle=blob
+        )
+
+    def iter_bytes(
+        self, image: ImageObject, start: int = 0, end: int | None = None
+    ) -> Iterator[bytes]:
+        return iter_blob(image.handle, start, end)
+
+
+class LocalImageSource(ImageSource):
+    """Images stored in a local directory (development and tests).
+
+    The modification time of a file stands for its generation.
+    """
+
+    def __init__(self, directory: str | os.PathLike, chunk_size: int = 1024 * 1024) -> None:
+        self.directory = Path(directory)
+        self.chunk_size = chunk_size
+
+    def stat(self, name: str) -> ImageObject | None:
+        path = self.directory / name
+        try:
+            stat_result = path.stat()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not path.is_file():
+            return None
+        updated = datetime.datetime.fromtimestamp(stat_result.st_mtime, datetime.UTC)
+        return ImageObject(name, stat_result.st_mtime_ns, stat_result.st_size, updated)
+
+    def iter_bytes(
+        self, image: ImageObject, start: int = 0, end: int | None = None
+    ) -> Iterator[bytes]:
+        if end is None:
+            end = image.size - 1
+        with open(self.directory / image.name, "rb") as file:
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = file.read(min(self.chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+
+
+def supported_formats() -> set[str]:
+    """Variant formats that the installed Pillow can encode (empty without Pillow)."""
+    if Image is None:
+        return set()
+    return {name for name in VARIANT_FORMATS if name in ("jpeg", "png") or features.check(name)}
+
+
+def accepts(accept: str | None, media_type: str) -> bool:
+    """True if an Accept header lists `media_type` explicitly with a non-zero quality."""
+    for media_range in (accept or "").split(","):
+        name, *params = (part.strip() for part in media_range.split(";"))
+        if name.lower() != media_type:
+            continue
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def is_negotiated(width: int | None, image_format: str | None) -> bool:
+    """True if the format of the response depends on the Accept header."""
+    return image_format == "auto" or (image_format is None and width is not None)
+
+
+class ImageVariant:
+    """A resized and/or re-encoded version of an image."""
+
+    def __init__(self, width: int | None, image_format: str) -> None:
+        self.width = width
+        self.format = image_format
+
+    @property
+    def key(self) -> str:
+        return f"w{self.width or 0}.{self.format}"
+
+    @property
+    def media_type(self) -> str:
+        return VARIANT_FORMATS[self.format][1]
+
+    def etag(self, image: ImageObject) -> str:
+        return f'"{image.generation}-{self.key}"'
+
+
+def choose_variant(
+    image: ImageObject, width: int | None, image_format: str | None, accept: str | None
+) -> ImageVariant | None:
+    """The variant to send for the width and format query parameters, None for the original.
+
+    Without a format, a width implies "auto": AVIF or WebP when the Accept
+    header allows it and Pillow can encode it, else the format of the original.
+    """
+    original_format = RESIZABLE_MEDIA_TYPES.get(image.media_type)
+    supported = supported_formats()
+    if original_format is None or not supported:
+        return None
+    if is_negotiated(width, image_format):
+        for name in NEGOTIATED_FORMATS:
+            if name in supported and accepts(accept, VARIANT_FORMATS[name][1]):
+                return ImageVariant(width, name)
+        image_format = "original"
+    if image_format in (None, "original") or image_format not in supported:
+        if width is None:
+            return None
+        image_format = original_format
+    return ImageVariant(width, image_format)
+
+
+def render_variant(data: bytes, variant: ImageVariant) -> bytes:
+    """Decode an image, shrink it to the variant width if wider, and encode it."""
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        if variant.width is not None and image.width > variant.width:
+            height = max(1, round(image.height * variant.width / image.width))
+            image = image.resize((variant.width, height), Image.Resampling.LANCZOS)
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        if variant.format == "jpeg":
+            if has_alpha:
+                background = Image.new("RGB", image.size, "white")
+                background.paste(image.convert("RGBA"), mask=image.convert("RGBA"))
+                image = background
+            else:
+                image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA" if has_alpha else "RGB")
+        buffer = io.BytesIO()
+        pillow_format = VARIANT_FORMATS[variant.format][0]
+        image.save(buffer, format=pillow_format, **ENCODER_OPTIONS[variant.format])
+    return buffer.getvalue()
+
+
+class ImageDiskCache:
+    """Image files on the local disk, least recently used evicted past `max_bytes`.
+
+    Files are named after a hash of the image path and the generation, and
+    written atomically (temporary file, then rename), so that readers never
+    see a partial image. Files already in the directory (from a previous
+    process) are adopted at startup.
+
+    Files returned with `pin=True` stay on disk until `release`d, even when
+    evicted meanwhile (they no longer count in the total size then).
+
+    Args:
+        directory: Cache directory, created if needed.
+        max_bytes: Maximum total size of the cached files.
+        metadata_ttl: Seconds that the metadata of an image is reused before
+            asking the source again (0 asks every time).
+        max_metadata: Maximum number of images whose metadata is kept.
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike,
+        max_bytes: int,
+        metadata_ttl: float = 300,
+        max_metadata: int = 4096,
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.metadata_ttl = metadata_ttl
+        self._lock = threading.Lock()
+        self._files: OrderedDict[str, int] = OrderedDict()  # File name -> size.
+        self._total_bytes = 0
+        self._metadata = TTLCache(ttl=metadata_ttl, max_entries=max_metadata)
+        self._downloads: dict[str, threading.Lock] = {}
+        # Files being sent (name -> count), and those to unlink once released.
+        self._pins: Counter[str] = Counter()
+        self._unlink_on_release: set[str] = set()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._adopt_existing_files()
+
+    def _adopt_existing_files(self) -> None:
+        entries = []
+        for path in self.directory.iterdir():
+            if path.name.startswith(".") or not path.is_file():
+                continue
+            stat_result = path.stat()
+            entries.append((stat_result.st_atime, path.name, stat_result.st_size))
+        for _atime, name, size in sorted(entries):
+            self._files[name] = size
+            self._total_bytes += size
+        self._evict()
+
+    @staticmethod
+    def _prefix(name: str) -> str:
+        return hashlib.sha256(name.encode()).hexdigest()[:32]
+
+    def _file_name(self, image: ImageObject, variant: ImageVariant | None = None) -> str:
+        suffix = f"-{variant.key}" if variant is not None else Path(image.name).suffix.lower()
+        return f"{self._prefix(image.name)}-{image.generation}{suffix}"
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def stat(self, source: ImageSource, name: str) -> ImageObject | None:
+        """Metadata of an image, asked to `source` at most every `metadata_ttl` seconds."""
+        image = self._metadata.get_or_compute(name, lambda: source.stat(name))
+        if image is None:
+            self._metadata.pop(name)  # Missing images are asked again every time.
+        return image
+
+    def get(
+        self, image: ImageObject, variant: ImageVariant | None = None, pin: bool = False
+    ) -> Path | None:
+        """Path of the cached file for this version (or variant) of the image, if any.
+
+        With `pin`, the file stays on disk until `release`d.
+        """
+        file_name = self._file_name(image, variant)
+        with self._lock:
+            if file_name not in self._files:
+                return None
+            self._files.move_to_end(file_name)
+            if pin:
+                self._pins[file_name] += 1
+        path = self.directory / file_name
+        if not path.exists():
+            # Removed behind our back (e.g. /tmp cleaned up).
+            if pin:
+                self.release(path)
+            self._forget(file_name)
+            return None
+        return path
+
+    def release(self, path: Path) -> None:
+        """Unpin a file returned with `pin=True`, unlinking it if it was evicted meanwhile."""
+        with self._lock:
+            self._pins[path.name] -= 1
+            if self._pins[path.name] > 0:
+                return
+            del self._pins[path.name]
+            if path.name not in self._unlink_on_release:
+                return
+            self._unlink_on_release.discard(path.name)
+        path.unlink(missing_ok=True)
+
+    def _unlink(self, names: list[str]) -> None:
+        with self._lock:
+            pinned = {name for name in names if name in self._pins}
+            self._unlink_on_release.update(pinned)
+        for name in names:
+            if name not in pinned:
+                (self.directory / name).unlink(missing_ok=True)
+
+    def fetch(
+        self,
+        source: ImageSource,
+        image: ImageObject,
+        variant: ImageVariant | None = None,
+        pin: bool = False,
+    ) -> Path | None:
+        """Path of the cached file, downloading (or rendering the variant) first if needed.
+
+        Returns None when the file does not fit in the cache or could not be
+        made (the caller then streams the original from the source). With
+        `pin`, the file stays on disk until `release`d.
+        """
+        if variant is None and image.size > self.max_bytes:
+            return None
+        path = self.get(image, variant, pin)
+        if path is not None:
+            return path
+
+        file_name = self._file_name(image, variant)
+        with self._lock:
+            download_lock = self._downloads.setdefault(file_name, threading.Lock())
+        # Concurrent requests for the same file wait for a single download.
+        with download_lock:
+            path = self.get(image, variant, pin)
+            if path is not None:
+                return path
+            try:
+                if variant is None:
+                    self._store(image, file_name, lambda file: source.download(image, file))
+                else:
+                    data = render_variant(self._original_bytes(source, image), variant)
+                    self._store(image, file_name, lambda file: file.write(data))
+            except Exception:
+                logger.warning("Could not cache image %s", image.name, exc_info=True)
+                return None
+            finally:
+                with self._lock:
+                    self._downloads.pop(file_name, None)
+        return self.get(image, variant, pin)
+
+    def _original_bytes(self, source: ImageSource, image: ImageObject) -> bytes:
+        path = self.fetch(source, image, pin=True)
+        if path is not None:
+            try:
+                return path.read_bytes()
+            finally:
+                self.release(path)
+        buffer = io.BytesIO()
+        source.download(image, buffer)
+        return buffer.getvalue()
+
+    def _store(
+        self, image: ImageObject, file_name: str, write: Callable[[BinaryIO], object]
+    ) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                write(file)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self.directory / file_name)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        prefix = self._prefix(image.name) + "-"
+        generation = str(image.generation)
+
+        def is_stale(name: str) -> bool:
+            # Files of older generations of the image (original and variants).
+            rest = name[len(prefix) :]
+            return name.startswith(prefix) and rest.split("-")[0].split(".")[0] != generation
+
+        with self._lock:
+            stale = [name for name in self._files if is_stale(name)]
+            for name in stale:
+                self._total_bytes -= self._files.pop(name)
+            self._total_bytes -= self._files.pop(file_name, 0)
+            self._files[file_name] = size
+            self._total_bytes += size
+            self._unlink_on_release.discard(file_name)
+        self._unlink(stale)
+        self._evict()
+
+    def _evict(self) -> None:
+        evicted = []
+        with self._lock:
+            while self._total_bytes > self.max_bytes and self._files:
+                name, size = self._files.popitem(last=False)
+                self._total_bytes -= size
+                evicted.append(name)
+        self._unlink(evicted)
+
+    def _forget(self, file_name: str) -> None:
+        with self._lock:
+            size = self._files.pop(file_name, None)
+            if size is not None:
+                self._total_bytes -= size
+
+    def clear(self) -> None:
+        """Remove every cached file."""
+        with self._lock:
+            self._files.clear()
+            self._total_bytes = 0
+            self._metadata.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._files)
@@ -0,0 +1,108 @@
+"""Opaque cursor tokens for keyset pagination of post listings.
+
+A listing page is identified by the post at its boundary, its `published`
+timestamp and key, and a direction: "older" pages hold the posts after the
+boundary in the listing order (-published, -__key__), "newer" pages the
+posts before it. The key breaks the ties between posts published at the
+same time. Fetching any page is then a range query limited to the page
+size, whatever its depth, unlike offsets which Datastore scans and bills.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import datetime
+from typing import Literal
+
+Direction = Literal["older", "newer"]
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.UTC)
+_PREFIXES: dict[Direction, str] = {"older": "o", "newer": "n"}
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor token cannot be decoded."""
+
+
+class PageCursor:
+    """Position in a listing: the boundary post (timestamp and key ID) and the
+    direction to read."""
+
+    def __init__(
+        self,
+        published: datetime.datetime,
+        direction: Direction,
+        key_id: int | str,
+    ) -> None:
+        if published.tzinfo is None:
+            published = published.replace(tzinfo=datetime.UTC)  # Assume UTC.
+        self.published = published
+        self.direction: Direction = direction
+        self.key_id = key_id
+
+    def encode(self) -> str:
+        micros = (self.published - _EPOCH) // datetime.timedelta(microseconds=1)
+        key = f"i{self.key_id}" if isinstance(self.key_id, int) else f"n{self.key_id}"
+        raw = f"{_PREFIXES[self.direction]}{micros}.{key}"
+        return base64.urlsafe_b64encode(raw.encode()).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def decode(token: str) -> PageCursor:
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+            direction = next(d for d, prefix in _PREFIXES.items() if raw[:1] == prefix)
+            timestamp, _dot, key = raw[1:].partition(".")
+            published = _EPOCH + datetime.timedelta(microseconds=int(timestamp))
+            key_id: int | str
+            if key[:1] == "i":
+                key_id = int(key[1:])
+            elif key[:1] == "n" and key[1:]:
+                key_id = key[1:]
+            else:
+                raise ValueError(key)
+        except (binascii.Error, UnicodeDecodeError, StopIteration, ValueError, OverflowError):
+            raise InvalidCursor(token) from None
+        return PageCursor(published, direction, key_id)
+
+    def __eq__(self, other: object) -> bool:
+        return (
+            isinstance(other, PageCursor)
+            and self.published == other.published
+            and self.direction == other.direction
+            and self.key_id == other.key_id
+        )
+
+    def __repr__(self) -> str:
+        return f"PageCursor({self.published.isoformat()}, {self.direction}, {self.key_id!r})"
+
+
+class PostPage:
+    """One page of a post listing with the cursors of its neighbouring pages.
+
+    `prev_cursor` is None on the first page; `prev_is_first` is True when the
+    previous page is the first one (link to the listing without a cursor).
+    `next_cursor` is None on the last page.
+    """
+
+    def __init__(
+        self,
+        posts: list,
+        next_cursor: str | None = None,
+        prev_cursor: str | None = None,
+        prev_is_first: bool = False,
+    ) -> None:
+        self.posts = posts
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.prev_is_first = prev_is_first
+
+    def prev_url(self, base: str) -> str | None:
+        """URL of the previous (newer) page under `base`, e.g. "/" or "/tag/x"."""
+        if self.prev_is_first:
+            return base
+        return f"{base}?cursor={self.prev_cursor}" if self.prev_cursor else None
+
+    def next_url(self, base: str) -> str | None:
+        """URL of the next (older) page under `base`."""
+        return f"{base}?cursor={self.next_cursor}" if self.next_cursor else None
@@ -0,0 +1,419 @@
+"""In-memory index of post metadata.
+
+The whole blog is a few hundred posts, so their metadata (everything but the
+body and its renderings) fits comfortably in memory. When enabled, the index
+is loaded at startup and reloaded in the background at a fixed interval, which
+bounds how stale it gets on instances that did not handle a write. A reload
+reads the dates of every post (a projection) and only the entities of the
+posts that are new or have other dates than in the index. Writes on
+this instance are applied at once through the post change listeners of
+services.blog. Listings and path lookups then run without queries, and only
+the posts actually displayed are read from Datastore, by key.
+"""
+
+from __future__ import annotations
+
+import datetime
+import logging
+import math
+import threading
+from bisect import bisect_left, bisect_right
+from collections.abc import Callable, Hashable
+
+from google.cloud import datastore
+
+from models.blog_post import BlogPost
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of keys of a Datastore lookup.
+_LOOKUP_BATCH = 1000
+
+
+class IndexedPost:
+    """Metadata of a post, as kept in the index (no body, no renderings).
+
+    Tags are sorted and without duplicates, each with its slug: the order in
+    which a projection query returns them (see blog._query_published_meta),
+    so that the index and the projections agree. Post pages, which read the
+    whole post, show the tags in the order of the author.
+    """
+
+    __slots__ = ("key", "title", "path", "published", "updated", "tags", "slugs", "difficulty")
+
+    def __init__(
+        self,
+        key: datastore.Key,
+        title: str | None = None,
+        path: str | None = None,
+        published: datetime.datetime | None = None,
+        updated: datetime.datetime | None = None,
+        tags: list[str] | None = None,
+        slugs: list[str] | None = None,
+        difficulty: int = 0,
+    ) -> None:
+        self.key = key
+        self.title = title
+        self.path = path
+        self.published = published
+        self.updated = updated
+        tags = tags or []
+        slugs = slugs or []
+        pairs = sorted(set(zip(tags, slugs, strict=False)))
+        self.tags = [tag for tag, _slug in pairs]
+        # Slugs without a tag (there should be none) keep their place at the end.
+        self.slugs = [slug for _tag, slug in pairs] + slugs[len(tags) :]
+        self.difficulty = difficulty
+
+    @staticmethod
+    def from_datastore_entity(entity: datastore.Entity) -> IndexedPost:
+        return IndexedPost(
+            key=entity.key,
+            title=entity.get("title"),
+            path=entity.get("path"),
+            published=entity.get("published"),
+            updated=entity.get("updated"),
+            tags=entity.get("tags", []),
+            slugs=entity.get("slugs", []),
+            difficulty=entity.get("difficulty", 0),
+        )
+
+    @staticmethod
+    def from_post(post: BlogPost) -> IndexedPost:
+        return IndexedPost(
+            key=post.key,
+            title=post.title,
+            path=post.path,
+            published=post.published,
+            updated=post.updated,
+            tags=post.tags,
+            slugs=post.slugs,
+            difficulty=post.difficulty,
+        )
+
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.UTC)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+class _Descending:
+    """A key ID in reverse order (Datastore orders integer IDs before names)."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, key_id: Hashable) -> None:
+        self.value = (isinstance(key_id, str), key_id)
+
+    def __lt__(self, other: _Descending) -> bool:
+        return other.value < self.value
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _Descending) and self.value == other.value
+
+
+def _sort_key(published: datetime.datetime | None, key_id: Hashable = None) -> tuple:
+    """Ascending key of the listing order (-published, -__key__), exact to the microsecond.
+
+    Posts without a publication date (never public) sort last. Without a key
+    ID, the key sorts before the posts published at that time.
+    """
+    if published is None:
+        micros = -math.inf
+    else:
+        if published.tzinfo is None:
+            published = published.replace(tzinfo=datetime.UTC)  # Assume UTC.
+        micros = (published - _EPOCH) // _MICROSECOND
+    return (-micros,) if key_id is None else (-micros, _Descending(key_id))
+
+
+def _post_sort_key(post: IndexedPost) -> tuple:
+    return _sort_key(post.published, post.key.id_or_name)
+
+
+class _Listing:
+    """Posts of a listing (all of them, or those with a tag), in the listing order.
+
+    Their sort keys are kept alongside, so that finding where the published
+    posts start (after the drafts) or where a cursor falls is a bisection:
+    a page of a listing costs O(log n + page size).
+    """
+
+    def __init__(self, posts: list[IndexedPost]) -> None:
+        self.posts = posts
+        self.keys = [_post_sort_key(post) for post in posts]
+
+    def bounds(self, now: datetime.datetime) -> tuple[int, int]:
+        """Slice of the published posts: dated, and not in the future."""
+        return bisect_left(self.keys, _sort_key(now)), bisect_left(self.keys, _sort_key(None))
+
+
+def read_post_dates(
+    db: datastore.Client,
+) -> dict[Hashable, tuple[datastore.Key, datetime.datetime | None, datetime.datetime | None]]:
+    """Key, publication and update dates of every post, by ID (a projection query).
+
+    Saving a published post changes its update date: comparing the dates with
+    those of a copy tells which posts changed since (see lookup_posts).
+    """
+    query = db.query(kind="BlogPost")
+    query.projection = ["published", "updated"]
+    return {
+        entity.key.id_or_name: (entity.key, entity.get("published"), entity.get("updated"))
+        for entity in query.fetch()
+    }
+
+
+def lookup_posts(db: datastore.Client, keys: list[datastore.Key]) -> list[datastore.Entity]:
+    """Entities of posts by key, in batches (deleted posts are skipped)."""
+    entities = []
+    for start in range(0, len(keys), _LOOKUP_BATCH):
+        entities += db.get_multi(keys[start : start + _LOOKUP_BATCH])
+    return entities
+
+
+def _tag_pairs(post) -> list[tuple[str, str]]:
+    # The slugs decide where a post is listed; the tags give their names.
+    return [
+        (slug, post.tags[i] if i < len(post.tags) else slug) for i, slug in enumerate(post.slugs)
+    ]
+
+
+class TagCount:
+    """A tag of the tag cloud: slug, display name and number of published posts.
+
+    `size` goes from 1 (least used tags) to 5 (most used), on a log scale.
+    """
+
+    __slots__ = ("slug", "name", "count", "size")
+
+    def __init__(self, slug: str, name: str, count: int) -> None:
+        self.slug = slug
+        self.name = name
+        self.count = count
+        self.size = 1
+
+    def __repr__(self) -> str:
+        return f"TagCount({self.slug!r}, {self.name!r}, {self.count})"
+
+
+def size_tags(tags: list[TagCount]) -> list[TagCount]:
+    """Set the sizes of the tags of a cloud; returns them sorted by name."""
+    most = max((tag.count for tag in tags), default=1)
+    for tag in tags:
+        tag.size = 1 + round(4 * math.log(tag.count) / math.log(most)) if most > 1 else 1
+    return sorted(tags, key=lambda tag: (tag.name.lower(), tag.slug))
+
+
+def count_tags(posts: list) -> list[TagCount]:
+    """Tag cloud of posts (BlogPost or IndexedPost, all counted), sorted by name."""
+    tags: dict[str, TagCount] = {}
+    for post in posts:
+        for slug, name in _tag_pairs(post):
+            if slug not in tags:
+                tags[slug] = TagCount(slug, name, 0)
+            tags[slug].count += 1
+    return size_tags(list(tags.values()))
+
+
+class _Snapshot:
+    """Immutable view of the index: readers never see a half-applied change."""
+
+    def __init__(self, posts: list[IndexedPost]) -> None:
+        self.posts = sorted(posts, key=_post_sort_key)
+        self.by_id = {post.key.id_or_name: post for post in self.posts}
+        self.position = {post.key.id_or_name: i for i, post in enumerate(self.posts)}
+        self.by_path = {post.path: post for post in self.posts if post.path}
+        self.listing = _Listing(self.posts)
+        # Tag slug -> posts with the tag.
+        tagged: dict[str, list[IndexedPost]] = {}
+        for post in self.posts:
+            for slug, _name in _tag_pairs(post):
+                tagged.setdefault(slug, []).append(post)
+        self.by_tag = {slug: _Listing(tag_posts) for slug, tag_posts in tagged.items()}
+
+    def get_listing(self, tag: str | None) -> _Listing:
+        if tag is None:
+            return self.listing
+        return self.by_tag.get(tag) or _Listing([])
+
+
+class PostIndex:
+    """Snapshot of the metadata of every post, refreshed in the background.
+
+    The index is not `ready` until its first successful load; callers fall
+    back to Datastore queries until then (and when the index is disabled).
+    """
+
+    def __init__(self) -> None:
+        self._snapshot: _Snapshot | None = None
+        self._lock = threading.Lock()
+        # Incremented by every change applied, so that a reload started before
+        # a change does not overwrite it with older data.
+        self._generation = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.loaded_at: datetime.datetime | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    def load(self, db: datastore.Client) -> bool:
+        """Read the metadata of all posts and swap in a new snapshot.
+
+        Posts whose dates (`published`, `updated`) match the current snapshot
+        are kept as they are: the others are read by key. Edits that keep both
+        dates (those of drafts) show on other instances when the post is
+        published. Returns False if a change was applied during the load (the
+        snapshot is then kept and the next reload catches up).
+        """
+        generation = self._generation
+        known = self._snapshot.by_id if self._snapshot is not None else {}
+        posts = []
+        changed = []
+        for post_id, (key, published, updated) in read_post_dates(db).items():
+            post = known.get(post_id)
+            if post is not None and (post.published, post.updated) == (published, updated):
+                posts.append(post)
+            else:
+                changed.append(key)
+        posts += [IndexedPost.from_datastore_entity(entity) for entity in lookup_posts(db, changed)]
+        snapshot = _Snapshot(posts)
+        with self._lock:
+            if self._snapshot is not None and generation != self._generation:
+                return False
+            self._snapshot = snapshot
+            self.loaded_at = datetime.datetime.now(datetime.UTC)
+        logger.info("Post index loaded with %d post(s), %d read", len(posts), len(changed))
+        return True
+
+    def apply_change(self, key_id: Hashable, post: BlogPost | None) -> None:
+        """Post change listener: upsert a saved post, or remove a deleted one."""
+        with self._lock:
+            if self._snapshot is None:
+                return
+            posts = {**self._snapshot.by_id}
+            if post is None:
+                posts.pop(key_id, None)
+            else:
+                posts[key_id] = IndexedPost.from_post(post)
+            self._snapshot = _Snapshot(list(posts.values()))
+            self._generation += 1
+
+    def clear(self) -> None:
+        """Forget the snapshot (the index is no longer ready)."""
+        with self._lock:
+            self._snapshot = None
+            self._generation += 1
+
+    def published(
+        self, tag: str | None = None, now: datetime.datetime | None = None
+    ) -> list[IndexedPost]:
+        """Posts visible to the public (optionally with a tag slug), newest first."""
+        return self.page(tag, now)
+
+    def page(
+        self,
+        tag: str | None = None,
+        now: datetime.datetime | None = None,
+        direction: str | None = None,
+        boundary: datetime.datetime | None = None,
+        offset: int = 0,
+        limit: int | None = None,
+        boundary_id: Hashable = None,
+    ) -> list[IndexedPost]:
+        """A page of the published posts (optionally with a tag slug).
+
+        Without a direction, the posts are newest first from `offset`. With
+        direction "older", they are the posts after the boundary post (published
+        at `boundary`, with key ID `boundary_id`) in the order (-published,
+        -__key__); with "newer" the posts before it, oldest first.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+        listing = snapshot.get_listing(tag)
+        start, end = listing.bounds(now or datetime.datetime.now(datetime.UTC))
+        if direction == "newer":
+            end = min(end, bisect_left(listing.keys, _sort_key(boundary, boundary_id))) - offset
+            first = start if limit is None else max(start, end - limit)
+            return listing.posts[first:end][::-1] if end > first else []
+        if direction == "older":
+            start = max(start, bisect_right(listing.keys, _sort_key(boundary, boundary_id)))
+        start += offset
+        stop = end if limit is None else min(end, start + limit)
+        return listing.posts[start:stop]
+
+    def count(self, tag: str | None = None, now: datetime.datetime | None = None) -> int:
+        """Number of posts visible to the public (optionally with a tag slug)."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return 0
+        start, end = snapshot.get_listing(tag).bounds(now or datetime.datetime.now(datetime.UTC))
+        return end - start
+
+    def tag_counts(self, now: datetime.datetime | None = None) -> list[TagCount]:
+        """Tag cloud of the published posts, sorted by name."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+        now = now or datetime.datetime.now(datetime.UTC)
+        tags = []
+        for slug, listing in snapshot.by_tag.items():
+            start, end = listing.bounds(now)
+            if end > start:
+                # Named as in the newest post with the tag.
+                name = dict(_tag_pairs(listing.posts[start]))[slug]
+                tags.append(TagCount(slug, name, end - start))
+        return size_tags(tags)
+
+    def neighbours(
+        self, post_id: Hashable, now: datetime.datetime | None = None
+    ) -> tuple[IndexedPost | None, IndexedPost | None]:
+        """The published posts just before and just after a post (older, newer)."""
+        snapshot = self._snapshot
+        if snapshot is None or post_id not in snapshot.position:
+            return None, None
+        now = now or datetime.datetime.now(datetime.UTC)
+        i = snapshot.position[post_id]
+        # Newest first: drafts (future dates) come before, undated posts last.
+        older = snapshot.posts[i + 1] if i + 1 < len(snapshot.posts) else None
+        newer = snapshot.posts[i - 1] if i > 0 else None
+        if older is not None and older.published is None:
+            older = None
+        if newer is not None and (newer.published is None or newer.published > now):
+            newer = None
+        return older, newer
+
+    def get_by_path(self, path: str) -> IndexedPost | None:
+        snapshot = self._snapshot
+        return snapshot.by_path.get(path) if snapshot is not None else None
+
+    def start_refresh(self, get_client: Callable[[], datastore.Client], interval: float) -> None:
+        """Reload the index every `interval` seconds in a daemon thread."""
+        if self._thread is not None or interval <= 0:
+            return
+        self._stop.clear()
+
+        def refresh() -> None:
+            while not self._stop.wait(interval):
+                try:
+                    self.load(get_client())
+                except Exception:
+                    logger.warning("Post index refresh failed", exc_info=True)
+
+        self._thread = threading.Thread(target=refresh, name="post-index-refresh", daemon=True)
+        self._thread.start()
+
+    def stop_refresh(self) -> None:
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def __len__(self) -> int:
+        snapshot = self._snapshot
+        return len(snapshot.posts) if snapshot is not None else 0
+
+
+post_index = PostIndex()
@@ -0,0 +1,290 @@
+"""Related posts: for each post, the posts most similar to it.
+
+Similarity mixes the overlap of the tags (Jaccard index of the slugs) and
+the cosine similarity of the TF-IDF vectors of the texts (the terms of
+services.search, title and tags weighted). The whole corpus is compared at
+once, as a matrix product (NumPy).
+
+The lists are computed ahead of time, when the posts are loaded, and kept
+in memory: a post page reads its list without any query. The scores of all
+pairs of posts are kept too: a post change tokenizes that post only (see
+services.analysis), scores it against the others (one row and one column of
+the matrix) and ranks again only the lists that it enters or leaves.
+"""
+
+from __future__ import annotations
+
+import datetime
+import logging
+import math
+import threading
+from collections import Counter
+from collections.abc import Hashable, Iterable, Mapping
+
+import numpy as np
+
+from models.blog_post import BlogPost
+from services.search import AnalyzedPost, analyze, is_published
+
+logger = logging.getLogger(__name__)
+
+# Share of the tags in the similarity (the text has the rest).
+TAG_WEIGHT = 0.5
+# Changes keep the terms and the IDF of the last build: build again once the
+# changes since outnumber this share of the posts.
+REBUILD_SHARE = 0.25
+
+
+def _vocabulary(vectors: list[Counter]) -> tuple[dict[str, float], dict[str, int]]:
+    """IDF of the terms, and columns of the terms shared by two posts or more.
+
+    The other terms cannot contribute to a similarity, but count in the norms.
+    """
+    frequencies = Counter(term for vector in vectors for term in vector)
+    idf = {term: math.log(len(vectors) / count) for term, count in frequencies.items()}
+    shared = sorted(term for term, count in frequencies.items() if count > 1)
+    return idf, {term: j for j, term in enumerate(shared)}
+
+
+def _text_row(
+    vector: Counter, idf: dict[str, float], columns: dict[str, int], rare: float
+) -> np.ndarray:
+    """Normalized TF-IDF vector of a post (terms unknown to `idf` weigh `rare`)."""
+    weights = {term: (1 + math.log(tf)) * idf.get(term, rare) for term, tf in vector.items()}
+    norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+    row = np.zeros(len(columns))
+    for term, weight in weights.items():
+        if term in columns:
+            row[columns[term]] = weight / norm
+    return row
+
+
+def _tag_row(tag_set: set, columns: dict[str, int]) -> np.ndarray:
+    row = np.zeros(len(columns))
+    row[[columns[slug] for slug in tag_set if slug in columns]] = 1.0
+    return row
+
+
+def _similarities(
+    text: np.ndarray, tags: np.ndarray, sizes: np.ndarray, rows: slice | list[int]
+) -> np.ndarray:
+    """Scores of the posts at `rows` (lines) against every post (columns).
+
+    `sizes` are the numbers of tags of the posts (slugs without a column included).
+    """
+    shared = tags[rows] @ tags.T
+    union = sizes[rows][:, None] + sizes[None, :] - shared
+    jaccard = np.divide(shared, union, out=np.zeros_like(shared), where=union > 0)
+    return TAG_WEIGHT * jaccard + (1 - TAG_WEIGHT) * (text[rows] @ text.T)
+
+
+def _top(scores: np.ndarray, tiebreak: np.ndarray, count: int) -> list[int]:
+    """Positions of the `count` best positive scores (ties: lowest `tiebreak` first)."""
+    candidates = np.flatnonzero(scores > 0)
+    order = np.lexsort((tiebreak[candidates], -scores[candidates]))
+    return candidates[order[:count]].tolist()
+
+
+def rank_related(vectors: list[Counter], tag_sets: list[set], count: int) -> list[list[int]]:
+    """For each post (by position), the positions of the `count` most similar posts.
+
+    `vectors` are the term frequencies of the posts and `tag_sets` their tag
+    slugs. Ties go to the post that comes first.
+    """
+    if len(vectors) < 2 or count <= 0:
+        return [[] for _vector in vectors]
+    idf, columns = _vocabulary(vectors)
+    slugs = {slug: j for j, slug in enumerate(sorted(set().union(*tag_sets)))}
+    text = np.array([_text_row(vector, idf, columns, 0.0) for vector in vectors])
+    tags = np.array([_tag_row(tag_set, slugs) for tag_set in tag_sets])
+    scores = _similarities(text, tags, tags.sum(axis=1), slice(None))
+    np.fill_diagonal(scores, 0.0)
+    tiebreak = np.arange(len(vectors))
+    return [_top(row, tiebreak, count) for row in scores]
+
+
+class _Snapshot:
+    """Immutable view of the lists: readers never see a half-applied change."""
+
+    def __init__(self, posts: list[AnalyzedPost | None], ranked: list[list[int]]) -> None:
+        self.related = {
+            post.key.id_or_name: tuple(posts[j] for j in ranked[i])
+            for i, post in enumerate(posts)
+            if post is not None
+        }
+
+
+class RelatedPosts:
+    """The related posts of every post, kept in memory.
+
+    Only the posts published by now are ranked or listed: drafts and posts
+    scheduled later enter with the change that publishes them (see
+    services.analysis). Empty until built.
+
+    Each post has a position: its row in the matrices of the TF-IDF vectors
+    (`_text`) and of the tags (`_tags`), its row and column in the matrix of
+    the scores. Removed posts keep their position, zeroed, with no list.
+    This state is changed under the lock, and the lists are then published
+    in a new snapshot, which readers use without the lock.
+    """
+
+    def __init__(self, count: int = 5) -> None:
+        self.count = count
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._snapshot: _Snapshot | None = None
+        self._posts: list[AnalyzedPost | None] = []
+        self._positions: dict[Hashable, int] = {}
+        # For each position, the positions of the related posts, most similar first.
+        self._ranked: list[list[int]] | None = None
+        self._idf: dict[str, float] = {}
+        self._rare = 0.0
+        self._columns: dict[str, int] = {}
+        self._slugs: dict[str, int] = {}
+        self._text = np.zeros((0, 0))
+        self._tags = np.zeros((0, 0))
+        self._sizes = np.zeros(0)
+        self._scores = np.zeros((0, 0))
+        # Ties go to the newest post.
+        self._tiebreak = np.zeros(0)
+        self._changes = 0
+
+    def configure(self, count: int) -> None:
+        with self._lock:
+            self.count = count
+            self._reset()
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    def _build(self, posts: list[AnalyzedPost]) -> None:
+        self._reset()
+        self._posts = list(posts)
+        self._positions = {post.key.id_or_name: i for i, post in enumerate(posts)}
+        self._idf, self._columns = _vocabulary([post.terms for post in posts])
+        # Terms unknown to the build weigh as much as the rarest ones.
+        self._rare = math.log(len(posts)) if posts else 0.0
+        slugs = sorted({slug for post in posts for slug in post.slugs})
+        self._slugs = {slug: j for j, slug in enumerate(slugs)}
+        self._text = np.zeros((len(posts), len(self._columns)))
+        self._tags = np.zeros((len(posts), len(self._slugs)))
+        self._sizes = np.zeros(len(posts))
+        self._tiebreak = np.zeros(len(posts))
+        for i, post in enumerate(posts):
+            self._fill(i, post)
+        self._scores = _similarities(self._text, self._tags, self._sizes, slice(None))
+        np.fill_diagonal(self._scores, 0.0)
+        self._ranked = [self._rank(i) for i in range(len(posts))]
+        self._snapshot = _Snapshot(self._posts, self._ranked)
+
+    def _fill(self, i: int, post: AnalyzedPost | None) -> None:
+        self._posts[i] = post
+        if post is None:
+            self._text[i] = 0.0
+            self._tags[i] = 0.0
+            self._sizes[i] = 0.0
+            return
+        slugs = set(post.slugs)
+        self._text[i] = _text_row(post.terms, self._idf, self._columns, self._rare)
+        self._tags[i] = _tag_row(slugs, self._slugs)
+        self._sizes[i] = len(slugs)
+        self._tiebreak[i] = -post.published.timestamp()
+
+    def _rank(self, i: int) -> list[int]:
+        if self._posts[i] is None:
+            return []
+        return _top(self._scores[i], self._tiebreak, self.count)
+
+    def _grow(self, count: int) -> None:
+        self._posts += [None] * count
+        self._ranked += [[] for _position in range(count)]
+        self._text = np.pad(self._text, ((0, count), (0, 0)))
+        self._tags = np.pad(self._tags, ((0, count), (0, 0)))
+        self._sizes = np.pad(self._sizes, (0, count))
+        self._tiebreak = np.pad(self._tiebreak, (0, count))
+        self._scores = np.pad(self._scores, (0, count))
+
+    def _change(self, i: int, post: AnalyzedPost | None) -> None:
+        """Score the post at position `i` again, then rank the lists it may change."""
+        self._fill(i, post)
+        scores = _similarities(self._text, self._tags, self._sizes, [i])[0]
+        scores[i] = 0.0
+        self._scores[i] = scores
+        self._scores[:, i] = scores
+        # Score of the last post of each full list: the post enters the lists it beats.
+        last = np.array(
+            [
+                self._scores[r, ranked[-1]] if len(ranked) == self.count else 0.0
+                for r, ranked in enumerate(self._ranked)
+            ]
+        )
+        rows = {r for r, ranked in enumerate(self._ranked) if i in ranked}
+        rows.update(np.flatnonzero((scores > 0) & (scores >= last)).tolist())
+        rows.add(i)
+        for r in rows:
+            self._ranked[r] = self._rank(r)
+
+    def build(self, posts: Iterable[BlogPost | AnalyzedPost]) -> None:
+        """Rank the related posts of these posts (those published by now)."""
+        now = datetime.datetime.now(datetime.UTC)
+        with self._lock:
+            if self.count <= 0:
+                return
+            self._build([analyze(post) for post in posts if is_published(post.published, now)])
+            ranked = len(self._positions)
+        logger.info("Related posts ranked for %d post(s)", ranked)
+
+    def update(self, post_id: Hashable, post: BlogPost | None) -> None:
+        """Post change listener: rank again with the new version of the post."""
+        self.apply({post_id: post})
+
+    def apply(self, changes: Mapping[Hashable, BlogPost | AnalyzedPost | None]) -> None:
+        """Rank again with saved posts and without deleted ones (None, or not
+        published yet), by post ID.
+
+        Does nothing until the lists are built (the build reads every post).
+        """
+        now = datetime.datetime.now(datetime.UTC)
+        with self._lock:
+            if self._ranked is None:
+                return
+            changes = {
+                post_id: (
+                    analyze(post)
+                    if post is not None and is_published(post.published, now)
+                    else None
+                )
+                for post_id, post in changes.items()
+            }
+            self._changes += len(changes)
+            if self._changes > REBUILD_SHARE * len(self._positions):
+                posts = {post.key.id_or_name: post for post in self._posts if post is not None}
+                posts.update(changes)
+                self._build([post for post in posts.values() if post is not None])
+                return
+            new = [
+                post_id
+                for post_id, post in changes.items()
+                if post is not None and post_id not in self._positions
+            ]
+            if new:
+                start = len(self._posts)
+                self._grow(len(new))
+                self._positions.update({post_id: start + n for n, post_id in enumerate(new)})
+            for post_id, post in changes.items():
+                if post_id in self._positions:
+                    self._change(self._positions[post_id], post)
+            self._snapshot = _Snapshot(self._posts, self._ranked)
+
+    def get(self, post_id: Hashable) -> list[AnalyzedPost]:
+        """Published posts related to a post, most similar first."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+        return list(snapshot.related.get(post_id, ()))
+
+
+related_posts = RelatedPosts()
@@ -0,0 +1,149 @@
+"""Cache for the Markdown renderings of blog posts.
+
+Entries are keyed by post key, a digest of the post body and a fingerprint of
+the Markdown configuration, so an edited body or a changed extension setup can
+never serve stale HTML. The cache has two tiers: a bounded in-process LRU and
+an optional directory on disk that survives restarts (and can be shared between
+workers of the same instance).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+def body_digest(body: str, fingerprint: str) -> str:
+    """Return a hex digest identifying a rendering of `body` under `fingerprint`."""
+    h = hashlib.sha256(fingerprint.encode("utf-8"))
+    h.update(b"\x00")
+    h.update((body or "").encode("utf-8"))
+    return h.hexdigest()
+
+
+def _key_dirname(post_key: Hashable | None) -> str:
+    """File-system safe directory name for a post key (id or name)."""
+    if post_key is None:
+        return "_unsaved"
+    return hashlib.sha1(repr(post_key).encode("utf-8")).hexdigest()  # nosec B324 - not security
+
+
+class RenderCache:
+    """Two-tier (memory LRU, optional disk) cache of rendered post HTML.
+
+    Args:
+        max_entries: Maximum number of renderings kept in memory.
+        directory: Optional directory for the durable tier (disabled if None).
+    """
+
+    def __init__(self, max_entries: int = 256, directory: str | None = None) -> None:
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, str] = OrderedDict()
+        self.max_entries = max_entries
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, max_entries: int | None = None, directory: str | None = None) -> None:
+        """Resize the memory tier and (re)point the durable tier."""
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+                self._evict()
+            self.directory = directory or None
+
+    def get_or_render(
+        self,
+        post_key: Hashable | None,
+        kind: str,
+        body: str,
+        fingerprint: str,
+        render: Callable[[], str],
+    ) -> str:
+        """Return the cached rendering, calling `render()` on a miss."""
+        digest = body_digest(body, fingerprint)
+        cache_key = (post_key, kind, digest)
+
+        with self._lock:
+            html = self._entries.get(cache_key)
+            if html is not None:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return html
+            self.misses += 1
+
+        html = self._read_disk(post_key, kind, digest)
+        if html is None:
+            html = render()
+            self._write_disk(post_key, kind, digest, html)
+
+        with self._lock:
+            self._entries[cache_key] = html
+            self._entries.move_to_end(cache_key)
+            self._evict()
+        return html
+
+    def invalidate(self, post_key: Hashable | None) -> None:
+        """Drop every rendering of the given post from both tiers."""
+        with self._lock:
+            for cache_key in [k for k in self._entries if k[0] == post_key]:
+                del self._entries[cache_key]
+        if self.directory:
+            shutil.rmtree(os.path.join(self.directory, _key_dirname(post_key)), ignore_errors=True)
+
+    def clear(self) -> None:
+        """Empty the memory tier (the disk tier is keyed by content and left alone)."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self) -> None:
+        # Caller holds the lock.
+        while len(self._entries) > max(self.max_entries, 0):
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, post_key: Hashable | None, kind: str, digest: str) -> str | None:
+        if not self.directory:
+            return None
+        return os.path.join(self.directory, _key_dirname(post_key), f"{kind}-{digest}.html")
+
+    def _read_disk(self, post_key: Hashable | None, kind: str, digest: str) -> str | None:
+        path = self._disk_path(post_key, kind, digest)
+        if path is None:
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError:
+            logger.warning("Could not read render cache file %s", path, exc_info=True)
+            return None
+
+    def _write_disk(self, post_key: Hashable | None, kind: str, digest: str, html: str) -> None:
+        path = self._disk_path(post_key, kind, digest)
+        if path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never see partial HTML.
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(html)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.warning("Could not write render cache file %s", path, exc_info=True)
+
+
+# Process-wide cache used by BlogPost; sized from settings at application startup.
+render_cache = RenderCache()
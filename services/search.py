@@ -0,0 +1,387 @@
+"""Full-text search over the posts: an inverted index ranked with BM25.
+
+Documents are the posts, indexed on their title, tags and the text of their
+rendered body (the title and tags weigh more). The index is one file:
+
+    MAGIC | header length (8 bytes) | header (JSON) | postings
+
+The header lists the documents (what a result displays, and their length)
+and, for each term, where its postings start and how many there are. The
+postings are pairs of 32-bit unsigned integers (document number, term
+frequency) in native byte order, read in place from a memory map: loading
+the index parses the header only. Queries never touch Datastore.
+
+A post change rewrites the file from the postings of the other posts and
+the terms of the changed post: only that post is tokenized again (see
+AnalyzedPost and services.analysis).
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+from collections.abc import Hashable, Iterable, Mapping
+from pathlib import Path
+
+from models.blog_post import RENDER_FINGERPRINT, BlogPost
+from services.post_index import IndexedPost
+from utils import html_to_text
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TGLSRCH1"
+_HEADER_LENGTH = struct.Struct("<Q")
+# Postings are counted (and document numbers stored) as unsigned 32-bit integers.
+_POSTING_TYPE = "I"
+# Words of the title and tags count as this many words of the body.
+TITLE_WEIGHT = 3
+TAG_WEIGHT = 2
+# Terms stored by another version of post_terms (or of the rendering it reads)
+# are computed again (see services.analysis): bump when changing the terms.
+TERMS_VERSION = repr((1, RENDER_FINGERPRINT))
+# BM25 parameters.
+K1 = 1.2
+B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+")
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the this to "
+    "was were which with".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Terms of a text: lowercase words without accents, stop words removed."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return [term for term in _TOKEN_RE.findall(text) if term not in STOP_WORDS]
+
+
+def post_terms(post: BlogPost) -> Counter:
+    """Term frequencies of a post (title and tags weighted)."""
+    terms = Counter(tokenize(html_to_text(post.rendered)))
+    for term in tokenize(post.title or ""):
+        terms[term] += TITLE_WEIGHT
+    for term in tokenize(" ".join(post.tags)):
+        terms[term] += TAG_WEIGHT
+    return terms
+
+
+class AnalyzedPost(IndexedPost):
+    """Metadata of a post with its term frequencies: all that the search index
+    and the related posts (services.related) use of it."""
+
+    __slots__ = ("terms",)
+
+    def __init__(self, key, *args, terms: Counter | None = None, **kwargs) -> None:
+        super().__init__(key, *args, **kwargs)
+        self.terms = terms if terms is not None else Counter()
+
+    @staticmethod
+    def from_post(post: BlogPost) -> AnalyzedPost:
+        return AnalyzedPost(
+            key=post.key,
+            title=post.title,
+            path=post.path,
+            published=post.published,
+            updated=post.updated,
+            tags=post.tags,
+            slugs=post.slugs,
+            difficulty=post.difficulty,
+            terms=post_terms(post),
+        )
+
+
+def analyze(post: BlogPost | AnalyzedPost) -> AnalyzedPost:
+    """The post analyzed (tokenized once: an AnalyzedPost is returned as is)."""
+    return post if isinstance(post, AnalyzedPost) else AnalyzedPost.from_post(post)
+
+
+def is_published(published: datetime.datetime | None, now: datetime.datetime) -> bool:
+    """True if a post with this publication date is public at `now`.
+
+    Drafts are dated 9999-12-31 (see routes.admin_fastapi), and posts can be
+    scheduled: both are left out of the analyses until their date.
+    """
+    if published is None:
+        return False
+    if published.tzinfo is None:
+        published = published.replace(tzinfo=datetime.UTC)  # Assume UTC.
+    return published <= now
+
+
+class SearchHit:
+    """A post matching a query, with what a result page shows of it."""
+
+    __slots__ = ("post_id", "title", "path", "published", "tags", "score")
+
+    def __init__(
+        self,
+        post_id: Hashable,
+        title: str,
+        path: str,
+        published: datetime.datetime,
+        tags: list[str],
+        score: float = 0.0,
+    ) -> None:
+        self.post_id = post_id
+        self.title = title
+        self.path = path
+        self.published = published
+        self.tags = tags
+        self.score = score
+
+
+class _Document:
+    __slots__ = ("post_id", "title", "path", "published", "tags", "length")
+
+    def __init__(self, post_id, title, path, published, tags, length) -> None:
+        self.post_id = post_id
+        self.title = title
+        self.path = path
+        self.published = published
+        self.tags = tags
+        self.length = length
+
+    @staticmethod
+    def from_post(post: AnalyzedPost, length: int) -> _Document:
+        return _Document(
+            post.key.id_or_name, post.title, post.path, post.published, list(post.tags), length
+        )
+
+    def to_json(self) -> list:
+        published = self.published.isoformat()
+        return [self.post_id, self.title, self.path, published, self.tags, self.length]
+
+    @staticmethod
+    def from_json(row: list) -> _Document:
+        post_id, title, path, published, tags, length = row
+        published = datetime.datetime.fromisoformat(published)
+        return _Document(post_id, title, path, published, tags, length)
+
+
+def _serialize(documents: list[_Document], postings: dict[str, list[tuple[int, int]]]) -> bytes:
+    terms = {}
+    values = array(_POSTING_TYPE)
+    for term in sorted(postings):
+        pairs = postings[term]
+        terms[term] = [len(values) // 2, len(pairs)]
+        for number, frequency in pairs:
+            values.append(number)
+            values.append(frequency)
+    header = json.dumps(
+        {"documents": [document.to_json() for document in documents], "terms": terms},
+        separators=(",", ":"),
+    ).encode()
+    # Align the postings on their item size, to read them in place.
+    padding = -(len(MAGIC) + _HEADER_LENGTH.size + len(header)) % values.itemsize
+    header += b" " * padding
+    return MAGIC + _HEADER_LENGTH.pack(len(header)) + header + values.tobytes()
+
+
+class _IndexData:
+    """An index as read from its file (immutable: changes make a new one)."""
+
+    def __init__(self, buffer) -> None:
+        # `buffer` is a memory map (or bytes), kept open as long as this object.
+        self.buffer = buffer
+        view = memoryview(buffer)
+        if bytes(view[: len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a search index")
+        offset = len(MAGIC)
+        (header_length,) = _HEADER_LENGTH.unpack_from(view, offset)
+        offset += _HEADER_LENGTH.size
+        header = json.loads(bytes(view[offset : offset + header_length]))
+        offset += header_length
+        self.documents = [_Document.from_json(row) for row in header["documents"]]
+        self.terms: dict[str, list[int]] = header["terms"]
+        self.postings = view[offset:].cast(_POSTING_TYPE)
+        lengths = [document.length for document in self.documents]
+        self.average_length = sum(lengths) / len(lengths) if lengths else 0.0
+
+    def term_postings(self, term: str) -> Iterable[tuple[int, int]]:
+        start, count = self.terms.get(term, (0, 0))
+        pairs = self.postings[2 * start : 2 * (start + count)]
+        return zip(pairs[0::2], pairs[1::2], strict=True)
+
+
+class SearchIndex:
+    """Inverted index of the posts, kept in a file (see the module docstring).
+
+    Without a file (path None) the same bytes are kept in memory instead.
+    The index is not `ready` until built (or loaded from its file).
+    """
+
+    def __init__(self, path: str | os.PathLike | None = None) -> None:
+        self.path = Path(path) if path else None
+        self._data: _IndexData | None = None
+        # Serializes the writers; readers use whichever _IndexData is current.
+        self._lock = threading.Lock()
+        # Incremented by every change, so that a build from posts read before a
+        # change does not overwrite it with older data.
+        self._generation = 0
+
+    def configure(self, path: str | os.PathLike | None) -> None:
+        self.path = Path(path) if path else None
+        self._data = None
+
+    @property
+    def ready(self) -> bool:
+        return self._data is not None
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def __len__(self) -> int:
+        data = self._data
+        return len(data.documents) if data is not None else 0
+
+    def load(self) -> bool:
+        """Read the index from its file; returns False if there is none (or it is invalid)."""
+        if self.path is None or not self.path.exists():
+            return False
+        try:
+            with open(self.path, "rb") as f:
+                data = _IndexData(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError):
+            logger.warning("Could not load the search index %s", self.path, exc_info=True)
+            return False
+        self._data = data
+        return True
+
+    def _write(self, content: bytes) -> None:
+        if self.path is None:
+            self._data = _IndexData(content)
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Written aside and renamed: readers of the previous file keep their map.
+        fd, temp_path = tempfile.mkstemp(dir=self.path.parent, prefix=".search-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        if not self.load():
+            raise OSError(f"Could not read back the search index {self.path}")
+
+    def build(
+        self, posts: Iterable[BlogPost | AnalyzedPost], generation: int | None = None
+    ) -> bool:
+        """Index these posts (those published by now), replacing the index.
+
+        `generation` is the `generation` of the index when the posts were read:
+        if a change was applied since, the build is discarded and False
+        returned (read the posts again to build).
+        """
+        now = datetime.datetime.now(datetime.UTC)
+        documents = []
+        postings: dict[str, list[tuple[int, int]]] = {}
+        for post in posts:
+            if not is_published(post.published, now):
+                continue
+            post = analyze(post)
+            for term, frequency in post.terms.items():
+                postings.setdefault(term, []).append((len(documents), frequency))
+            documents.append(_Document.from_post(post, post.terms.total()))
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._write(_serialize(documents, postings))
+        logger.info("Search index built with %d post(s)", len(documents))
+        return True
+
+    def update(self, post_id: Hashable, post: BlogPost | None) -> None:
+        """Post change listener: reindex a saved post, or remove a deleted one."""
+        self.apply({post_id: post})
+
+    def apply(self, changes: Mapping[Hashable, BlogPost | AnalyzedPost | None]) -> None:
+        """Reindex saved posts and remove deleted ones (None, or not published yet), by post ID.
+
+        Does nothing until the index is built (the build reads every post).
+        """
+        with self._lock:
+            self._generation += 1
+            data = self._data
+            if data is None:
+                return
+            # Number of each remaining document in the new index (-1: removed).
+            renumber = []
+            documents = []
+            for document in data.documents:
+                if document.post_id in changes:
+                    renumber.append(-1)
+                else:
+                    renumber.append(len(documents))
+                    documents.append(document)
+            postings: dict[str, list[tuple[int, int]]] = {}
+            for term in data.terms:
+                pairs = [
+                    (renumber[number], frequency)
+                    for number, frequency in data.term_postings(term)
+                    if renumber[number] >= 0
+                ]
+                if pairs:
+                    postings[term] = pairs
+            now = datetime.datetime.now(datetime.UTC)
+            for post in changes.values():
+                if post is None or not is_published(post.published, now):
+                    continue
+                post = analyze(post)
+                for term, frequency in post.terms.items():
+                    postings.setdefault(term, []).append((len(documents), frequency))
+                documents.append(_Document.from_post(post, post.terms.total()))
+            self._write(_serialize(documents, postings))
+
+    def search(
+        self, query: str, limit: int = 20, now: datetime.datetime | None = None
+    ) -> list[SearchHit]:
+        """Published posts matching any term of the query, best BM25 score first."""
+        data = self._data
+        if data is None or not data.documents:
+            return []
+        now = now or datetime.datetime.now(datetime.UTC)
+        total = len(data.documents)
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            count = data.terms.get(term, (0, 0))[1]
+            if not count:
+                continue
+            idf = math.log(1 + (total - count + 0.5) / (count + 0.5))
+            for number, frequency in data.term_postings(term):
+                length = data.documents[number].length / (data.average_length or 1)
+                score = idf * frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * length))
+                scores[number] = scores.get(number, 0.0) + score
+        hits = []
+        for number, score in scores.items():
+            document = data.documents[number]
+            if document.published > now:
+                continue  # Not published yet.
+            hits.append(
+                SearchHit(
+                    document.post_id,
+                    document.title,
+                    document.path,
+                    document.published,
+                    document.tags,
+                    score,
+                )
+            )
+        hits.sort(key=lambda hit: (-hit.score, -hit.published.timestamp()))
+        return hits[:limit]
+
+
+search_index = SearchIndex()
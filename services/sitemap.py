@@ -0,0 +1,93 @@
+"""Sitemaps: the URLs of the public pages, for crawlers.
+
+Crawlers find every post in the sitemap, with the date of its last update
+(`lastmod`), instead of walking the paginated listings. The sitemap lists
+the front page, the archive, the tag pages and the posts; it is built from
+the metadata of the posts only (see services.blog.list_post_dates).
+
+A sitemap holds at most MAX_URLS URLs: past that, /sitemap.xml is an index
+of the sitemaps /sitemap-1.xml, /sitemap-2.xml, ...
+"""
+
+from __future__ import annotations
+
+import datetime
+from xml.sax.saxutils import escape
+
+from services.feeds import rfc3339
+
+# Maximum number of URLs of a sitemap (sitemaps.org protocol).
+MAX_URLS = 50_000
+SITEMAP_MEDIA_TYPE = "application/xml"
+_XMLNS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+
+
+class SitemapURL:
+    """A URL of a sitemap, with the date its content last changed (if known)."""
+
+    __slots__ = ("loc", "lastmod")
+
+    def __init__(self, loc: str, lastmod: datetime.datetime | None = None) -> None:
+        self.loc = loc
+        self.lastmod = lastmod
+
+
+def sitemap_urls(posts: list, base: str) -> list[SitemapURL]:
+    """URLs of the site given the published posts (newest first) and the base URL."""
+    modified = {post.key.id_or_name: post.updated or post.published for post in posts}
+    newest = max(modified.values(), default=None)
+    urls = [
+        SitemapURL(f"{base}/", newest),
+        SitemapURL(f"{base}/archive", newest),
+        SitemapURL(f"{base}/tags", newest),
+        SitemapURL(f"{base}/bestof"),
+        SitemapURL(f"{base}/about"),
+    ]
+    tags: dict[str, datetime.datetime] = {}
+    for post in posts:
+        date = modified[post.key.id_or_name]
+        for slug in post.slugs:
+            tags[slug] = max(tags.get(slug, date), date)
+    urls += [SitemapURL(f"{base}/tag/{slug}", date) for slug, date in sorted(tags.items())]
+    urls += [SitemapURL(base + post.path, modified[post.key.id_or_name]) for post in posts]
+    return urls
+
+
+def _entries(tag: str, urls: list[SitemapURL]) -> str:
+    lines = []
+    for url in urls:
+        lastmod = f"<lastmod>{rfc3339(url.lastmod)}</lastmod>" if url.lastmod else ""
+        lines.append(f"<{tag}><loc>{escape(url.loc)}</loc>{lastmod}</{tag}>")
+    return "\n".join(lines)
+
+
+def render_urlset(urls: list[SitemapURL]) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<urlset xmlns="{_XMLNS}">\n{_entries("url", urls)}\n</urlset>\n'
+    )
+
+
+def render_index(sitemaps: list[SitemapURL]) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<sitemapindex xmlns="{_XMLNS}">\n{_entries("sitemap", sitemaps)}\n</sitemapindex>\n'
+    )
+
+
+def sitemap_documents(urls: list[SitemapURL], base: str, max_urls: int = MAX_URLS) -> list[str]:
+    """The documents of the sitemap: [/sitemap.xml, /sitemap-1.xml, /sitemap-2.xml, ...].
+
+    With at most `max_urls` URLs, /sitemap.xml lists them and is the only
+    document. Otherwise it is the index of the others, which list `max_urls`
+    URLs each.
+    """
+    if len(urls) <= max_urls:
+        return [render_urlset(urls)]
+    parts = [urls[i : i + max_urls] for i in range(0, len(urls), max_urls)]
+    dates = [[url.lastmod for url in part if url.lastmod is not None] for part in parts]
+    index = [
+        SitemapURL(f"{base}/sitemap-{number}.xml", max(part_dates, default=None))
+        for number, part_dates in enumerate(dates, start=1)
+    ]
+    return [render_index(index)] + [render_urlset(part) for part in parts]
@@ -1,3 +1,55 @@
+"""Process-wide Cloud Storage client and streaming reads of blobs.
+
+As with the Datastore client (see services.datastore), creating a client runs
+credential discovery and opens new connections, so one client is shared by
+the whole worker process and created on first use.
+"""
+
+import threading
+from collections.abc import Iterator
+
 from google.cloud import storage
 
-storage_client = storage.Client()
+# Bucket holding the images of the posts, served under /img/.
+IMAGE_BUCKET = "thegrandlocus_bucket"
+# Bytes downloaded per request to Cloud Storage while streaming a blob: the
+# most a response holds in memory at once.
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+_client: storage.Client | None = None
+_client_lock = threading.Lock()
+
+
+def get_storage_client() -> storage.Client:
+    """FastAPI dependency returning the shared Cloud Storage client."""
+    global _client
+    client = _client
+    if client is None:
+        with _client_lock:
+            if _client is None:
+                _client = storage.Client()
+            client = _client
+    return client
+
+
+def iter_blob(
+    blob: storage.Blob, start: int = 0, end: int | None = None, chunk_size: int = STREAM_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """Yield the bytes `start` to `end` (inclusive) of a blob, chunk by chunk.
+
+    Reads are pinned to the generation of `blob`, so that an object replaced
+    mid-stream fails the response instead of mixing two versions.
+    """
+    if end is None:
+        end = blob.size - 1
+    remaining = end - start + 1
+    if remaining <= 0:
+        return
+    with blob.open("rb", chunk_size=chunk_size, if_generation_match=blob.generation) as reader:
+        reader.seek(start)
+        while remaining > 0:
+            data = reader.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
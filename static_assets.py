@@ -0,0 +1,135 @@
+"""Fingerprinted URLs for the static files.
+
+Templates link static files through the `static_url` Jinja global, which
+inserts a digest of the file content in its name (js/locus.js becomes
+js/locus.1a2b3c4d5e6f.js). A fingerprinted URL always designates the same
+content, so FingerprintedStaticFiles serves it as immutable, and a deploy
+that changes a file changes its URL. The manifest mapping the files to
+their fingerprinted names is built from the static tree on first use.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+
+from fastapi.templating import Jinja2Templates
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+from starlette.types import Scope
+
+from compression import ENCODING_SUFFIXES, PrecompressedStaticFiles
+
+STATIC_PREFIX = "/static/"
+HASH_LENGTH = 12
+# Fingerprinted files can be cached forever: their URL changes with them.
+IMMUTABLE = "public, max-age=31536000, immutable"
+# name.<digest>.ext (the digest goes before the last extension).
+_FINGERPRINTED = re.compile(
+    rf"^(?P<stem>.+)\.(?P<digest>[0-9a-f]{{{HASH_LENGTH}}})(?P<ext>\.[^./]+)$"
+)
+
+
+def fingerprinted_name(path: str, digest: str) -> str:
+    stem, dot, ext = path.rpartition(".")
+    if not dot or "/" in ext:
+        return f"{path}.{digest}"
+    return f"{stem}.{digest}.{ext}"
+
+
+class StaticManifest:
+    """Fingerprinted name of each file of a static directory (relative paths)."""
+
+    def __init__(self, directory: str | os.PathLike) -> None:
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._names: dict[str, str] | None = None
+        self._originals: dict[str, str] = {}
+
+    def _build(self) -> dict[str, str]:
+        with self._lock:
+            if self._names is not None:
+                return self._names
+            names = {}
+            suffixes = set(ENCODING_SUFFIXES.values())
+            for path in sorted(self.directory.rglob("*")):
+                if not path.is_file() or path.suffix in suffixes:
+                    continue
+                relative = path.relative_to(self.directory).as_posix()
+                digest = hashlib.sha256(path.read_bytes()).hexdigest()[:HASH_LENGTH]
+                names[relative] = fingerprinted_name(relative, digest)
+            self._originals = {name: path for path, name in names.items()}
+            self._names = names
+            return names
+
+    @property
+    def names(self) -> dict[str, str]:
+        return self._build()
+
+    @property
+    def version(self) -> str:
+        """Digest of the whole manifest: changes when any static file does."""
+        digest = hashlib.sha256()
+        for name in self.names.values():
+            digest.update(name.encode() + b"\n")
+        return digest.hexdigest()
+
+    def url(self, path: str) -> str:
+        """URL of a static file, fingerprinted if the file is known."""
+        path = path.lstrip("/").removeprefix(STATIC_PREFIX.lstrip("/"))
+        return STATIC_PREFIX + self.names.get(path, path)
+
+    def original(self, name: str) -> str | None:
+        """Path of the file with this fingerprinted name (None if not current)."""
+        self._build()
+        return self._originals.get(name)
+
+    def reset(self) -> None:
+        """Forget the manifest (rebuilt on next use)."""
+        with self._lock:
+            self._names = None
+            self._originals = {}
+
+
+static_manifest = StaticManifest("static")
+
+
+def static_url(path: str) -> str:
+    """Jinja global: {{ static_url('css/screen.css') }}."""
+    return static_manifest.url(path)
+
+
+def add_static_url(templates: Jinja2Templates) -> Jinja2Templates:
+    templates.env.globals["static_url"] = static_url
+    return templates
+
+
+class FingerprintedStaticFiles(PrecompressedStaticFiles):
+    """Static files, also served under their fingerprinted names as immutable.
+
+    A fingerprinted name that is not current (an old page requesting a file
+    changed since) gets the current file, with the default caching only.
+    """
+
+    def __init__(self, *args, manifest: StaticManifest = static_manifest, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.manifest = manifest
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        name = path.replace(os.sep, "/")
+        original = self.manifest.original(name)
+        if original is not None:
+            response = await super().get_response(original, scope)
+            if response.status_code in (200, 304):
+                response.headers["Cache-Control"] = IMMUTABLE
+            return response
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as exc:
+            match = _FINGERPRINTED.match(name)
+            if exc.status_code != 404 or match is None:
+                raise
+        return await super().get_response(match["stem"] + match["ext"], scope)
@@ -0,0 +1,12 @@
+"""Posts of the bundled Datastore backup, shared by the tests that run on real content."""
+
+import gzip
+import json
+from pathlib import Path
+
+BACKUP = Path(__file__).parent.parent / "backups" / "posts_backup_2025-06-30.json.gz"
+
+
+def load_backup_posts() -> list[dict]:
+    with gzip.open(BACKUP, "rt", encoding="utf-8") as f:
+        return json.load(f)
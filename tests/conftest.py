@@ -0,0 +1,7 @@
+"""Settings required to import the application modules in tests (see config.Settings)."""
+
+import os
+
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test-client-id")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test-client-secret")
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
@@ -0,0 +1,199 @@
+"""An in-memory stand-in for datastore.Client, for the tests of the Datastore code paths.
+
+It answers the queries that services.blog makes: equality and inequality
+filters (on properties and on `__key__`), orders, offsets and limits,
+projections (one result per distinct value of a projected list property)
+and COUNT aggregations. Entities without a property that a query filters,
+orders or projects on are left out, as they are missing from the index.
+Every query run is recorded in `queries`, and every write in `writes`.
+"""
+
+import contextlib
+import copy
+import itertools
+
+from google.cloud import datastore
+
+PROJECT = "test"
+
+
+def _sort_value(value):
+    if isinstance(value, datastore.Key):
+        return (isinstance(value.id_or_name, str), value.id_or_name)
+    return value
+
+
+def _matches(value, operator, expected) -> bool:
+    value, expected = _sort_value(value), _sort_value(expected)
+    if operator == "=":
+        return value == expected
+    if operator == "<":
+        return value < expected
+    if operator == "<=":
+        return value <= expected
+    if operator == ">":
+        return value > expected
+    if operator == ">=":
+        return value >= expected
+    raise ValueError(f"Unsupported operator {operator}")
+
+
+class FakeQuery:
+    def __init__(self, client, kind):
+        self.client = client
+        self.kind = kind
+        self.filters = []
+        self.order = []
+        self.projection = []
+
+    def add_filter(self, property_name=None, operator=None, value=None, *, filter=None):
+        if filter is not None:
+            property_name, operator, value = filter.property_name, filter.operator, filter.value
+        self.filters.append((property_name, operator, value))
+        return self
+
+    def keys_only(self):
+        self.projection = ["__key__"]
+
+    def _values(self, entity, name):
+        if name == "__key__":
+            return [entity.key]
+        value = entity.get(name)
+        if value is None or value == []:
+            return []
+        return value if isinstance(value, list) else [value]
+
+    def _results(self):
+        names = {name.lstrip("-") for name in self.order} | set(self.projection)
+        names |= {name for name, _operator, _value in self.filters}
+        results = []
+        for entity in self.client.entities.values():
+            if entity.key.kind != self.kind:
+                continue
+            if any(not self._values(entity, name) for name in names):
+                continue
+            if all(
+                any(_matches(value, operator, expected) for value in self._values(entity, name))
+                for name, operator, expected in self.filters
+            ):
+                results.append(entity)
+        for name in reversed(self.order):
+            prop = name.lstrip("-")
+            results.sort(
+                key=lambda entity, prop=prop: min(map(_sort_value, self._values(entity, prop))),
+                reverse=name.startswith("-"),
+            )
+        return results
+
+    def _project(self, entity):
+        if self.projection == ["__key__"]:
+            return [datastore.Entity(key=entity.key)]
+        lists = [name for name in self.projection if isinstance(entity.get(name), list)]
+        rows = [{}]
+        for name in self.projection:
+            values = sorted(set(entity[name])) if name in lists else [entity[name]]
+            rows = [dict(row, **{name: value}) for row in rows for value in values]
+        projected = []
+        for row in rows:
+            result = datastore.Entity(key=entity.key)
+            result.update(row)
+            projected.append(result)
+        return projected
+
+    def fetch(self, limit=None, offset=0, **kwargs):
+        self.client.queries.append(self)
+        results = self._results()
+        if self.projection:
+            results = [row for entity in results for row in self._project(entity)]
+        else:
+            results = [copy.deepcopy(entity) for entity in results]
+        end = None if limit is None else offset + limit
+        return iter(results[offset:end])
+
+
+class _AggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class FakeAggregationQuery:
+    def __init__(self, query):
+        self.query = query
+        self.alias = None
+
+    def count(self, alias=None):
+        self.alias = alias
+        return self
+
+    def fetch(self, **kwargs):
+        self.query.client.counts.append(self.query)
+        return iter([[_AggregationResult(self.alias, len(self.query._results()))]])
+
+
+class FakeClient:
+    """Entities by key, shared by everything that uses the client."""
+
+    def __init__(self, entities=()):
+        self.entities = {entity.key: entity for entity in entities}
+        self.queries = []
+        self.counts = []
+        self.writes = []
+        self._ids = itertools.count(1000)
+
+    def key(self, *path):
+        return datastore.Key(*path, project=PROJECT)
+
+    def query(self, kind=None):
+        return FakeQuery(self, kind)
+
+    def aggregation_query(self, query):
+        return FakeAggregationQuery(query)
+
+    def get(self, key):
+        entity = self.entities.get(key)
+        return copy.deepcopy(entity) if entity is not None else None
+
+    def get_multi(self, keys):
+        return [copy.deepcopy(self.entities[key]) for key in keys if key in self.entities]
+
+    def put(self, entity):
+        if entity.key.is_partial:
+            entity.key = entity.key.completed_key(next(self._ids))
+        self.writes.append(entity.key)
+        self.entities[entity.key] = copy.deepcopy(entity)
+
+    def put_multi(self, entities):
+        for entity in entities:
+            self.put(entity)
+
+    def delete(self, key):
+        self.writes.append(key)
+        self.entities.pop(key, None)
+
+    def delete_multi(self, keys):
+        for key in keys:
+            self.delete(key)
+
+    @contextlib.contextmanager
+    def transaction(self, **kwargs):
+        yield self
+
+
+def post_entity(post_id, published, updated=None, **properties) -> datastore.Entity:
+    """A BlogPost entity (title, body, path and tags made up from its ID by default)."""
+    entity = datastore.Entity(key=datastore.Key("BlogPost", post_id, project=PROJECT))
+    entity.update(
+        {
+            "title": f"Post {post_id}",
+            "body": f"Body of post {post_id}.",
+            "published": published,
+            "updated": updated or published,
+            "path": f"/post-{post_id}",
+            "tags": [],
+            "slugs": [],
+            "difficulty": 0,
+        }
+    )
+    entity.update(properties)
+    return entity
@@ -0,0 +1,208 @@
+"""Unit tests for the analyzed posts shared by the search index and the related posts."""
+
+import datetime
+
+from google.cloud import datastore
+
+from models.blog_post import BlogPost
+from services.analysis import PostAnalyses, to_entity
+from services.related import RelatedPosts
+from services.search import SearchIndex, analyze
+
+UTC = datetime.UTC
+NOW = datetime.datetime(2024, 6, 1, tzinfo=UTC)
+
+
+class FakeQuery:
+    def __init__(self, entities, kind):
+        self.entities = entities
+        self.kind = kind
+        self.projection = []
+
+    def fetch(self):
+        for entity in list(self.entities.values()):
+            if entity.key.kind != self.kind:
+                continue
+            if not self.projection:
+                yield entity
+                continue
+            projected = datastore.Entity(key=entity.key)
+            projected.update({name: entity.get(name) for name in self.projection})
+            yield projected
+
+
+class FakeClient:
+    """Just enough of datastore.Client for the analyses, shared by the instances."""
+
+    def __init__(self, entities):
+        self.entities = {entity.key: entity for entity in entities}
+        self.read = []
+
+    def key(self, *path):
+        return datastore.Key(*path, project="test")
+
+    def query(self, kind):
+        return FakeQuery(self.entities, kind)
+
+    def get_multi(self, keys):
+        self.read += [key.id for key in keys]
+        return [self.entities[key] for key in keys if key in self.entities]
+
+    def put(self, entity):
+        self.entities[entity.key] = entity
+
+    def put_multi(self, entities):
+        for entity in entities:
+            self.put(entity)
+
+    def delete_multi(self, keys):
+        for key in keys:
+            self.entities.pop(key, None)
+
+    def stored(self):
+        return sorted(key.parent.id for key in self.entities if key.kind == "PostTerms")
+
+
+def make_entity(post_id, title, body, tags=(), days_ago=10, edited=0):
+    published = NOW - datetime.timedelta(days=days_ago)
+    entity = datastore.Entity(key=datastore.Key("BlogPost", post_id, project="test"))
+    entity.update(
+        {
+            "title": title,
+            "body": body,
+            "published": published,
+            "updated": published + datetime.timedelta(days=edited),
+            "path": f"/2024/05/post-{post_id}",
+            "tags": list(tags),
+            "slugs": [tag.lower() for tag in tags],
+        }
+    )
+    return entity
+
+
+def make_client():
+    return FakeClient(
+        [
+            make_entity(1, "Noisy genes", "Cells are noisy, and genes too.", ["Biology"]),
+            make_entity(2, "Markov chains", "Random events: the genes of chance.", ["Biology"]),
+            make_entity(3, "Bayes", "Priors and posteriors.", ["Math"]),
+        ]
+    )
+
+
+def make_analyses(stored=True):
+    analyses = PostAnalyses()
+    analyses.configure(stored=stored)
+    search = SearchIndex()
+    related = RelatedPosts(count=2)
+    analyses.subscribe(search)
+    analyses.subscribe(related)
+    return analyses, search, related
+
+
+def hits(search, query):
+    return sorted(hit.post_id for hit in search.search(query, now=NOW))
+
+
+def test_refresh_reads_posts_changed_elsewhere_only():
+    client = make_client()
+    analyses, search, related = make_analyses()
+    assert analyses.refresh(client)  # Loads the posts.
+    assert len(analyses) == 3
+    assert hits(search, "genes") == [1, 2]
+    assert [post.key.id for post in related.get(1)] == [2]
+    client.read = []
+    assert not analyses.refresh(client)
+    assert client.read == []
+
+    # Another instance edits a post, deletes one and publishes one.
+    client.put(make_entity(2, "Markov chains", "Random walks.", ["Math"], edited=1))
+    del client.entities[datastore.Key("BlogPost", 3, project="test")]
+    client.put(make_entity(4, "More genes", "Genes, noisy again.", ["Biology"]))
+    assert analyses.refresh(client)
+    assert sorted(client.read) == [2, 4]
+    assert len(analyses) == 3
+    assert hits(search, "genes") == [1, 4]
+    assert hits(search, "posteriors") == []
+    assert [post.key.id for post in related.get(1)] == [4]
+
+
+def test_load_reads_posts_changed_since_stored_only():
+    client = make_client()
+    analyses, search, _related = make_analyses()
+    assert analyses.load(client)
+    assert sorted(client.read) == [1, 2, 3]
+    assert client.stored() == [1, 2, 3]
+
+    # The next instance starts from the stored analyses.
+    client.read = []
+    analyses, search, related = make_analyses()
+    assert analyses.load(client)
+    assert client.read == []
+    assert hits(search, "genes") == [1, 2]
+    assert [post.key.id for post in related.get(1)] == [2]
+
+    # Changed without storing the analyses (e.g. restored from a backup).
+    client.put(make_entity(2, "Markov chains", "Random walks.", ["Math"], edited=1))
+    del client.entities[datastore.Key("BlogPost", 3, project="test")]
+    analyses, search, _related = make_analyses()
+    assert analyses.load(client)
+    assert client.read == [2]
+    assert client.stored() == [1, 2]
+    assert hits(search, "genes") == [1]
+
+
+def test_analyses_are_not_stored_by_default():
+    client = make_client()
+    client.put(to_entity(analyze(BlogPost.from_datastore_entity(make_entity(9, "Old", "Gone.")))))
+    analyses = PostAnalyses()
+    assert analyses.load(client)
+    assert sorted(client.read) == [1, 2, 3]
+    # Neither read nor written: not even the analysis of a deleted post is removed.
+    assert client.stored() == [9]
+
+
+def test_local_change_is_stored_and_not_read_again():
+    client = make_client()
+    analyses, search, _related = make_analyses()
+    analyses.start_refresh(lambda: client, 0)
+    analyses.stop_refresh()
+    assert analyses.ready
+    client.read = []
+    entity = make_entity(1, "Noisy cells", "Cells only.", ["Biology"], edited=1)
+    client.put(entity)
+    analyses.apply_change(1, BlogPost.from_datastore_entity(entity))
+    assert hits(search, "genes") == [2]
+    assert not analyses.refresh(client)
+    # Stored: the next instance does not read it either.
+    started, started_search, _related = make_analyses()
+    assert started.load(client)
+    assert hits(started_search, "cells") == [1]
+    assert client.read == []
+
+    del client.entities[entity.key]
+    analyses.apply_change(1, None)
+    assert client.stored() == [2, 3]
+
+
+def test_drafts_and_scheduled_posts_are_left_out():
+    client = make_client()
+    draft = make_entity(4, "Draft genes", "Genes, not published.")
+    draft["published"] = datetime.datetime(9999, 12, 31, tzinfo=UTC)
+    scheduled = make_entity(5, "Scheduled genes", "Genes, tomorrow.")
+    scheduled["published"] = datetime.datetime.now(UTC) + datetime.timedelta(days=1)
+    client.put(draft)
+    client.put(scheduled)
+    analyses, search, _related = make_analyses()
+    assert analyses.load(client)
+    assert len(analyses) == 3
+    assert client.stored() == [1, 2, 3]
+    assert hits(search, "genes") == [1, 2]
+
+    # Saved as a draft by the admin (naive date).
+    post = BlogPost.from_datastore_entity(
+        client.entities[datastore.Key("BlogPost", 1, project="test")]
+    )
+    post.published = datetime.datetime(9999, 12, 31)
+    analyses.apply_change(1, post)
+    assert hits(search, "genes") == [2]
@@ -0,0 +1,245 @@
+"""Unit tests for the Datastore code paths of services.blog (the post index unloaded)."""
+
+import datetime
+
+import pytest
+
+from models.blog_post import BlogPost
+from services import blog as blog_service
+from services.pagination import PageCursor
+from services.post_index import post_index
+from tests.fake_datastore import FakeClient, post_entity
+
+UTC = datetime.UTC
+NOW = datetime.datetime.now(UTC)
+
+
+def days_ago(days):
+    return NOW - datetime.timedelta(days=days)
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    assert not post_index.ready
+    for cache in (
+        blog_service._post_counts,
+        blog_service._archive,
+        blog_service._tag_cloud,
+        blog_service._neighbours,
+    ):
+        cache.clear()
+
+
+def test_public_reads_leave_stale_renderings_to_backfill():
+    client = FakeClient([post_entity(1, days_ago(2)), post_entity(2, days_ago(1))])
+    current = BlogPost.from_datastore_entity(client.entities[client.key("BlogPost", 2)])
+    current.prerender()
+    client.entities[current.key].update(current.rendering_properties())
+
+    posts = blog_service.get_posts(client, limit=None)
+    assert [post.summary for post in posts] == ["<p>Body of post 2.</p>", "<p>Body of post 1.</p>"]
+    assert client.writes == []
+
+    assert blog_service.backfill_renderings(client) == 1
+    assert client.writes == [client.key("BlogPost", 1)]
+    stored = BlogPost.from_datastore_entity(client.entities[client.key("BlogPost", 1)])
+    assert stored.has_current_renderings
+    assert blog_service.backfill_renderings(client) == 0
+
+
+def filters(query):
+    """Filters of a query, without the values of the dates (which depend on now)."""
+    return [
+        (name, operator) if isinstance(value, datetime.datetime) else (name, operator, value)
+        for name, operator, value in query.filters
+    ]
+
+
+def counting_client():
+    return FakeClient(
+        [
+            post_entity(1, days_ago(3), tags=["Biology"], slugs=["biology"]),
+            post_entity(2, days_ago(2), tags=["Math"], slugs=["math"]),
+            post_entity(3, days_ago(1), tags=["Biology"], slugs=["biology"]),
+            # A draft (far future publication date, as set by the admin).
+            post_entity(4, datetime.datetime(9999, 12, 31, tzinfo=UTC), slugs=["biology"]),
+        ]
+    )
+
+
+def test_totals_are_counted_by_aggregation_and_cached():
+    client = counting_client()
+    posts, total = blog_service.get_posts(client, limit=2, with_total=True)
+    assert [post.key.id for post in posts] == [3, 2]
+    assert total == 3
+    posts, total = blog_service.get_posts_by_tag("biology", client, limit=1, with_total=True)
+    assert [post.key.id for post in posts] == [3]
+    assert total == 2
+    assert [filters(query) for query in client.counts] == [
+        [("published", "<=")],
+        [("slugs", "=", "biology"), ("published", "<=")],
+    ]
+
+    # Cached until a post changes.
+    assert blog_service.get_posts(client, limit=2, with_total=True)[1] == 3
+    assert len(client.counts) == 2
+    blog_service.delete_post(1, client)
+    assert blog_service.get_posts(client, limit=2, with_total=True)[1] == 2
+    assert len(client.counts) == 3
+
+
+def test_neighbours_from_projections():
+    client = counting_client()
+    post = BlogPost.from_datastore_entity(client.entities[client.key("BlogPost", 2)])
+    older, newer = blog_service.get_neighbours(post, client)
+    assert (older.key.id, older.path) == (1, "/post-1")
+    assert (newer.key.id, newer.path) == (3, "/post-3")
+    older_query, newer_query = client.queries
+    assert filters(older_query) == [("published", "<")]
+    assert older_query.order == ["-published"]
+    # The draft is newer, but not published.
+    assert filters(newer_query) == [("published", ">"), ("published", "<=")]
+    assert newer_query.order == ["published"]
+    assert older_query.projection == newer_query.projection == ["published", "path"]
+
+    newest = BlogPost.from_datastore_entity(client.entities[client.key("BlogPost", 3)])
+    older, newer = blog_service.get_neighbours(newest, client)
+    assert (older.key.id, newer) == (2, None)
+    # Cached per post.
+    blog_service.get_neighbours(post, client)
+    assert len(client.queries) == 4
+
+
+def test_archive_merges_the_tags_projection():
+    client = FakeClient(
+        [
+            post_entity(1, datetime.datetime(2019, 5, 1, tzinfo=UTC), tags=["Math", "Bayes"]),
+            post_entity(2, datetime.datetime(2020, 3, 1, tzinfo=UTC)),
+            post_entity(3, datetime.datetime(2020, 6, 1, tzinfo=UTC), tags=["Math", "Math"]),
+            post_entity(4, datetime.datetime(9999, 12, 31, tzinfo=UTC), tags=["Draft"]),
+        ]
+    )
+    archive = blog_service.get_archive(client)
+    assert [[post.key.id for post in year] for year in archive] == [[3, 2], [1]]
+    posts = {post.key.id: post for year in archive for post in year}
+    assert (posts[1].title, posts[1].path) == ("Post 1", "/post-1")
+    # Sorted and without duplicates; posts without tags are kept.
+    assert (posts[1].tags, posts[1].slugs) == (["Bayes", "Math"], ["bayes", "math"])
+    assert (posts[2].tags, posts[3].tags) == ([], ["Math"])
+
+    tags_query, query = client.queries
+    assert filters(tags_query) == filters(query) == [("published", "<=")]
+    assert tags_query.order == query.order == ["-published"]
+    assert tags_query.projection == ["published", "tags"]
+    assert query.projection == ["published", "path", "title"]
+
+    assert [(tag.name, tag.count) for tag in blog_service.get_tag_cloud(client)] == [
+        ("Bayes", 1),
+        ("Math", 2),
+    ]
+    # Both cached until a post changes.
+    blog_service.get_archive(client)
+    assert len(client.queries) == 4
+
+
+def test_post_dates_for_sitemaps():
+    client = FakeClient(
+        [
+            post_entity(1, days_ago(3), updated=days_ago(1), tags=["Math"]),
+            post_entity(2, days_ago(2)),
+            post_entity(3, datetime.datetime(9999, 12, 31, tzinfo=UTC)),
+        ]
+    )
+    posts = blog_service.list_post_dates(client)
+    assert [(post.key.id, post.path, post.updated) for post in posts] == [
+        (2, "/post-2", days_ago(2)),
+        (1, "/post-1", days_ago(1)),
+    ]
+    assert (posts[0].slugs, posts[1].slugs) == ([], ["math"])
+    assert [query.projection for query in client.queries] == [
+        ["published", "tags"],
+        ["published", "path", "updated"],
+    ]
+
+
+def batch_client():
+    """Posts 4 to 9 imported in one batch (published at the same time), a draft
+    (post 11) and posts before and after the batch."""
+    batch = days_ago(5)
+    return FakeClient(
+        [post_entity(post_id, days_ago(10 - post_id)) for post_id in (1, 2, 3)]
+        + [post_entity(post_id, batch) for post_id in range(4, 10)]
+        + [post_entity(10, days_ago(1))]
+        + [post_entity(11, datetime.datetime(9999, 12, 31, tzinfo=UTC))]
+    )
+
+
+# Newest first, the batch by key, descending.
+LISTING = [10, 9, 8, 7, 6, 5, 4, 3, 2, 1]
+
+
+def ids(page):
+    return [post.key.id for post in page.posts]
+
+
+def follow(client, token):
+    return blog_service.get_posts_page(client, PageCursor.decode(token), limit=3)
+
+
+def test_cursor_pages_walk_across_posts_published_together():
+    client = batch_client()
+    page = blog_service.get_posts_page(client, limit=3)
+    pages = [ids(page)]
+    assert (page.prev_cursor, page.prev_is_first) == (None, False)
+    while page.next_cursor is not None:
+        page = follow(client, page.next_cursor)
+        pages.append(ids(page))
+    assert pages == [[10, 9, 8], [7, 6, 5], [4, 3, 2], [1]]
+
+    back = []
+    while page.prev_cursor is not None:
+        page = follow(client, page.prev_cursor)
+        back.append(ids(page))
+    # Back to the first page, without a link to a previous one.
+    assert back == [[4, 3, 2], [7, 6, 5], [10, 9, 8]]
+    assert (page.prev_cursor, page.prev_is_first) == (None, False)
+    # From within the batch, the ties are read past the key, then the other posts.
+    ties = next(query for query in client.queries if query.projection == ["__key__"])
+    assert filters(ties)[0] == ("published", "=")
+    assert ties.filters[1] == ("__key__", "<", client.key("BlogPost", 8))
+    assert ties.order == ["-__key__"]
+
+
+@pytest.mark.parametrize("offset", range(1, len(LISTING)))
+def test_offset_pages_lead_to_cursor_pages(offset):
+    client = batch_client()
+    page = blog_service.get_posts_page(client, limit=3, offset=offset)
+    assert ids(page) == LISTING[offset : offset + 3]
+    if page.next_cursor is not None:
+        assert ids(follow(client, page.next_cursor)) == LISTING[offset + 3 : offset + 6]
+    else:
+        assert offset + 3 >= len(LISTING)
+    if offset <= 3:
+        assert page.prev_is_first
+    else:
+        assert ids(follow(client, page.prev_cursor)) == LISTING[offset - 3 : offset]
+
+
+def test_page_dates_are_read_before_the_posts():
+    client = batch_client()
+    client.entities[client.key("BlogPost", 8)]["updated"] = days_ago(0)
+    page = blog_service.get_posts_page(client, limit=3, read_posts=False)
+    assert [(post.key.id, post.updated) for post in page.posts] == [
+        (10, days_ago(1)),
+        (9, days_ago(5)),
+        (8, days_ago(0)),
+    ]
+    assert not any(isinstance(post, BlogPost) for post in page.posts)
+    page_query, dates_query = client.queries
+    assert page_query.projection == ["published"]
+    assert dates_query.projection == ["published", "updated"]
+    assert filters(dates_query) == [("published", ">="), ("published", "<=")]
+
+    read = blog_service.read_page_posts(page, client)
+    assert [post.title for post in read.posts] == ["Post 10", "Post 9", "Post 8"]
+    assert read.next_cursor == page.next_cursor
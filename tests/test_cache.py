@@ -0,0 +1,56 @@
+"""Unit tests for the in-process TTL cache."""
+
+from services.cache import TTLCache
+
+
+def test_ttl_cache_computes_once():
+    cache = TTLCache(ttl=60)
+    calls = []
+    assert cache.get_or_compute("key", lambda: calls.append(1) or 42) == 42
+    assert cache.get_or_compute("key", lambda: calls.append(1) or 43) == 42
+    assert len(calls) == 1
+
+
+def test_ttl_cache_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("services.cache.time.monotonic", lambda: now[0])
+    cache = TTLCache(ttl=10)
+    cache.get_or_compute("key", lambda: 1)
+    now[0] += 9
+    assert cache.get_or_compute("key", lambda: 2) == 1
+    now[0] += 2
+    assert cache.get_or_compute("key", lambda: 3) == 3
+
+
+def test_ttl_cache_clear_as_listener():
+    cache = TTLCache(ttl=60)
+    cache.get_or_compute("a", lambda: 1)
+    cache.get_or_compute("b", lambda: 2)
+    cache.clear(123, None)
+    assert len(cache) == 0
+
+
+def test_ttl_cache_bounded():
+    cache = TTLCache(ttl=60, max_entries=2)
+    for key in "abc":
+        cache.get_or_compute(key, lambda key=key: key)
+    assert len(cache) == 2
+    assert cache.get_or_compute("a", lambda: "recomputed") == "recomputed"
+
+
+def test_ttl_cache_disabled():
+    cache = TTLCache(ttl=0)
+    cache.get_or_compute("key", lambda: 1)
+    assert cache.get_or_compute("key", lambda: 2) == 2
+
+
+def test_ttl_cache_does_not_store_values_computed_across_a_clear():
+    cache = TTLCache(ttl=60)
+
+    def compute():
+        cache.clear()  # A post changes while the value is computed.
+        return "stale"
+
+    assert cache.get_or_compute("key", compute) == "stale"
+    assert cache.get_or_compute("key", lambda: "fresh") == "fresh"
+    assert cache.get_or_compute("key", lambda: "recomputed") == "fresh"
@@ -0,0 +1,89 @@
+"""Unit tests for content encoding negotiation and precompressed static files."""
+
+import gzip
+import os
+
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+
+from compression import (
+    PrecompressedStaticFiles,
+    accepted_encodings,
+    is_compressible,
+    precompress_directory,
+)
+
+SCRIPT = b"function f() { return 1; }\n" * 100
+
+
+def test_accepted_encodings():
+    assert accepted_encodings("gzip, deflate") == ["gzip"]
+    assert accepted_encodings("GZIP;q=0.5") == ["gzip"]
+    assert accepted_encodings("gzip;q=0") == []
+    assert accepted_encodings("identity") == []
+    assert accepted_encodings(None) == []
+
+
+def test_is_compressible():
+    assert is_compressible("text/html; charset=utf-8")
+    assert is_compressible("application/javascript")
+    assert not is_compressible("image/png")
+    assert not is_compressible(None)
+
+
+def test_precompress_directory(tmp_path):
+    (tmp_path / "js").mkdir()
+    (tmp_path / "js" / "app.js").write_bytes(SCRIPT)
+    (tmp_path / "tiny.css").write_bytes(b"a{}")
+    (tmp_path / "photo.png").write_bytes(os.urandom(4096))
+
+    written = precompress_directory(tmp_path)
+    assert tmp_path / "js" / "app.js.gz" in written
+    assert not (tmp_path / "tiny.css.gz").exists()
+    assert not (tmp_path / "photo.png.gz").exists()
+    assert gzip.decompress((tmp_path / "js" / "app.js.gz").read_bytes()) == SCRIPT
+    # Up-to-date copies are not rewritten.
+    assert precompress_directory(tmp_path) == []
+
+
+def make_client(directory):
+    app = Starlette(routes=[Mount("/static", app=PrecompressedStaticFiles(directory=directory))])
+    return TestClient(app)
+
+
+def test_precompressed_static_files(tmp_path):
+    (tmp_path / "app.js").write_bytes(SCRIPT)
+    precompress_directory(tmp_path)
+    client = make_client(tmp_path)
+
+    response = client.get("/static/app.js", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < len(SCRIPT)
+    assert response.content == SCRIPT
+
+    cached = client.get(
+        "/static/app.js",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["etag"]},
+    )
+    assert cached.status_code == 304
+
+    plain = client.get("/static/app.js", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.content == SCRIPT
+    # Ranges apply to the original file.
+    partial = client.get(
+        "/static/app.js", headers={"Accept-Encoding": "gzip", "Range": "bytes=0-9"}
+    )
+    assert partial.status_code == 206
+    assert "content-encoding" not in partial.headers
+
+
+def test_precompressed_static_files_outdated(tmp_path):
+    (tmp_path / "app.js").write_bytes(SCRIPT)
+    precompress_directory(tmp_path)
+    stat_result = os.stat(tmp_path / "app.js.gz")
+    os.utime(tmp_path / "app.js", ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 10**9))
+    response = make_client(tmp_path).get("/static/app.js", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
@@ -0,0 +1,117 @@
+"""Unit tests for the dependency graph from posts to pages."""
+
+import datetime
+from types import SimpleNamespace
+
+from google.cloud import datastore
+
+from models.blog_post import BlogPost
+from services.dependencies import DependencyTracker, SiteGraph, route_path, update_export
+from services.post_index import PostIndex
+
+UTC = datetime.UTC
+
+SETTINGS = SimpleNamespace(
+    url_prefix="",
+    host="https://example.com",
+    date_format="%d %B %Y",
+    copyright_year=2024,
+    posts_per_page=2,
+    disqus_shortname="example",
+)
+
+
+def make_post(i, slugs=None, title=None):
+    published = datetime.datetime(2020, 1, 1 + i, tzinfo=UTC)
+    slugs = slugs if slugs is not None else ["odd" if i % 2 else "even"]
+    return BlogPost(
+        key=datastore.Key("BlogPost", i, project="test"),
+        title=title or f"Post {i}",
+        body=f"Body of post {i}.",
+        published=published,
+        updated=published,
+        path=f"/2020/01/post-{i}",
+        tags=slugs,
+        slugs=slugs,
+    )
+
+
+def make_posts(*changed):
+    """Posts 1..6, newest first, with `changed` posts replacing theirs."""
+    posts = {i: make_post(i) for i in range(1, 7)}
+    posts.update({post.key.id: post for post in changed})
+    return sorted(posts.values(), key=lambda post: post.published, reverse=True)
+
+
+def test_route_path():
+    assert route_path("/") == "/"
+    assert route_path("/page/3/") == "/"
+    assert route_path("/tag/odd/page/2/") == "/tag/odd"
+    assert route_path("/tag/odd/") == "/tag/odd"
+    assert route_path("/archive/") == "/archive"
+    assert route_path("/2020/01/post-1") == "/2020/01/post-1"
+
+
+def test_site_graph_edit():
+    before = SiteGraph.from_posts(make_posts(), SETTINGS)
+    assert before.pages_of(3) == {
+        "/page/2/",
+        "/tag/odd/",
+        "/archive/",
+        "/feed.xml",
+        "/2020/01/post-2",
+        "/2020/01/post-3",
+        "/2020/01/post-4",
+    }
+    after = SiteGraph.from_posts(make_posts(make_post(3, title="New title")), SETTINGS)
+    # Only the pages showing the post change: not the other listing pages.
+    assert before.changed_pages(after) == before.pages_of(3)
+
+
+def test_site_graph_tag_change():
+    before = SiteGraph.from_posts(make_posts(), SETTINGS)
+    after = SiteGraph.from_posts(make_posts(make_post(6, slugs=["odd"])), SETTINGS)
+    changed = before.changed_pages(after)
+    # Post 6 moves from the even tag to the top of the odd one: both shift.
+    assert {"/tag/even/", "/tag/even/page/2/", "/tag/odd/page/2/"} <= changed
+    assert "/page/2/" not in changed and "/about/" not in changed
+
+
+def test_dependency_tracker():
+    index = PostIndex()
+    index.load(SimpleNamespace(query=lambda kind: SimpleNamespace(fetch=lambda: [])))
+    for post in make_posts():
+        index.apply_change(post.key.id, post)
+    tracker = DependencyTracker(index, SETTINGS)
+    assert tracker.post_changed(1) is None  # No graph yet.
+
+    tracker.rebuild()
+    post = make_post(1, title="New title")
+    index.apply_change(1, post)
+    affected = tracker.post_changed(1, post)
+    assert affected == {
+        "/page/3/",
+        "/tag/odd/page/2/",
+        "/archive/",
+        "/feed.xml",
+        "/2020/01/post-1",
+        "/2020/01/post-2",
+    }
+
+    index.apply_change(6, None)
+    affected = tracker.post_changed(6)
+    assert {"/", "/page/2/", "/page/3/", "/2020/01/post-6", "/2020/01/post-5"} <= affected
+
+
+def test_update_export(tmp_path):
+    written, deleted = update_export(make_posts(), SETTINGS, tmp_path, workers=1)
+    assert "index.html" in written and deleted == []
+    assert update_export(make_posts(), SETTINGS, tmp_path, workers=1) == ([], [])
+
+    posts = make_posts(make_post(2, slugs=["prime"]))
+    written, deleted = update_export(posts, SETTINGS, tmp_path, workers=1)
+    assert "2020/01/post-2/index.html" in written
+    assert "tag/prime/index.html" in written
+    assert "2020/01/post-5/index.html" not in written
+    assert deleted == ["tag/even/page/2/index.html"]
+    assert not (tmp_path / "tag/even/page/2/index.html").exists()
@@ -0,0 +1,77 @@
+"""Unit tests for the static export of the site."""
+
+import datetime
+from types import SimpleNamespace
+
+import pytest
+from google.cloud import datastore
+
+from models.blog_post import BlogPost
+from services.export import ExportPage, export_site, listing_path, site_pages
+
+UTC = datetime.UTC
+
+SETTINGS = SimpleNamespace(
+    url_prefix="",
+    host="https://example.com",
+    date_format="%d %B %Y",
+    copyright_year=2024,
+    posts_per_page=2,
+    disqus_shortname="example",
+)
+
+
+def make_posts():
+    posts = []
+    for i in range(5):
+        published = datetime.datetime(2020 + i // 3, 1, 1 + i, tzinfo=UTC)
+        posts.append(
+            BlogPost(
+                key=datastore.Key("BlogPost", i + 1, project="test"),
+                title=f"Post {i}",
+                body=f"Body of *post {i}*.",
+                published=published,
+                updated=published,
+                path=f"/{published.year}/01/post-{i}",
+                tags=["Odd" if i % 2 else "Even"],
+                slugs=["odd" if i % 2 else "even"],
+            )
+        )
+    return posts[::-1]  # Newest first.
+
+
+def test_export_page_filename():
+    assert ExportPage("/", "listing.html", {}).filename == "index.html"
+    assert ExportPage("/page/2/", "listing.html", {}).filename == "page/2/index.html"
+    assert ExportPage("/2024/01/post", "post.html", {}).filename == "2024/01/post/index.html"
+    assert ExportPage("/robots.txt", "robots.txt", {}).filename == "robots.txt"
+    assert listing_path("/tag/odd/", 1) == "/tag/odd/"
+    assert listing_path("/tag/odd/", 3) == "/tag/odd/page/3/"
+
+
+def test_site_pages():
+    pages = {page.path: page for page in site_pages(make_posts(), SETTINGS)}
+    assert {"/", "/page/2/", "/page/3/", "/tag/even/", "/tag/even/page/2/", "/tag/odd/"} <= set(
+        pages
+    )
+    assert "/page/4/" not in pages and "/tag/odd/page/2/" not in pages
+    assert [post.title for post in pages["/page/2/"].context["posts"]] == ["Post 2", "Post 1"]
+    assert pages["/page/2/"].context["prev_page"] == "/"
+    assert pages["/page/2/"].context["next_page"] == "/page/3/"
+    assert pages["/2020/01/post-0"].template == "post.html"
+    by_year = pages["/archive/"].context["by_year"]
+    assert [len(posts) for posts in by_year] == [2, 3]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_export_site(tmp_path, workers):
+    files = export_site(make_posts(), SETTINGS, tmp_path, workers=workers)
+    assert "index.html" in files and "2021/01/post-4/index.html" in files
+    front = (tmp_path / "index.html").read_text()
+    assert "Post 4" in front and "Post 2" not in front
+    assert 'href="/page/2/"' in front
+    post = (tmp_path / "2020/01/post-0/index.html").read_text()
+    assert "<em>post 0</em>" in post
+    assert (tmp_path / "robots.txt").read_text().startswith("User-agent")
+    assert (tmp_path / "static/js/locus.js").exists()
+    assert len(list((tmp_path / "static/js").glob("locus.*.js"))) == 1
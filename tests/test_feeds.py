@@ -0,0 +1,89 @@
+"""Unit tests for the Atom feed and lastpost.json."""
+
+import datetime
+import json
+import xml.etree.ElementTree as ET
+from types import SimpleNamespace
+
+from fastapi.templating import Jinja2Templates
+from google.cloud import datastore
+
+from models.blog_post import BlogPost
+from services.feeds import feed_context, lastpost_json, rfc3339
+from utils import absolutify_url
+
+UTC = datetime.UTC
+ATOM = "{http://www.w3.org/2005/Atom}"
+
+SETTINGS = SimpleNamespace(url_prefix="/blog", host="https://example.com/")
+
+
+def make_post(post_id, published, updated=None):
+    return BlogPost(
+        key=datastore.Key("BlogPost", post_id, project="test"),
+        title=f"Post <{post_id}>",
+        body=f"See [this](/2020/01/post-{post_id}) and ![a figure](/img/{post_id}.png) & more.",
+        published=published,
+        updated=updated or published,
+        path=f"/2020/01/post-{post_id}",
+        tags=["Statistics", "R & Python"],
+        slugs=["statistics", "r-python"],
+    )
+
+
+def test_absolutify_url():
+    html = (
+        '<a href="/x">x</a><img SRC=\'/i.png\'><a href="//cdn.com/y"></a>'
+        '<a href="https://other.com/z"></a><a data-href="/q"></a><a href="#top"></a>'
+    )
+    assert absolutify_url(html, "https://h.com/blog/") == (
+        "<a href=\"https://h.com/blog/x\">x</a><img SRC='https://h.com/blog/i.png'>"
+        '<a href="//cdn.com/y"></a><a href="https://other.com/z"></a>'
+        '<a data-href="/q"></a><a href="#top"></a>'
+    )
+
+
+def test_rfc3339():
+    assert rfc3339(datetime.datetime(2024, 1, 2, 3, 4, 5, 678)) == "2024-01-02T03:04:05Z"
+    tz = datetime.timezone(datetime.timedelta(hours=2))
+    assert rfc3339(datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=tz)) == "2024-01-02T01:04:05Z"
+
+
+def test_atom_feed():
+    posts = [
+        make_post(2, datetime.datetime(2024, 2, 1, tzinfo=UTC)),
+        make_post(
+            1,
+            datetime.datetime(2024, 1, 1, tzinfo=UTC),
+            updated=datetime.datetime(2024, 3, 1, tzinfo=UTC),
+        ),
+    ]
+    templates = Jinja2Templates(directory="templates")
+    document = templates.get_template("feed.xml").render(feed_context(posts, SETTINGS))
+    feed = ET.fromstring(document)
+    assert feed.findtext(f"{ATOM}updated") == "2024-03-01T00:00:00Z"
+    assert feed.find(f"{ATOM}link[@rel='self']").get("href") == "https://example.com/blog/feed.xml"
+    entries = feed.findall(f"{ATOM}entry")
+    assert [entry.findtext(f"{ATOM}title") for entry in entries] == ["Post <2>", "Post <1>"]
+    assert entries[0].findtext(f"{ATOM}id") == "https://example.com/blog/2020/01/post-2"
+    assert [c.get("term") for c in entries[0].findall(f"{ATOM}category")] == [
+        "Statistics",
+        "R & Python",
+    ]
+    content = entries[0].findtext(f"{ATOM}content")
+    assert 'href="https://example.com/blog/2020/01/post-2"' in content
+    assert 'src="https://example.com/blog/img/2.png"' in content
+
+    empty = ET.fromstring(templates.get_template("feed.xml").render(feed_context([], SETTINGS)))
+    assert empty.findall(f"{ATOM}entry") == []
+
+
+def test_lastpost_json():
+    post = make_post(3, datetime.datetime(2024, 5, 17, tzinfo=UTC))
+    data = json.loads(lastpost_json(post, SETTINGS))
+    assert data["path"] == "/2020/01/post-3"
+    assert data["url"] == "https://example.com/blog/2020/01/post-3"
+    assert data["pubdate"] == "May 17, 2024"
+    assert data["tag_pairs"] == [["Statistics", "statistics"], ["R & Python", "r-python"]]
+    assert 'href="https://example.com/blog/2020/01/post-3"' in data["summary"]
+    assert json.loads(lastpost_json(None, SETTINGS)) == {}
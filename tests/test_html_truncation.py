@@ -1,6 +1,6 @@
 import pytest
 
-from utils import HTMLStreamer, HTMLWordTruncator
+from utils import HTMLStreamer, HTMLWordTruncator, count_html_words
 
 # Tests for HTMLStreamer
 
@@ -378,3 +378,16 @@ def test_html_word_truncator_complex_nesting():
     truncator = HTMLWordTruncator(max_words=5)
     expected = "<div><p>Here is <em>some <i>very important__TRUNCATION_MARKER_</i></em></p></div>"
     assert truncator.process(html) == expected
+
+
+@pytest.mark.parametrize(
+    "html_input, expected_count",
+    [
+        ("", 0),
+        ("<p>one two <b>three</b></p>", 3),
+        ("<p>well-known words</p>", 2),
+        ("<img src='a-b-c.png'> <br/> &amp;", 0),
+    ],
+)
+def test_count_html_words(html_input, expected_count):
+    assert count_html_words(html_input) == expected_count
@@ -0,0 +1,99 @@
+"""Unit tests for the HTTP validator helpers."""
+
+import datetime
+
+import pytest
+from fastapi import Request
+
+from http_cache import (
+    RangeNotSatisfiable,
+    http_date,
+    is_not_modified,
+    make_etag,
+    not_modified_response,
+    parse_byte_range,
+    template_version,
+)
+
+UPDATED = datetime.datetime(2024, 3, 1, 12, 30, 15, 250000, tzinfo=datetime.UTC)
+
+
+def make_request(**headers):
+    raw = [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "GET", "headers": raw})
+
+
+def test_make_etag_is_strong_and_stable():
+    etag = make_etag("v1", 42, UPDATED)
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == make_etag("v1", 42, UPDATED)
+    assert etag != make_etag("v1", 42, UPDATED + datetime.timedelta(seconds=1))
+
+
+@pytest.mark.parametrize(
+    "if_none_match, expected",
+    [
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"xyz", "abc"', True),
+        ("*", True),
+        ('"xyz"', False),
+    ],
+)
+def test_if_none_match(if_none_match, expected):
+    request = make_request(if_none_match=if_none_match)
+    assert is_not_modified(request, '"abc"', UPDATED) is expected
+
+
+def test_if_none_match_takes_precedence_over_if_modified_since():
+    request = make_request(if_none_match='"xyz"', if_modified_since=http_date(UPDATED))
+    assert not is_not_modified(request, '"abc"', UPDATED)
+
+
+def test_if_modified_since():
+    # HTTP dates have no fraction of a second.
+    assert is_not_modified(make_request(if_modified_since=http_date(UPDATED)), '"a"', UPDATED)
+    earlier = http_date(UPDATED - datetime.timedelta(seconds=1))
+    assert not is_not_modified(make_request(if_modified_since=earlier), '"a"', UPDATED)
+    assert not is_not_modified(make_request(if_modified_since="garbage"), '"a"', UPDATED)
+    assert not is_not_modified(make_request(), '"a"', UPDATED)
+
+
+def test_not_modified_response_headers():
+    response = not_modified_response(make_request(if_none_match='"abc"'), '"abc"', UPDATED)
+    assert response.status_code == 304
+    assert response.headers["etag"] == '"abc"'
+    assert response.headers["last-modified"] == "Fri, 01 Mar 2024 12:30:15 GMT"
+    assert not_modified_response(make_request(), '"abc"', UPDATED) is None
+
+
+def test_template_version(tmp_path):
+    (tmp_path / "page.html").write_text("<p>{{ x }}</p>")
+    version = template_version(tmp_path, "fingerprint")
+    assert version == template_version(tmp_path, "fingerprint")
+    assert version != template_version(tmp_path, "other fingerprint")
+    (tmp_path / "page.html").write_text("<div>{{ x }}</div>")
+    assert version != template_version(tmp_path, "fingerprint")
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-9", (0, 9)),
+        ("bytes=90-", (90, 99)),
+        ("bytes=-10", (90, 99)),
+        ("bytes=-500", (0, 99)),
+        ("bytes=95-200", (95, 99)),
+        ("bytes=5-3", None),
+        ("bytes=0-1,5-6", None),
+        ("items=0-9", None),
+        ("bytes=a-b", None),
+    ],
+)
+def test_parse_byte_range(header, expected):
+    assert parse_byte_range(header, 100) == expected
+
+
+def test_parse_byte_range_not_satisfiable():
+    with pytest.raises(RangeNotSatisfiable):
+        parse_byte_range("bytes=100-", 100)
@@ -0,0 +1,191 @@
+"""Unit tests for the image sources and the on-disk image cache."""
+
+import io
+import os
+
+import pytest
+
+from services.images import (
+    ImageDiskCache,
+    ImageVariant,
+    LocalImageSource,
+    choose_variant,
+    is_negotiated,
+    supported_formats,
+)
+
+
+class CountingSource(LocalImageSource):
+    """Local directory source counting the downloads."""
+
+    def __init__(self, directory):
+        super().__init__(directory, chunk_size=3)
+        self.downloads = 0
+        self.stats = 0
+
+    def stat(self, name):
+        self.stats += 1
+        return super().stat(name)
+
+    def download(self, image, file):
+        self.downloads += 1
+        super().download(image, file)
+
+
+@pytest.fixture
+def source(tmp_path):
+    images = tmp_path / "bucket"
+    (images / "figs").mkdir(parents=True)
+    (images / "figs" / "a.png").write_bytes(b"a" * 40)
+    (images / "b.jpg").write_bytes(b"b" * 40)
+    (images / "c.gif").write_bytes(b"c" * 40)
+    return CountingSource(images)
+
+
+def test_local_source_ranges(source):
+    image = source.stat("figs/a.png")
+    assert image.size == 40
+    assert image.media_type == "image/png"
+    assert b"".join(source.iter_bytes(image, 5, 9)) == b"aaaaa"
+    buffer = io.BytesIO()
+    source.download(image, buffer)
+    assert buffer.getvalue() == b"a" * 40
+    assert source.stat("missing.png") is None
+    assert source.stat("figs") is None
+
+
+def test_image_cache_hit_skips_download(source, tmp_path):
+    cache = ImageDiskCache(tmp_path / "cache", max_bytes=100)
+    image = source.stat("figs/a.png")
+    path = cache.fetch(source, image)
+    assert path.read_bytes() == b"a" * 40
+    assert cache.fetch(source, image) == path
+    assert source.downloads == 1
+    assert not [name for name in os.listdir(tmp_path / "cache") if name.startswith(".")]
+
+
+def test_image_cache_lru_eviction_by_bytes(source, tmp_path):
+    cache = ImageDiskCache(tmp_path / "cache", max_bytes=100)
+    a, b, c = (source.stat(name) for name in ("figs/a.png", "b.jpg", "c.gif"))
+    cache.fetch(source, a)
+    cache.fetch(source, b)
+    cache.fetch(source, a)  # Now b is least recently used.
+    cache.fetch(source, c)
+    assert cache.total_bytes == 80
+    assert cache.get(b) is None
+    assert cache.get(a) is not None and cache.get(c) is not None
+    assert len(os.listdir(tmp_path / "cache")) == 2
+
+
+def test_image_cache_new_generation_replaces_old(source, tmp_path):
+    cache = ImageDiskCache(tmp_path / "cache", max_bytes=100)
+    old = source.stat("b.jpg")
+    cache.fetch(source, old)
+    (source.directory / "b.jpg").write_bytes(b"B" * 10)
+    os.utime(source.directory / "b.jpg", ns=(0, old.generation + 1))
+    new = source.stat("b.jpg")
+    assert cache.fetch(source, new).read_bytes() == b"B" * 10
+    assert cache.get(old) is None
+    assert cache.total_bytes == 10
+    assert len(os.listdir(tmp_path / "cache")) == 1
+
+
+def test_image_cache_keeps_pinned_files_until_released(source, tmp_path):
+    cache = ImageDiskCache(tmp_path / "cache", max_bytes=50)
+    a, b = source.stat("figs/a.png"), source.stat("b.jpg")
+    path = cache.fetch(source, a, pin=True)
+    cache.fetch(source, b)  # Evicts a, which is being sent.
+    assert cache.get(a) is None
+    assert cache.total_bytes == 40
+    assert path.read_bytes() == b"a" * 40
+    cache.release(path)
+    assert not path.exists()
+    assert len(os.listdir(tmp_path / "cache")) == 1
+
+
+def test_image_cache_skips_images_larger_than_cache(source, tmp_path):
+    cache = ImageDiskCache(tmp_path / "cache", max_bytes=30)
+    assert cache.fetch(source, source.stat("b.jpg")) is None
+    assert len(cache) == 0
+
+
+def test_image_cache_adopts_files_after_restart(source, tmp_path):
+    image = source.stat("c.gif")
+    ImageDiskCache(tmp_path / "cache", max_bytes=100).fetch(source, image)
+    cache = ImageDiskCache(tmp_path / "cache", max_bytes=100)
+    assert cache.total_bytes == 40
+    assert cache.fetch(source, image) is not None
+    assert source.downloads == 1
+
+
+def test_image_cache_metadata_ttl(source, tmp_path):
+    cache = ImageDiskCache(tmp_path / "cache", max_bytes=100, metadata_ttl=60)
+    assert cache.stat(source, "b.jpg") is cache.stat(source, "b.jpg")
+    assert source.stats == 1
+    uncached = ImageDiskCache(tmp_path / "other", max_bytes=100, metadata_ttl=0)
+    uncached.stat(source, "b.jpg")
+    uncached.stat(source, "b.jpg")
+    assert source.stats == 3
+    # The metadata of at most `max_metadata` images is kept.
+    small = ImageDiskCache(tmp_path / "small", max_bytes=100, max_metadata=1)
+    small.stat(source, "b.jpg")
+    small.stat(source, "c.gif")
+    small.stat(source, "b.jpg")
+    assert source.stats == 6
+
+
+def write_test_image(path, size=(100, 50), mode="RGB"):
+    Image = pytest.importorskip("PIL.Image")
+    Image.new(mode, size, "red").save(path)
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        ("image/avif,image/webp,*/*", "avif"),
+        ("image/webp,*/*", "webp"),
+        ("image/avif;q=0,image/webp;q=0.8", "webp"),
+        ("*/*", "png"),
+        (None, "png"),
+    ],
+)
+def test_choose_variant_negotiates_format(tmp_path, accept, expected):
+    write_test_image(tmp_path / "a.png")
+    image = LocalImageSource(tmp_path).stat("a.png")
+    if expected not in supported_formats():
+        pytest.skip(f"Pillow cannot encode {expected}")
+    variant = choose_variant(image, 640, None, accept)
+    assert (variant.width, variant.format) == (640, expected)
+
+
+def test_choose_variant_original(tmp_path):
+    write_test_image(tmp_path / "a.png")
+    (tmp_path / "b.svg").write_text("<svg/>")
+    source = LocalImageSource(tmp_path)
+    # No parameter, or only the original format: the original as is.
+    assert choose_variant(source.stat("a.png"), None, None, "image/webp") is None
+    assert choose_variant(source.stat("a.png"), None, "original", "image/webp") is None
+    assert choose_variant(source.stat("a.png"), None, "jpeg", None).format == "jpeg"
+    assert choose_variant(source.stat("b.svg"), 640, "webp", "image/webp") is None
+    assert is_negotiated(640, None) and is_negotiated(None, "auto")
+    assert not is_negotiated(640, "webp") and not is_negotiated(None, None)
+
+
+def test_image_cache_variants(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    (tmp_path / "bucket").mkdir()
+    write_test_image(tmp_path / "bucket" / "a.png", size=(1000, 500), mode="RGBA")
+    source = CountingSource(tmp_path / "bucket")
+    cache = ImageDiskCache(tmp_path / "cache", max_bytes=10**7)
+    image = source.stat("a.png")
+
+    path = cache.fetch(source, image, ImageVariant(320, "jpeg"))
+    with Image.open(path) as variant:
+        assert (variant.format, variant.size) == ("JPEG", (320, 160))
+    assert cache.fetch(source, image, ImageVariant(320, "jpeg")) == path
+    # Narrower images are not enlarged.
+    with Image.open(cache.fetch(source, image, ImageVariant(1280, "png"))) as variant:
+        assert variant.size == (1000, 500)
+    # The original was downloaded once and cached along with the variants.
+    assert source.downloads == 1
+    assert len(cache) == 3
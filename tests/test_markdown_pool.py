@@ -0,0 +1,45 @@
+"""Unit tests for the pooled Markdown converters."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import markdown
+
+from models.blog_post import markdown_pool
+from models.markdown_pool import MarkdownPool, cached_html_formatter
+
+
+def test_markdown_pool_reuses_converters():
+    created = []
+
+    def factory():
+        md = markdown.Markdown()
+        created.append(md)
+        return md
+
+    pool = MarkdownPool({"plain": factory})
+    assert pool.convert("plain", "*one*") == "<p><em>one</em></p>"
+    assert pool.convert("plain", "two") == "<p>two</p>"
+    assert len(created) == 1
+
+
+def test_markdown_pool_resets_converters():
+    pool = MarkdownPool({"plain": markdown.Markdown})
+    # Reference definitions must not leak from one document to the next.
+    pool.convert("plain", "[link][1]\n\n[1]: http://example.com")
+    assert pool.convert("plain", "[link][1]") == "<p>[link][1]</p>"
+
+
+def test_markdown_pool_is_thread_safe():
+    bodies = [f"Post *{i}*\n\n[sourcecode:py]\nx = {i}\n[/sourcecode]" for i in range(64)]
+    expected = [markdown_pool.convert("full", body) for body in bodies]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda body: markdown_pool.convert("full", body), bodies))
+    assert results == expected
+
+
+def test_cached_html_formatter_shared_per_options():
+    first = cached_html_formatter(lang_str="language-py", linenos=True, hl_lines=[1])
+    second = cached_html_formatter(lang_str="language-r", linenos=True, hl_lines=[1])
+    other = cached_html_formatter(lang_str="language-py", linenos=False, hl_lines=[1])
+    assert first is second
+    assert first is not other
@@ -0,0 +1,148 @@
+"""Unit tests for the full-page cache middleware."""
+
+import time
+
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+
+from page_cache import PageCache, PageCacheMiddleware
+
+
+class FakeSessionMiddleware:
+    """Stands for SessionMiddleware: the session comes from an X-User header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            user = dict(scope["headers"]).get(b"x-user")
+            scope["session"] = {"user": user.decode()} if user else {}
+        await self.app(scope, receive, send)
+
+
+def make_client(cache):
+    app = FastAPI()
+    app.state.renders = 0
+
+    @app.get("/about")
+    def about():
+        app.state.renders += 1
+        return Response(f"render {app.state.renders}", headers={"ETag": '"v1"'})
+
+    @app.get("/2024/01/missing")
+    def missing():
+        app.state.renders += 1
+        return Response("not found", status_code=404)
+
+    @app.get("/{year:int}/{month:int}/{slug}")
+    def post(year: int, month: int, slug: str):
+        app.state.renders += 1
+        return Response(f"/{year}/{month:02d}/{slug.lower()}")
+
+    @app.get("/admin/")
+    def admin():
+        app.state.renders += 1
+        return Response("admin")
+
+    app.add_middleware(PageCacheMiddleware, cache=cache)
+    app.add_middleware(FakeSessionMiddleware)
+    return TestClient(app), app.state
+
+
+def test_page_cache_hit():
+    client, state = make_client(PageCache(ttl=60))
+    first = client.get("/about")
+    second = client.get("/about")
+    assert (first.headers["x-cache"], second.headers["x-cache"]) == ("MISS", "HIT")
+    assert second.text == "render 1"
+    assert state.renders == 1
+    # The query string is part of the key.
+    assert client.get("/about?x=1").headers["x-cache"] == "MISS"
+
+
+def test_page_cache_bypass():
+    client, state = make_client(PageCache(ttl=60))
+    client.get("/about")
+    # Signed-in admin, other methods and other paths go to the route.
+    assert client.get("/about", headers={"X-User": "admin"}).text == "render 2"
+    client.get("/admin/")
+    client.get("/admin/")
+    assert state.renders == 4
+
+
+def test_page_cache_errors_not_cached():
+    client, state = make_client(PageCache(ttl=60))
+    assert client.get("/2024/01/missing").status_code == 404
+    assert client.get("/2024/01/missing").status_code == 404
+    assert state.renders == 2
+
+
+def test_page_cache_conditional_get():
+    client, state = make_client(PageCache(ttl=60))
+    client.get("/about")
+    response = client.get("/about", headers={"If-None-Match": '"v1"'})
+    assert response.status_code == 304
+    assert response.headers["etag"] == '"v1"'
+    assert state.renders == 1
+
+
+def test_page_cache_stale_while_revalidate():
+    cache = PageCache(ttl=0.05, stale_ttl=60)
+    client, state = make_client(cache)
+    # One event loop for all the requests, as in a server, for the background refresh.
+    with client:
+        client.get("/about")
+        time.sleep(0.1)
+        stale = client.get("/about")
+        assert stale.headers["x-cache"] == "STALE"
+        assert stale.text == "render 1"
+        cache.ttl = 60
+        # The background refresh stores a newer page.
+        deadline = time.monotonic() + 5
+        while state.renders < 2:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        assert client.get("/about").text == "render 2"
+
+
+def test_page_cache_clear():
+    cache = PageCache(ttl=60)
+    client, state = make_client(cache)
+    client.get("/about")
+    cache.clear("post id", None)
+    assert len(cache) == 0
+    assert client.get("/about").text == "render 2"
+
+
+def test_page_cache_post_paths_are_canonical():
+    cache = PageCache(ttl=60)
+    client, state = make_client(cache)
+    client.get("/2024/01/title")
+    # Other spellings of the post path are the same page, invalidated with it.
+    assert client.get("/2024/1/Title").headers["x-cache"] == "HIT"
+    assert len(cache) == 1
+    cache.invalidate({"/2024/01/title"})
+    assert client.get("/2024/1/TITLE").headers["x-cache"] == "MISS"
+    assert state.renders == 2
+
+
+def test_page_cache_compressed():
+    cache = PageCache(ttl=60)
+    app = FastAPI()
+
+    @app.get("/archive")
+    def archive():
+        return Response("<li>post</li>" * 200, media_type="text/html")
+
+    app.add_middleware(PageCacheMiddleware, cache=cache)
+    app.add_middleware(FakeSessionMiddleware)
+    client = TestClient(app)
+    client.get("/archive")
+    response = client.get("/archive", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["x-cache"] == "HIT"
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.text == "<li>post</li>" * 200
+    identity = client.get("/archive", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity.headers
@@ -0,0 +1,48 @@
+"""Unit tests for listing cursors."""
+
+import datetime
+
+import pytest
+
+from services.pagination import InvalidCursor, PageCursor, PostPage
+
+
+@pytest.mark.parametrize("direction", ["older", "newer"])
+@pytest.mark.parametrize("key_id", [5629499534213120, "été.2"])
+def test_page_cursor_round_trip(direction, key_id):
+    published = datetime.datetime(2024, 5, 17, 9, 30, 12, 345678, tzinfo=datetime.UTC)
+    cursor = PageCursor(published, direction, key_id)
+    token = cursor.encode()
+    assert "=" not in token
+    assert PageCursor.decode(token) == cursor
+
+
+def test_page_cursor_key_distinguishes_cursors():
+    published = datetime.datetime(2024, 5, 17, tzinfo=datetime.UTC)
+    assert PageCursor(published, "older", 1) != PageCursor(published, "older", 2)
+    assert PageCursor(published, "older", 1).encode() != PageCursor(published, "older", 2).encode()
+
+
+def test_page_cursor_naive_datetime_is_utc():
+    naive = PageCursor(datetime.datetime(2020, 1, 1), "older", 1)
+    aware = PageCursor(datetime.datetime(2020, 1, 1, tzinfo=datetime.UTC), "older", 1)
+    assert naive.encode() == aware.encode()
+
+
+@pytest.mark.parametrize(
+    "token",
+    # The last one has no key: "o123".
+    ["", "!!!", "eDEyMw", "bmFiYw", "été", "bzEyMy54MQ", "bzEyMy5p", "bzEyMw"],
+)
+def test_page_cursor_invalid_tokens(token):
+    with pytest.raises(InvalidCursor):
+        PageCursor.decode(token)
+
+
+def test_post_page_urls():
+    page = PostPage([], next_cursor="abc", prev_cursor="def")
+    assert page.next_url("/") == "/?cursor=abc"
+    assert page.prev_url("/tag/x") == "/tag/x?cursor=def"
+    assert PostPage([], prev_is_first=True).prev_url("/") == "/"
+    assert PostPage([]).prev_url("/") is None
+    assert PostPage([]).next_url("/") is None
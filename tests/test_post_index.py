@@ -0,0 +1,201 @@
+"""Unit tests for the in-memory post index."""
+
+import datetime
+
+from google.cloud import datastore
+
+from models.blog_post import BlogPost
+from services.post_index import IndexedPost, PostIndex
+
+UTC = datetime.UTC
+
+
+class FakeQuery:
+    def __init__(self, entities):
+        self.entities = entities
+        self.projection = []
+
+    def fetch(self):
+        for entity in self.entities:
+            projected = datastore.Entity(key=entity.key)
+            projected.update({name: entity.get(name) for name in self.projection})
+            yield projected
+
+
+class FakeClient:
+    """Just enough of datastore.Client to load the index."""
+
+    def __init__(self, entities):
+        self.entities = entities
+        self.read = []
+
+    def query(self, kind):
+        return FakeQuery(self.entities)
+
+    def get_multi(self, keys):
+        self.read += [key.id for key in keys]
+        by_key = {entity.key: entity for entity in self.entities}
+        return [by_key[key] for key in keys if key in by_key]
+
+
+def make_entity(post_id, published, slugs=(), path=None):
+    entity = datastore.Entity(key=datastore.Key("BlogPost", post_id, project="test"))
+    entity.update(
+        {
+            "title": f"Post {post_id}",
+            "body": "Body",
+            "published": published,
+            "path": path or f"/post-{post_id}",
+            "tags": list(slugs),
+            "slugs": list(slugs),
+        }
+    )
+    return entity
+
+
+def loaded_index():
+    index = PostIndex()
+    index.load(
+        FakeClient(
+            [
+                make_entity(1, datetime.datetime(2020, 1, 1, tzinfo=UTC), ["a"]),
+                make_entity(2, datetime.datetime(2022, 1, 1, tzinfo=UTC), ["a", "b"]),
+                make_entity(3, datetime.datetime(2021, 1, 1, tzinfo=UTC)),
+                # Draft (far future publication date) and post without a date.
+                make_entity(4, datetime.datetime(9999, 1, 1, tzinfo=UTC), ["a"]),
+                make_entity(5, None),
+            ]
+        )
+    )
+    return index
+
+
+def ids(posts):
+    return [post.key.id for post in posts]
+
+
+def test_post_index_published_listing():
+    index = loaded_index()
+    assert index.ready
+    assert len(index) == 5
+    assert ids(index.published()) == [2, 3, 1]
+    assert ids(index.published("a")) == [2, 1]
+    assert index.get_by_path("/post-3").key.id == 3
+    assert index.get_by_path("/missing") is None
+
+
+def test_post_index_apply_change():
+    index = loaded_index()
+    post = BlogPost(
+        key=datastore.Key("BlogPost", 6, project="test"),
+        title="New",
+        body="Body",
+        published=datetime.datetime(2023, 1, 1, tzinfo=UTC),
+        updated=None,
+        path="/new",
+        slugs=["b"],
+    )
+    index.apply_change(6, post)
+    assert ids(index.published()) == [6, 2, 3, 1]
+    assert ids(index.published("b")) == [6, 2]
+    assert index.get_by_path("/new").title == "New"
+    index.apply_change(2, None)
+    assert ids(index.published()) == [6, 3, 1]
+
+
+def test_post_index_not_ready_until_loaded():
+    index = PostIndex()
+    index.apply_change(1, None)
+    assert not index.ready
+    assert index.published() == []
+    assert index.get_by_path("/post-1") is None
+
+
+def test_indexed_post_tags_sorted_without_duplicates():
+    key = datastore.Key("BlogPost", 1, project="test")
+    post = IndexedPost(key, tags=["Genes", "Bayes", "Genes"], slugs=["genes", "bayes", "genes"])
+    # The order of a projection of the tags, whatever the source of the post.
+    assert post.tags == ["Bayes", "Genes"]
+    assert post.slugs == ["bayes", "genes"]
+
+
+def test_post_index_reload_reads_changed_posts_only():
+    index = PostIndex()
+    entities = [
+        make_entity(post_id, datetime.datetime(2020, 1, post_id, tzinfo=UTC))
+        for post_id in (1, 2, 3)
+    ]
+    client = FakeClient(entities)
+    assert index.load(client)
+    assert sorted(client.read) == [1, 2, 3]
+
+    client.read = []
+    entities[0]["title"] = "Edited"
+    entities[0]["updated"] = datetime.datetime(2024, 1, 1, tzinfo=UTC)
+    del entities[1]
+    entities.append(make_entity(4, datetime.datetime(2021, 1, 1, tzinfo=UTC)))
+    assert index.load(client)
+    assert sorted(client.read) == [1, 4]
+    assert ids(index.published()) == [4, 3, 1]
+    assert index.get_by_path("/post-1").title == "Edited"
+
+
+def test_post_index_reload_does_not_undo_concurrent_change():
+    index = loaded_index()
+
+    class RacingClient(FakeClient):
+        def query(self, kind):
+            # A post is deleted while the reload reads the (older) posts.
+            index.apply_change(1, None)
+            return super().query(kind)
+
+    assert not index.load(RacingClient([make_entity(1, datetime.datetime(2020, 1, 1))]))
+    assert ids(index.published()) == [2, 3]
+
+
+def test_post_index_neighbours():
+    index = loaded_index()
+    # Published posts, newest first: 2, 3, 1 (4 is a draft, 5 has no date).
+    assert ids(index.neighbours(3)) == [1, 2]
+    older, newer = index.neighbours(2)
+    assert older.key.id == 3 and newer is None
+    older, newer = index.neighbours(1)
+    assert older is None and newer.key.id == 3
+    assert index.neighbours(42) == (None, None)
+
+
+def test_post_index_pages():
+    index = loaded_index()
+    now = datetime.datetime(2030, 1, 1, tzinfo=UTC)
+    assert ids(index.page(now=now, limit=2)) == [2, 3]
+    assert ids(index.page(now=now, offset=2, limit=2)) == [1]
+    # The boundary is post 3.
+    boundary = {"boundary": datetime.datetime(2021, 1, 1, tzinfo=UTC), "boundary_id": 3}
+    assert ids(index.page(now=now, direction="older", **boundary)) == [1]
+    # Newer posts come oldest first, from the boundary.
+    assert ids(index.page(now=now, direction="newer", limit=1, **boundary)) == [2]
+    assert ids(index.page("a", now=now, direction="older", **boundary)) == [1]
+    assert index.page("missing", now=now) == []
+    assert index.count(now=now) == 3
+    assert index.count("a", now=now) == 2
+    # The draft of 9999 is published by then.
+    assert index.count("a", now=datetime.datetime(9999, 6, 1, tzinfo=UTC)) == 3
+
+
+def test_post_index_pages_break_ties_by_key():
+    # An import batch: posts published at the same time, listed by key, descending.
+    same = datetime.datetime(2021, 1, 1, tzinfo=UTC)
+    index = PostIndex()
+    index.load(FakeClient([make_entity(post_id, same) for post_id in (3, 1, 4, 2)]))
+    now = datetime.datetime(2030, 1, 1, tzinfo=UTC)
+    assert ids(index.page(now=now)) == [4, 3, 2, 1]
+    older = index.page(now=now, direction="older", boundary=same, boundary_id=3, limit=1)
+    assert ids(older) == [2]
+    newer = index.page(now=now, direction="newer", boundary=same, boundary_id=2, limit=5)
+    assert ids(newer) == [3, 4]
+
+
+def test_post_index_tag_counts():
+    index = loaded_index()
+    tags = index.tag_counts(now=datetime.datetime(2030, 1, 1, tzinfo=UTC))
+    assert [(tag.slug, tag.count, tag.size) for tag in tags] == [("a", 2, 5), ("b", 1, 1)]
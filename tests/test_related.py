@@ -0,0 +1,116 @@
+"""Unit tests for the related posts."""
+
+import datetime
+from collections import Counter
+from types import SimpleNamespace
+
+from google.cloud import datastore
+
+from models.blog_post import BlogPost
+from services.export import site_pages
+from services.related import RelatedPosts, rank_related
+
+UTC = datetime.UTC
+NOW = datetime.datetime(2024, 6, 1, tzinfo=UTC)
+
+SETTINGS = SimpleNamespace(
+    url_prefix="",
+    host="https://example.com",
+    date_format="%d %B %Y",
+    copyright_year=2024,
+    posts_per_page=10,
+    disqus_shortname="example",
+)
+
+
+def make_post(post_id, title, body, tags=(), days_ago=None):
+    published = NOW - datetime.timedelta(days=10 + post_id if days_ago is None else days_ago)
+    return BlogPost(
+        key=datastore.Key("BlogPost", post_id, project="test"),
+        title=title,
+        body=body,
+        published=published,
+        updated=published,
+        path=f"/2024/05/post-{post_id}",
+        tags=list(tags),
+        slugs=[tag.lower() for tag in tags],
+    )
+
+
+def make_posts():
+    return [
+        make_post(1, "Gene regulation", "Enhancers regulate genes in chromatin.", ["Biology"]),
+        make_post(2, "Chromatin loops", "Enhancers contact promoters in chromatin.", ["Biology"]),
+        make_post(3, "Bayes factors", "Priors, posteriors and evidence.", ["Math"]),
+        make_post(4, "Priors", "How to choose priors: evidence and posteriors.", ["Math"]),
+        make_post(5, "Cooking", "Bread and butter."),
+    ]
+
+
+def test_rank_related():
+    vectors = [Counter(a=2, b=1), Counter(a=1, c=1), Counter(d=1), Counter(b=1, a=1)]
+    tag_sets = [{"x"}, set(), {"y"}, {"x"}]
+    assert rank_related(vectors, tag_sets, 2) == [[3, 1], [0, 3], [], [0, 1]]
+    assert rank_related(vectors[:1], tag_sets[:1], 2) == [[]]
+
+
+def test_related_posts():
+    related = RelatedPosts(count=1)
+    assert not related.ready and related.get(1) == []
+    related.build(make_posts())
+    assert [post.key.id_or_name for post in related.get(1)] == [2]
+    assert [post.key.id_or_name for post in related.get(3)] == [4]
+    assert related.get(5) == []
+
+    # A draft (dated 9999, as the admin does) is only listed once published.
+    post = make_post(6, "Enhancers in chromatin", "Enhancers, genes, chromatin.", ["Biology"])
+    published = post.published
+    post.published = datetime.datetime(9999, 12, 31)
+    related.update(6, post)
+    assert [post.key.id_or_name for post in related.get(1)] == [2]
+    post.published = published
+    related.update(6, post)
+    assert [post.key.id_or_name for post in related.get(1)] == [6]
+    related.update(6, None)
+    related.update(2, None)
+    assert related.get(1) == []
+
+
+def test_site_pages_list_related_posts():
+    posts = sorted(make_posts(), key=lambda post: post.published, reverse=True)
+    related = RelatedPosts(count=2)
+    related.build(posts)
+    pages = {page.path: page for page in site_pages(posts, SETTINGS, related)}
+    assert [post.title for post in pages["/2024/05/post-3"].context["related"]] == ["Priors"]
+    pages = {page.path: page for page in site_pages(posts, SETTINGS)}
+    assert "related" not in pages["/2024/05/post-3"].context
+
+
+def test_related_posts_change_scores_one_post():
+    posts = make_posts()
+    related = RelatedPosts(count=2)
+    related.build(posts)
+    # Same terms, other frequencies: the IDF of the build still holds.
+    edited = make_post(
+        3, "Bayes factors", "Priors, posteriors and evidence. Evidence, evidence.", ["Math"]
+    )
+    related.update(3, edited)
+    rebuilt = RelatedPosts(count=2)
+    rebuilt.build([edited if post.key.id == 3 else post for post in posts])
+    for post in posts:
+        post_id = post.key.id
+        expected = [related_post.key.id for related_post in rebuilt.get(post_id)]
+        assert [related_post.key.id for related_post in related.get(post_id)] == expected
+
+
+def test_related_posts_readers_keep_their_snapshot():
+    related = RelatedPosts(count=2)
+    related.build(make_posts())
+    snapshot = related._snapshot
+    related.update(2, None)
+    # Changes publish a new snapshot: one being read is left as it was.
+    assert related._snapshot is not snapshot
+    assert [post.key.id for post in snapshot.related[1]] == [2]
+    assert related.get(1) == []
+    related.configure(3)
+    assert not related.ready and related.get(1) == []
@@ -0,0 +1,144 @@
+"""Unit tests for the post render cache."""
+
+import datetime
+
+import pytest
+
+from models.blog_post import BlogPost
+from services.render_cache import RenderCache, render_cache
+
+
+class Renderer:
+    """Callable returning a fixed string and counting its calls."""
+
+    def __init__(self, html: str = "<p>html</p>") -> None:
+        self.html = html
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        return self.html
+
+
+def test_render_cache_hit_skips_render():
+    cache = RenderCache(max_entries=4)
+    render = Renderer()
+    assert cache.get_or_render(1, "full", "body", "fp", render) == "<p>html</p>"
+    assert cache.get_or_render(1, "full", "body", "fp", render) == "<p>html</p>"
+    assert render.calls == 1
+
+
+@pytest.mark.parametrize(
+    "changed_args",
+    [
+        (2, "full", "body", "fp"),  # Other post.
+        (1, "summary", "body", "fp"),  # Other kind of rendering.
+        (1, "full", "edited body", "fp"),  # Edited body.
+        (1, "full", "body", "other fp"),  # Other Markdown configuration.
+    ],
+)
+def test_render_cache_key_components(changed_args):
+    cache = RenderCache(max_entries=4)
+    render = Renderer()
+    cache.get_or_render(1, "full", "body", "fp", render)
+    cache.get_or_render(*changed_args, render)
+    assert render.calls == 2
+
+
+def test_render_cache_lru_eviction():
+    cache = RenderCache(max_entries=2)
+    render = Renderer()
+    cache.get_or_render(1, "full", "a", "fp", render)
+    cache.get_or_render(2, "full", "b", "fp", render)
+    # Touch the first entry so that the second one is least recently used.
+    cache.get_or_render(1, "full", "a", "fp", render)
+    cache.get_or_render(3, "full", "c", "fp", render)
+    assert len(cache) == 2
+    cache.get_or_render(1, "full", "a", "fp", render)
+    assert render.calls == 3
+    cache.get_or_render(2, "full", "b", "fp", render)
+    assert render.calls == 4
+
+
+def test_render_cache_invalidate():
+    cache = RenderCache(max_entries=4)
+    render = Renderer()
+    cache.get_or_render(1, "full", "body", "fp", render)
+    cache.get_or_render(1, "summary", "body", "fp", render)
+    cache.get_or_render(2, "full", "body", "fp", render)
+    cache.invalidate(1)
+    assert len(cache) == 1
+    cache.get_or_render(1, "full", "body", "fp", render)
+    assert render.calls == 4
+
+
+def test_render_cache_disk_tier(tmp_path):
+    render = Renderer()
+    RenderCache(directory=str(tmp_path)).get_or_render(1, "full", "body", "fp", render)
+    # A fresh cache (e.g. after a restart) finds the rendering on disk.
+    html = RenderCache(directory=str(tmp_path)).get_or_render(1, "full", "body", "fp", render)
+    assert html == "<p>html</p>"
+    assert render.calls == 1
+
+
+def test_render_cache_disk_tier_invalidate(tmp_path):
+    render = Renderer()
+    RenderCache(directory=str(tmp_path)).get_or_render(1, "full", "body", "fp", render)
+    RenderCache(directory=str(tmp_path)).invalidate(1)
+    RenderCache(directory=str(tmp_path)).get_or_render(1, "full", "body", "fp", render)
+    assert render.calls == 2
+
+
+def test_blog_post_renderings_are_cached(monkeypatch):
+    render_cache.clear()
+    post = BlogPost(
+        key=None,
+        title="Title",
+        body="Some *text*.",
+        published=datetime.datetime(2020, 1, 1),
+        updated=datetime.datetime(2020, 1, 1),
+    )
+    assert post.rendered == "<p>Some <em>text</em>.</p>"
+    assert post.summary == "<p>Some <em>text</em>.</p>"
+
+    def fail():
+        raise AssertionError("Markdown should not run on a cache hit")
+
+    monkeypatch.setattr(post, "_render_full", fail)
+    monkeypatch.setattr(post, "_render_summary", fail)
+    assert post.rendered == "<p>Some <em>text</em>.</p>"
+    assert post.summary == "<p>Some <em>text</em>.</p>"
+
+
+def test_blog_post_prerender_stores_renderings():
+    post = BlogPost(
+        key=None,
+        title="Title",
+        body="Some *text* here.",
+        published=datetime.datetime(2020, 1, 1),
+        updated=datetime.datetime(2020, 1, 1),
+    )
+    post.prerender()
+    assert post.has_current_renderings
+    assert post.rendering_properties() == {
+        "rendered_html": "<p>Some <em>text</em> here.</p>",
+        "summary_html": "<p>Some <em>text</em> here.</p>",
+        "word_count": 3,
+        "render_digest": post.render_digest,
+    }
+
+
+def test_blog_post_serves_stored_renderings_for_current_body():
+    post = BlogPost(
+        key=None,
+        title="Title",
+        body="Body",
+        published=datetime.datetime(2020, 1, 1),
+        updated=datetime.datetime(2020, 1, 1),
+    )
+    post.prerender()
+    post.rendered_html = "<p>stored</p>"
+    assert post.rendered == "<p>stored</p>"
+    # Stored renderings of another body are ignored.
+    post.body = "Edited body"
+    assert post.rendered == "<p>Edited body</p>"
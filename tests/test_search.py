@@ -0,0 +1,92 @@
+"""Unit tests for the full-text search index."""
+
+import datetime
+
+from google.cloud import datastore
+
+from models.blog_post import BlogPost
+from services.search import SearchIndex, tokenize
+from utils import html_to_text
+
+UTC = datetime.UTC
+NOW = datetime.datetime(2024, 6, 1, tzinfo=UTC)
+
+
+def make_post(post_id, title, body, tags=(), days_ago=10):
+    published = NOW - datetime.timedelta(days=days_ago)
+    return BlogPost(
+        key=datastore.Key("BlogPost", post_id, project="test"),
+        title=title,
+        body=body,
+        published=published,
+        updated=published,
+        path=f"/2024/05/post-{post_id}",
+        tags=list(tags),
+        slugs=[tag.lower() for tag in tags],
+    )
+
+
+def make_posts():
+    return [
+        make_post(1, "Noisy genes", "Cells are *noisy*, and genes too.", ["Biology"]),
+        make_post(2, "Markov chains", "A chain of random events: the genes of probability."),
+        make_post(3, "Bayes", "Priors and posteriors, with a word on café culture.", ["Math"]),
+        make_post(4, "Future genes", "Not published yet: genes.", days_ago=-3),
+    ]
+
+
+def test_tokenize():
+    assert tokenize("The Café, and CAFE-au-lait!") == ["cafe", "cafe", "au", "lait"]
+    assert html_to_text("<p>Hi <b>there</b></p><script>x = 1</script>") == "Hi there"
+    # Inline tags do not split words; block-level tags do.
+    assert html_to_text("<b>B</b>ayesian gen<em>es</em>") == "Bayesian genes"
+    assert html_to_text("<ul><li>one</li><li>two</li></ul>end<br>line") == "one two end line"
+    assert (
+        html_to_text("<h2>Title</h2><p>Text</p><table><tr><td>a</td><td>b</td></tr></table>")
+        == "Title Text a b"
+    )
+
+
+def test_search_ranks_and_filters():
+    index = SearchIndex()
+    assert not index.ready and index.search("genes", now=NOW) == []
+    index.build(make_posts())
+    assert index.ready and len(index) == 4
+    # The title weighs more than the body; the future post is not found.
+    assert [hit.post_id for hit in index.search("genes", now=NOW)] == [1, 2]
+    assert [hit.post_id for hit in index.search("cafe", now=NOW)] == [3]
+    assert [hit.post_id for hit in index.search("biology noisy", now=NOW)] == [1]
+    assert index.search("the", now=NOW) == []
+    assert len(index.search("genes", now=NOW + datetime.timedelta(days=5))) == 3
+
+
+def test_update_and_reload(tmp_path):
+    path = tmp_path / "search.bin"
+    index = SearchIndex(path)
+    index.build(make_posts())
+    index.update(2, None)
+    assert [hit.post_id for hit in index.search("genes", now=NOW)] == [1]
+    index.update(1, make_post(1, "Renamed", "Nothing about the topic anymore."))
+    assert index.search("genes", now=NOW) == []
+    assert [hit.title for hit in index.search("renamed", now=NOW)] == ["Renamed"]
+    index.update(5, make_post(5, "Chains again", "Markov genes."))
+    assert [hit.post_id for hit in index.search("genes", now=NOW)] == [5]
+
+    reloaded = SearchIndex(path)
+    assert reloaded.load()
+    assert len(reloaded) == 4
+    assert {hit.post_id for hit in reloaded.search("cafe chains", now=NOW)} == {3, 5}
+
+    path.write_bytes(b"garbage")
+    assert not SearchIndex(path).load()
+
+
+def test_build_discarded_after_concurrent_change():
+    index = SearchIndex()
+    assert index.build(make_posts())
+    generation = index.generation
+    posts = make_posts()  # Read before the change below.
+    index.update(1, None)
+    assert not index.build(posts, generation)
+    assert 1 not in {hit.post_id for hit in index.search("genes", now=NOW)}
+    assert index.build(make_posts(), index.generation)
@@ -1,8 +1,9 @@
 """Unit tests for security helpers."""
 
 import pytest
+from fastapi import HTTPException
 
-from security import oauth_email_allowed
+from security import oauth_email_allowed, validate_image_blob_path
 
 
 @pytest.fixture(autouse=True)
@@ -24,3 +25,12 @@ def test_oauth_production_requires_allowlist(monkeypatch):
 
 def test_oauth_dev_allows_any_when_allowlist_empty(monkeypatch):
     assert oauth_email_allowed("any@gmail.com", "") is True
+
+
+def test_validate_image_variant_parameters():
+    validate_image_blob_path("figs/a.png", 640, "webp")
+    validate_image_blob_path("figs/a.png", None, "auto")
+    for width, image_format in ((641, None), (0, None), (None, "gif"), (None, "WEBP")):
+        with pytest.raises(HTTPException) as excinfo:
+            validate_image_blob_path("figs/a.png", width, image_format)
+        assert excinfo.value.status_code == 400
@@ -0,0 +1,71 @@
+"""Unit tests for the sitemap."""
+
+import datetime
+import xml.etree.ElementTree as ET
+
+from google.cloud import datastore
+
+from services.post_index import IndexedPost
+from services.sitemap import sitemap_documents, sitemap_urls
+
+UTC = datetime.UTC
+SITEMAP = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+BASE = "https://example.com/blog"
+
+
+def make_posts():
+    posts = []
+    for i in range(4):
+        published = datetime.datetime(2024, 1, 1 + i, tzinfo=UTC)
+        posts.append(
+            IndexedPost(
+                key=datastore.Key("BlogPost", i + 1, project="test"),
+                path=f"/2024/01/post-{i}",
+                published=published,
+                updated=published + datetime.timedelta(days=10) if i == 0 else None,
+                slugs=["odd" if i % 2 else "even", "r&d"],
+            )
+        )
+    return posts[::-1]  # Newest first.
+
+
+def locations(document: str) -> dict[str, str | None]:
+    root = ET.fromstring(document)
+    return {entry.findtext(f"{SITEMAP}loc"): entry.findtext(f"{SITEMAP}lastmod") for entry in root}
+
+
+def test_sitemap():
+    urls = sitemap_urls(make_posts(), BASE)
+    (document,) = sitemap_documents(urls, BASE)
+    assert ET.fromstring(document).tag == f"{SITEMAP}urlset"
+    assert locations(document) == {
+        f"{BASE}/": "2024-01-11T00:00:00Z",
+        f"{BASE}/archive": "2024-01-11T00:00:00Z",
+        f"{BASE}/tags": "2024-01-11T00:00:00Z",
+        f"{BASE}/bestof": None,
+        f"{BASE}/about": None,
+        f"{BASE}/tag/even": "2024-01-11T00:00:00Z",
+        f"{BASE}/tag/odd": "2024-01-04T00:00:00Z",
+        f"{BASE}/tag/r&d": "2024-01-11T00:00:00Z",
+        f"{BASE}/2024/01/post-3": "2024-01-04T00:00:00Z",
+        f"{BASE}/2024/01/post-2": "2024-01-03T00:00:00Z",
+        f"{BASE}/2024/01/post-1": "2024-01-02T00:00:00Z",
+        f"{BASE}/2024/01/post-0": "2024-01-11T00:00:00Z",
+    }
+    assert "r&amp;d" in document
+
+
+def test_sitemap_index():
+    urls = sitemap_urls(make_posts(), BASE)
+    documents = sitemap_documents(urls, BASE, max_urls=5)
+    assert len(documents) == 4
+    index = ET.fromstring(documents[0])
+    assert index.tag == f"{SITEMAP}sitemapindex"
+    assert locations(documents[0]) == {
+        f"{BASE}/sitemap-1.xml": "2024-01-11T00:00:00Z",
+        f"{BASE}/sitemap-2.xml": "2024-01-11T00:00:00Z",
+        f"{BASE}/sitemap-3.xml": "2024-01-11T00:00:00Z",
+    }
+    parts = [locations(document) for document in documents[1:]]
+    assert [len(part) for part in parts] == [5, 5, 2]
+    assert [loc for part in parts for loc in part] == [url.loc for url in urls]
@@ -0,0 +1,72 @@
+"""Unit tests for the fingerprinted static file URLs."""
+
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+
+from static_assets import (
+    IMMUTABLE,
+    FingerprintedStaticFiles,
+    StaticManifest,
+    fingerprinted_name,
+)
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    (tmp_path / "js").mkdir()
+    (tmp_path / "js" / "app.js").write_text("console.log(1);\n")
+    (tmp_path / "LICENSE").write_text("MIT\n")
+    return tmp_path
+
+
+def test_fingerprinted_name():
+    assert fingerprinted_name("js/app.js", "0123456789ab") == "js/app.0123456789ab.js"
+    assert fingerprinted_name("js/jquery.min.js", "0123456789ab") == "js/jquery.min.0123456789ab.js"
+    assert fingerprinted_name("LICENSE", "0123456789ab") == "LICENSE.0123456789ab"
+
+
+def test_manifest_urls(static_dir):
+    manifest = StaticManifest(static_dir)
+    url = manifest.url("js/app.js")
+    assert url.startswith("/static/js/app.") and url.endswith(".js")
+    assert manifest.url("/static/js/app.js") == url
+    assert manifest.original(url.removeprefix("/static/")) == "js/app.js"
+    # Unknown files keep their plain URL.
+    assert manifest.url("js/missing.js") == "/static/js/missing.js"
+
+    version = manifest.version
+    (static_dir / "js" / "app.js").write_text("console.log(2);\n")
+    manifest.reset()
+    assert manifest.url("js/app.js") != url
+    assert manifest.version != version
+
+
+def test_fingerprinted_static_files(static_dir):
+    manifest = StaticManifest(static_dir)
+    app = Starlette(
+        routes=[
+            Mount(
+                "/static",
+                app=FingerprintedStaticFiles(directory=static_dir, manifest=manifest),
+            )
+        ]
+    )
+    client = TestClient(app)
+    url = manifest.url("js/app.js")
+
+    response = client.get(url)
+    assert response.text == "console.log(1);\n"
+    assert response.headers["cache-control"] == IMMUTABLE
+    cached = client.get(url, headers={"If-None-Match": response.headers["etag"]})
+    assert cached.status_code == 304
+    assert cached.headers["cache-control"] == IMMUTABLE
+
+    # Plain names, and names with an outdated digest, are not immutable.
+    plain = client.get("/static/js/app.js")
+    assert plain.status_code == 200 and "cache-control" not in plain.headers
+    outdated = client.get("/static/js/app.000000000000.js")
+    assert outdated.text == "console.log(1);\n"
+    assert "cache-control" not in outdated.headers
+    assert client.get("/static/js/missing.000000000000.js").status_code == 404
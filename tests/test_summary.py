@@ -0,0 +1,67 @@
+"""Tests for the incremental summary rendering of blog posts."""
+
+import re
+
+import pytest
+
+from models.blog_post import SUMMARY_MAX_WORDS, BlogPost, markdown_pool, summary_chunks
+from tests.backup_posts import load_backup_posts
+from utils import HTMLWordTruncator
+
+
+def whole_body_summary(body: str) -> str:
+    """Reference implementation: convert the whole body, then truncate."""
+    html = markdown_pool.convert("summary", body)
+    truncator = HTMLWordTruncator(max_words=SUMMARY_MAX_WORDS, end="__TRUNCATION_MARKER_")
+    return re.sub(r"\s*__TRUNCATION_MARKER_", "...", truncator.process(html))
+
+
+def make_post(body: str) -> BlogPost:
+    return BlogPost(key=None, title="Title", body=body, published=None, updated=None)
+
+
+@pytest.mark.parametrize(
+    "body, expected_chunks",
+    [
+        ("one\n\ntwo", ["one", "two"]),
+        ("one\r\n\r\ntwo\r\n  \r\nthree", ["one", "two", "three"]),
+        # Lists, blockquotes and indented blocks may continue past blank lines.
+        ("* one\n\n* two\n\nthree", ["* one\n\n* two\n\nthree"]),
+        ("> one\n\n> two", ["> one\n\n> two"]),
+        ("one\n\n    code\n\n    more", ["one\n\n    code\n\n    more"]),
+        # Raw HTML is never split.
+        ("<div>\none\n\ntwo\n</div>\n\nthree", ["<div>\none\n\ntwo\n</div>\n\nthree"]),
+        # Reference definitions are repeated in every chunk.
+        (
+            "[a][1]\n\nb\n\n[1]: http://x.org",
+            [
+                "[a][1]\n\n[1]: http://x.org",
+                "b\n\n[1]: http://x.org",
+                "[1]: http://x.org\n\n[1]: http://x.org",
+            ],
+        ),
+    ],
+)
+def test_summary_chunks(body, expected_chunks):
+    assert list(summary_chunks(body)) == expected_chunks
+
+
+def test_summary_stops_converting_after_word_budget(monkeypatch):
+    body = "\n\n".join(f"Paragraph {i} " + "word " * 50 for i in range(20))
+    converted = []
+    with markdown_pool.converter("summary") as md:
+        original_convert = md.convert
+
+        def convert(text):
+            converted.append(text)
+            return original_convert(text)
+
+        monkeypatch.setattr(md, "convert", convert)
+    make_post(body)._render_summary()
+    # Paragraphs have 52 words: the word budget runs out in the fourth one.
+    assert len(converted) == 4
+
+
+@pytest.mark.parametrize("post", load_backup_posts(), ids=lambda post: str(post["id"]))
+def test_summary_matches_whole_body_truncation(post):
+    assert make_post(post["body"])._render_summary() == whole_body_summary(post["body"])
@@ -0,0 +1,97 @@
+"""Micro-benchmark of HTMLWordTruncator word counting on real post bodies."""
+
+import re
+import time
+from html.parser import HTMLParser
+
+import pytest
+
+from models.blog_post import markdown_pool
+from tests.backup_posts import load_backup_posts
+from utils import HTMLWordTruncator, StopStreaming
+
+
+class LegacyHTMLWordTruncator(HTMLWordTruncator):
+    """HTMLWordTruncator with the former split-based word counting."""
+
+    _splitter = re.compile(r"([\w-]+)")
+
+    def handle_data(self, data: str) -> None:
+        if self.max_words <= 0:
+            self.out.write(self.end)
+            raise StopStreaming()
+        parts = self._splitter.split(data)
+        word_tokens = [part for i, part in enumerate(parts) if i % 2 == 1 and part.strip()]
+        word_count = len(word_tokens)
+        if word_count <= self.max_words:
+            self.out.write(data)
+            self.max_words -= word_count
+            return
+        output_parts = []
+        words_taken = 0
+        for i, part in enumerate(parts):
+            output_parts.append(part)
+            if i % 2 == 1 and part.strip():
+                words_taken += 1
+                if words_taken == self.max_words:
+                    break
+        self.out.write("".join(output_parts))
+        self.out.write(self.end)
+        self.close_open_tags()
+        raise StopStreaming
+
+
+class TextNodeCollector(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=False)
+        self.nodes: list[str] = []
+
+    def handle_data(self, data: str) -> None:
+        self.nodes.append(data)
+
+
+@pytest.fixture(scope="module")
+def post_html() -> list[str]:
+    return [markdown_pool.convert("full", post["body"]) for post in load_backup_posts()]
+
+
+@pytest.fixture(scope="module")
+def text_nodes(post_html) -> list[str]:
+    collector = TextNodeCollector()
+    for html in post_html:
+        collector.feed(html)
+    return collector.nodes
+
+
+def best_time(func, repeat: int = 5) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def count_nodes(truncator_class, nodes: list[str]) -> None:
+    truncator = truncator_class()
+    truncator.begin()
+    for node in nodes:
+        truncator.handle_data(node)
+
+
+@pytest.mark.parametrize("max_words", [1, 10, 180, None])
+def test_truncator_matches_legacy_on_posts(post_html, max_words):
+    for html in post_html:
+        expected = LegacyHTMLWordTruncator(max_words=max_words).process(html)
+        assert HTMLWordTruncator(max_words=max_words).process(html) == expected
+
+
+@pytest.mark.slow
+def test_truncator_word_counting_timings(text_nodes, record_property):
+    # Reported only (see the JUnit XML report): wall-clock comparisons are not
+    # reliable enough on shared machines to fail a test.
+    legacy = best_time(lambda: count_nodes(LegacyHTMLWordTruncator, text_nodes))
+    current = best_time(lambda: count_nodes(HTMLWordTruncator, text_nodes))
+    record_property("text_nodes", len(text_nodes))
+    record_property("legacy_ms", round(legacy * 1000, 1))
+    record_property("current_ms", round(current * 1000, 1))
@@ -2,6 +2,7 @@ import re
 import unicodedata
 from html.parser import HTMLParser
 from io import StringIO
+from itertools import islice
 
 VOID: set[str] = {
     "area",
@@ -23,6 +24,10 @@ VOID: set[str] = {
 }
 
 
+# Words are sequences of word characters and hyphens (hyphenated words count once).
+_WORD_RE = re.compile(r"[\w-]+")
+
+
 class StopStreaming(Exception):
     """Exception used to interrupt HTML streaming."""
 
@@ -38,6 +43,7 @@ class HTMLStreamer(HTMLParser):
         super().__init__(convert_charrefs=False)
         self.out: StringIO = out if out is not None else StringIO()
         self.stack: list[str] = []
+        self.stopped: bool = False
 
     def handle_charref(self, name: str) -> None:
         self.out.write(f"&#{name};")
@@ -77,24 +83,50 @@ class HTMLStreamer(HTMLParser):
         for tag in reversed(self.stack):
             self.out.write(f"</{tag}>")
 
-    def process(self, html: str) -> str:
-        """Parse HTML and return as string.
+    def begin(self) -> None:
+        """Reset the parser and output before streaming a new document."""
+        self.reset()
+        self.stack.clear()
+        self.out = StringIO()
+        self.stopped = False
+
+    def stream(self, html: str) -> bool:
+        """Parse the next chunk of the document started with `begin`.
+
+        Feeding a document in chunks gives the same output as processing it
+        at once, so callers can produce the HTML lazily.
 
         Args:
-            html: HTML content to parse
+            html: Next chunk of HTML content
 
         Returns:
-            Processed HTML as string
+            False once streaming has been interrupted (later chunks are ignored)
         """
-        self.reset()
-        self.stack.clear()
-        self.out = StringIO()
+        if self.stopped:
+            return False
         try:
             self.feed(html)
         except StopStreaming:
-            pass
+            self.stopped = True
+        return not self.stopped
+
+    def getvalue(self) -> str:
+        """Return the output produced so far."""
         return self.out.getvalue()
 
+    def process(self, html: str) -> str:
+        """Parse HTML and return as string.
+
+        Args:
+            html: HTML content to parse
+
+        Returns:
+            Processed HTML as string
+        """
+        self.begin()
+        self.stream(html)
+        return self.getvalue()
+
 
 class HTMLWordTruncator(HTMLStreamer):
     r"""Truncates HTML content after specified number of words.
@@ -141,9 +173,6 @@ class HTMLWordTruncator(HTMLStreamer):
         super().__init__()
         self.max_words: float = float("inf") if max_words is None else max_words
         self.end: str = end
-        # Regex splits text into tokens: alternating non-word and word tokens
-        # Captures word tokens (sequences of word chars/hyphens) for counting.
-        self._splitter = re.compile(r"([\w-]+)")
 
     def handle_data(self, data: str) -> None:
         """Count words and truncate when exceeding limit.
@@ -154,17 +183,18 @@ class HTMLWordTruncator(HTMLStreamer):
         - Unicode characters
         - Words with apostrophes
         - Whitespace-only tokens
+
+        No intermediate token lists are built: words are counted by the regex
+        engine, and the truncation point is found by a lazy scan that stops at
+        the last word that fits.
         """
         # Check if word limit already reached
         if self.max_words <= 0:
             self.out.write(self.end)
             raise StopStreaming()
 
-        # Split data into tokens while preserving whitespace
-        parts = self._splitter.split(data)
-        # Extract only word tokens (non-whitespace)
-        word_tokens = [part for i, part in enumerate(parts) if i % 2 == 1 and part.strip()]
-        word_count = len(word_tokens)
+        # subn counts the words in C without building a list of tokens.
+        word_count = _WORD_RE.subn("", data)[1]
 
         # Case 1: Entire chunk fits within remaining word limit
         if word_count <= self.max_words:
@@ -172,19 +202,9 @@ class HTMLWordTruncator(HTMLStreamer):
             self.max_words -= word_count
             return
 
-        # Case 2: Need to truncate within this chunk
-        output_parts = []
-        words_taken = 0
-        for i, part in enumerate(parts):
-            output_parts.append(part)
-            # Only count non-whitespace tokens as words
-            if i % 2 == 1 and part.strip():
-                words_taken += 1
-                if words_taken == self.max_words:
-                    break
-
-        # Write truncated content
-        self.out.write("".join(output_parts))
+        # Case 2: Truncate after the last word that fits, scanning no further
+        last_word = next(islice(_WORD_RE.finditer(data), int(self.max_words) - 1, None))
+        self.out.write(data[: last_word.end()])
         self.out.write(self.end)
         self.close_open_tags()
         raise StopStreaming
@@ -207,6 +227,84 @@ class HTMLWordTruncator(HTMLStreamer):
         super().handle_starttag(tag, attrs)
 
 
+class HTMLWordCounter(HTMLParser):
+    """Counts words in the text nodes of an HTML document.
+
+    Words are counted the same way as in `HTMLWordTruncator`.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.count: int = 0
+
+    def handle_data(self, data: str) -> None:
+        self.count += _WORD_RE.subn("", data)[1]
+
+
+def count_html_words(html: str) -> int:
+    """Return the number of words in the text of an HTML document."""
+    counter = HTMLWordCounter()
+    counter.feed(html)
+    counter.close()
+    return counter.count
+
+
+class HTMLTextExtractor(HTMLParser):
+    """Collects the text nodes of an HTML document (not scripts and styles).
+
+    Block-level tags separate words; inline tags do not ("<b>B</b>ayes" is "Bayes").
+    """
+
+    SKIPPED = {"script", "style"}
+    BLOCKS = frozenset(
+        "address article aside blockquote br caption dd div dl dt figcaption figure footer "
+        "h1 h2 h3 h4 h5 h6 header hr li main nav ol p pre section table tbody td tfoot th "
+        "thead tr ul".split()
+    )
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.out: StringIO = StringIO()
+        self.skipping: int = 0
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if tag in self.SKIPPED:
+            self.skipping += 1
+        elif tag in self.BLOCKS:
+            self.out.write(" ")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in self.SKIPPED and self.skipping:
+            self.skipping -= 1
+        elif tag in self.BLOCKS:
+            self.out.write(" ")
+
+    def handle_data(self, data: str) -> None:
+        if not self.skipping:
+            self.out.write(data)
+
+
+def html_to_text(html: str) -> str:
+    """Return the text of an HTML document, with whitespace collapsed."""
+    extractor = HTMLTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return " ".join(extractor.out.getvalue().split())
+
+
+# href and src attributes with a root-relative URL (not protocol-relative: //host/...).
+_RELATIVE_URL_RE = re.compile(r"""((?<![\w-])(?:href|src)\s*=\s*)(["'])/(?!/)""", re.IGNORECASE)
+
+
+def absolutify_url(html: str, base_url: str) -> str:
+    """Make the root-relative links and sources of an HTML fragment absolute.
+
+    For HTML read outside the site (feeds): "/img/a.png" becomes
+    base_url + "/img/a.png".
+    """
+    return _RELATIVE_URL_RE.sub(lambda m: f"{m[1]}{m[2]}{base_url.rstrip('/')}/", html)
+
+
 def slugify(s: str) -> str:
     """Slugify a unicode string (replace non-letters and numbers with "-")."""
     s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode("ascii")